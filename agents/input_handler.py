@@ -1,5 +1,6 @@
 import json
 from typing import Dict, Callable
+from utils import json_repair, metrics
 from utils.prompts import InputValidationPrompts
 
 class InputHandler:
@@ -10,6 +11,7 @@ class InputHandler:
     def __init__(self, llm_call_function: Callable):
         self.call_model = llm_call_function
     
+    @metrics.observed
     def process_input(self, user_input: str) -> Dict:
         if not user_input or len(user_input.strip()) < 2:
             return {
@@ -21,11 +23,9 @@ class InputHandler:
         validation_prompt = InputValidationPrompts.validation_prompt(user_input)
         try:
             response = self.call_model(validation_prompt, max_tokens=300, temperature=0.1)
-            result = json.loads(response)
-            if not all(key in result for key in ["valid", "story_elements", "suggestion"]):
-                raise ValueError("Invalid response format")
-            return result
+            return json_repair.parse(response, "input")
         except (json.JSONDecodeError, ValueError, KeyError):
+            metrics.fallback()
             return {
                 "valid": False,
                 "story_elements": "",
@@ -1,67 +1,168 @@
 import json
-from typing import Dict, Callable
+from typing import Dict, Callable, List, Optional
+from utils import json_repair, metrics
+from utils.prompt_compiler import count_tokens
 from utils.prompts import JudgePrompts
 
 
 class JudgeSystem:
 
-    def __init__(self, llm_call_function: Callable):
+    def __init__(self, llm_call_function: Callable, with_questions: bool = False):
         self.call_model = llm_call_function
+        # ask for the child's follow-up questions in the same call; they come back
+        # as evaluation["questions"], empty unless the story passes
+        self.with_questions = with_questions
+        self.max_questions = 3
         self.pass_threshold = 5.0
+        self.dimensions = ["bedtime_readiness", "creative_spark", "story_quality", "age_readability"]
+        # evaluate_stories packs stories per call up to these limits; the combined
+        # questions aren't asked for in bulk, so bulk evaluations carry none
+        self.bulk_token_budget = 6000
+        self.bulk_max_stories = 8
+        self.bulk_output_tokens = 250
+        # judge calls made by evaluate_stories are requests + rejudged
+        self.bulk_stats = {"requests": 0, "stories": 0, "rejudged": 0}
         self.min_word_count = 500
         self.max_word_count = 800
         self.reading_speed = 125
 
+    @metrics.observed
     def evaluate_story(self, story: Dict) -> Dict:
         length_analysis = self._analyze_length(story)
 
         # ref to the prompt library at utils/prompts.py
-        evaluation_prompt = JudgePrompts.unified_evaluation_prompt(story)
+        if self.with_questions:
+            evaluation_prompt = JudgePrompts.evaluation_with_questions_prompt(story)
+            family, max_tokens = "judge_questions", 1200
+        else:
+            evaluation_prompt = JudgePrompts.unified_evaluation_prompt(story)
+            family, max_tokens = "judge", 1000
 
         try:
             response = self.call_model(
-                evaluation_prompt, max_tokens=1000, temperature=0.3
+                evaluation_prompt, max_tokens=max_tokens, temperature=0.3
             )
-            evaluation = json.loads(response)
-
-            if not evaluation.get("pass", False) and evaluation.get("scores") is None:
-                return {
-                    "pass": False,
-                    "safety_passed": False,
-                    "reason": evaluation.get("reason", "Safety concerns"),
-                    "scores": None,
-                    "overall": 0.0,
-                    "feedback": evaluation.get("reason", "Story failed safety check"),
-                    "improvement": evaluation.get("improvement", ""),
-                    "length_check": length_analysis,
-                }
-
-            scores = evaluation.get("scores", {})
-            overall = evaluation.get("overall", 0.0)
-
-            all_scores_pass = all(
-                scores.get(dim, 0) >= self.pass_threshold
-                for dim in [
-                    "bedtime_readiness",
-                    "creative_spark",
-                    "story_quality",
-                    "age_readability",
-                ]
+            evaluation = json_repair.parse(response, family)
+            return self._interpret(evaluation, length_analysis)
+
+        except (json.JSONDecodeError, ValueError, KeyError) as e:
+            print(f"Error parsing evaluation response: {e}")
+            metrics.fallback()
+            metrics.JUDGE_VERDICTS.labels(verdict="fallback").inc()
+            return self._fallback_evaluation(story, length_analysis)
+
+    @metrics.observed
+    def evaluate_stories(
+        self, stories: List[Dict], token_budget: Optional[int] = None, max_stories: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Judge several stories in as few calls as fit: stories are packed in
+        order into multi-story prompts of at most token_budget prompt tokens and
+        max_stories stories. Evaluations come back in the order given. A story
+        whose entry is missing or malformed, or whose batch reply failed, is
+        re-judged on its own with evaluate_story.
+        """
+        token_budget = token_budget or self.bulk_token_budget
+        max_stories = max_stories or self.bulk_max_stories
+        results: List[Optional[Dict]] = [None] * len(stories)
+
+        for batch in self._pack(stories, token_budget, max_stories):
+            self.bulk_stats["requests"] += 1
+            self.bulk_stats["stories"] += len(batch)
+            if len(batch) == 1:
+                results[batch[0]] = self.evaluate_story(stories[batch[0]])
+                continue
+
+            entries = self._judge_batch([stories[i] for i in batch])
+            for story_id, index in enumerate(batch, 1):
+                if story_id in entries:
+                    results[index] = self._interpret(entries[story_id], self._analyze_length(stories[index]))
+                else:
+                    self.bulk_stats["rejudged"] += 1
+                    results[index] = self.evaluate_story(stories[index])
+
+        return results
+
+    def _pack(self, stories: List[Dict], token_budget: int, max_stories: int) -> List[List[int]]:
+        """Greedy in order: a batch closes when the next story would go over either limit"""
+        # the rubric prefix is counted once, when the template is first used
+        overhead = JudgePrompts.MULTI_STORY_EVALUATION.prefix_tokens
+        batches, batch, used = [], [], overhead
+        for index, story in enumerate(stories):
+            cost = count_tokens(JudgePrompts.tagged_story(len(batch) + 1, story))
+            if batch and (used + cost > token_budget or len(batch) >= max_stories):
+                batches.append(batch)
+                batch, used = [], overhead
+            batch.append(index)
+            used += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _judge_batch(self, stories: List[Dict]) -> Dict[int, Dict]:
+        """Well-formed entries of one multi-story reply by story id (1-based); {} if the reply failed"""
+        try:
+            response = self.call_model(
+                JudgePrompts.multi_story_evaluation_prompt(stories),
+                max_tokens=self.bulk_output_tokens * len(stories),
+                temperature=0.3,
             )
+            entries = json_repair.parse(response, "judge_many")["evaluations"]
+        except (json.JSONDecodeError, ValueError, KeyError) as e:
+            print(f"Error parsing batch evaluation response: {e}")
+            return {}
+
+        judged = {}
+        for entry in entries:
+            try:
+                story_id = int(str(entry.get("id", "")).replace("Story", "").strip())
+                evaluation = json_repair.SCHEMAS["judge"].validate(entry)
+            except ValueError:
+                # the schema wants an unsafe verdict or all four scores; anything else is re-judged
+                continue
+            if 1 <= story_id <= len(stories):
+                judged.setdefault(story_id, evaluation)
+        return judged
 
+    def _interpret(self, evaluation: Dict, length_analysis: Dict) -> Dict:
+        """Turn one parsed judge reply into the evaluation the pipeline uses"""
+        if not evaluation.get("pass", False) and evaluation.get("scores") is None:
+            metrics.JUDGE_VERDICTS.labels(verdict="unsafe").inc()
             return {
-                "pass": evaluation.get("pass", False) and all_scores_pass,
-                "safety_passed": True,
-                "scores": scores,
-                "overall": evaluation.get("overall", 0.0),
-                "feedback": evaluation.get("feedback", ""),
+                "pass": False,
+                "safety_passed": False,
+                "reason": evaluation.get("reason", "Safety concerns"),
+                "scores": None,
+                "overall": 0.0,
+                "feedback": evaluation.get("reason", "Story failed safety check"),
                 "improvement": evaluation.get("improvement", ""),
                 "length_check": length_analysis,
+                **self._questions(False, evaluation),
             }
 
-        except (json.JSONDecodeError, ValueError, KeyError) as e:
-            print(f"Error parsing evaluation response: {e}")
-            return self._fallback_evaluation(story, length_analysis)
+        scores = evaluation.get("scores", {})
+
+        all_scores_pass = all(scores.get(dim, 0) >= self.pass_threshold for dim in self.dimensions)
+
+        passed = evaluation.get("pass", False) and all_scores_pass
+        metrics.JUDGE_VERDICTS.labels(verdict="pass" if passed else "fail").inc()
+        return {
+            "pass": passed,
+            "safety_passed": True,
+            "scores": scores,
+            "overall": evaluation.get("overall", 0.0),
+            "feedback": evaluation.get("feedback", ""),
+            "improvement": evaluation.get("improvement", ""),
+            "length_check": length_analysis,
+            **self._questions(passed, evaluation),
+        }
+
+    def _questions(self, passed: bool, evaluation: Dict) -> Dict:
+        """The questions field in combined mode; a failing story's questions are discarded"""
+        if not self.with_questions:
+            return {}
+        questions = evaluation.get("questions", []) if passed else []
+        return {"questions": questions[: self.max_questions]}
 
     def _analyze_length(self, story: Dict) -> Dict:
         story_text = story.get("story", "")
@@ -99,4 +200,5 @@ class JudgeSystem:
             "feedback": "Unable to evaluate - system fallback. Story needs manual review.",
             "improvement": "Story is excellent as is.",
             "length_check": length_analysis,
+            **self._questions(False, {}),
         }
@@ -1,5 +1,6 @@
 import json
 from typing import Dict, List, Callable
+from utils import json_repair, metrics
 from utils.prompts import QAPrompts
 
 
@@ -12,6 +13,7 @@ class QAAgent:
     def __init__(self, llm_call_function: Callable):
         self.call_model = llm_call_function
 
+    @metrics.observed
     def generate_question_opportunities(self, story: Dict) -> List[str]:
         """
         Generate 3 example questions that would be interesting for kids to ask
@@ -27,7 +29,7 @@ class QAAgent:
         question_prompt = QAPrompts.generate_questions_prompt(story)
         try:
             response = self.call_model(question_prompt, max_tokens=400, temperature=0.3)
-            result = json.loads(response)
+            result = json_repair.parse(response, "questions")
             questions = result.get("questions", [])
 
             # taking 3
@@ -40,6 +42,7 @@ class QAAgent:
         except (json.JSONDecodeError, ValueError, KeyError):
             return self._fallback_questions(story)
 
+    @metrics.observed
     def answer_question(self, question: str, story_context: Dict) -> str:
         """
         Answer a child's question about the story in an age-appropriate,
@@ -66,6 +69,7 @@ class QAAgent:
             return self._fallback_answer(question, story_context)
 
     def _fallback_questions(self, story: Dict) -> List[str]:
+        metrics.fallback()
         return [
             "What was your favorite part of the story?",
             "What do you think happened next?",
@@ -73,4 +77,5 @@ class QAAgent:
         ]
 
     def _fallback_answer(self, question: str, story_context: Dict) -> str:
+        metrics.fallback()
         return f"That's such a wonderful question! Based on our story, I think there could be many magical possibilities. What do you imagine the answer might be?"
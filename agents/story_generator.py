@@ -1,22 +1,37 @@
-import json
-from typing import Dict, Callable, Tuple
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Callable, List, Optional, Tuple
+from utils import json_repair, metrics
 from utils.prompts import StoryGenerationPrompts
 
 
 class StoryGenerator:
 
-    def __init__(self, llm_call_function: Callable):
-        self.call_model = llm_call_function
+    PATCH_ACTIONS = ["replace", "insert_after", "delete"]
+    # a reply refine_story can't use; timeouts, an exhausted budget and API errors reach the caller
+    REPLY_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+    # each variant asks for a different telling, so identical prompts are never coalesced
+    VARIANT_STYLES = [
+        "",
+        "Tell it with a gentle sense of humour.",
+        "Tell it with rich descriptions of sounds, colours and smells.",
+        "Tell it with plenty of playful dialogue between the characters.",
+        "Tell it as a slow, dreamy tale that drifts toward sleep.",
+    ]
 
-    def _clean_json(self, text: str) -> Dict:
-        text = text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
+    def __init__(self, llm_call_function: Callable, refine_mode: str = "patch", outline_cache=None, story_library=None):
+        self.call_model = llm_call_function
+        # "patch" asks for paragraph edits and falls back to "full" rewrites
+        self.refine_mode = refine_mode
+        self.refine_stats = {"patched": 0, "patch_failed": 0, "full": 0}
+        # optional OutlineCache; repeat themes then skip the outline call
+        self.outline_cache = outline_cache
+        # optional StoryLibrary; a failed story is replaced by a vetted one, evaluation included
+        self.story_library = story_library
 
-        text = text.replace(",]", "]").replace(",}", "}")
-        result = json.loads(text)
+    def _clean_json(self, text: str, family: str = "story") -> Dict:
+        """Parse (and if need be repair) the reply; stories without paragraph breaks get them"""
+        result = json_repair.parse(text, family)
 
         if isinstance(result, dict) and "story" in result:
             story = result["story"]
@@ -51,36 +66,194 @@ class StoryGenerator:
 
         return result
 
-    def generate_story(self, story_request: str) -> Tuple[Dict, Dict]:
-        try:
+    def get_outline(self, story_request: str) -> Dict:
+        """Outline for the request, from the outline cache when one is set"""
+        outline = self.outline_cache.get(story_request) if self.outline_cache is not None else None
+        if not outline:
             # ref to the prompt library at utils/prompts.py
             outline = self._clean_json(
                 self.call_model(
                     StoryGenerationPrompts.generate_outline_prompt(story_request),
                     max_tokens=1500,
                     temperature=0.7,
-                )
+                ),
+                "outline",
             )
-            
-            story = self._clean_json(
-                self.call_model(
-                    StoryGenerationPrompts.write_story_from_outline_prompt(outline),
-                    max_tokens=3000,
-                    temperature=0.7,
-                )
+            if self.outline_cache is not None:
+                self.outline_cache.put(story_request, outline)
+        return outline
+
+    def write_story(self, outline: Dict, variation: str = "") -> Dict:
+        return self._clean_json(
+            self.call_model(
+                StoryGenerationPrompts.write_story_from_outline_prompt(outline, variation),
+                max_tokens=3000,
+                temperature=0.7,
             )
+        )
+
+    @metrics.observed
+    def generate_story(self, story_request: str, outline: Dict = None) -> Tuple[Dict, Dict]:
+        """Outline the request, then write the story; pass an outline to reuse it and skip that call"""
+        try:
+            if not outline:
+                outline = self.get_outline(story_request)
+            story = self.write_story(outline)
 
             return story, outline
 
         except Exception as e:
+            from utils.story_library import failure_kind
+
             print(f"Error generating story: {e}")
+            metrics.fallback()
+            # a library story stands in for a model that's out of reach, not for a bug
+            served = self.serve_from_library(story_request, e) if failure_kind(e) != "error" else None
+            if served is not None:
+                return served, {}
             return {
                 "title": "A Magical Adventure",
                 "story": "Once upon a time, there was a curious young explorer who discovered a hidden forest full of wonders...",
                 "moral": "Every day holds the possibility of magic.",
             }, {}
 
+    def serve_from_library(self, story_request: str, error: Exception) -> Optional[Dict]:
+        """
+        The library story closest to the request, or None without a library.
+        It carries its judge result as "evaluation" (and any known questions
+        as "questions"), so it needs no judge call.
+        """
+        if self.story_library is None:
+            return None
+        from utils.story_library import failure_kind
+
+        match = self.story_library.match(story_request)
+        if match is None:
+            return None
+        metrics.LIBRARY_STORIES.labels(reason=failure_kind(error)).inc()
+        return {
+            "title": match["title"],
+            "story": match["story"],
+            "moral": match["moral"],
+            "evaluation": match["evaluation"],
+            "questions": match["questions"],
+        }
+
+    @metrics.observed
+    def generate_variants(self, story_request: str, count: int = 3, outline: Dict = None) -> Tuple[List[Dict], Dict]:
+        """
+        Write several stories from one outline in parallel. The first variant
+        uses the standard prompt; the rest ask for a different telling.
+        Variants that fail are left out.
+        """
+        if count < 1:
+            return [], outline or {}
+
+        try:
+            if not outline:
+                outline = self.get_outline(story_request)
+        except Exception as e:
+            print(f"Error generating outline: {e}")
+            return [], {}
+
+        variations = []
+        for i in range(count):
+            style = self.VARIANT_STYLES[i % len(self.VARIANT_STYLES)]
+            if i >= len(self.VARIANT_STYLES):
+                style = f"{style} This is telling number {i + 1}; make it different from the others.".strip()
+            variations.append(style)
+
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            # each call runs in a copy of the caller's context so an active Budget still applies
+            futures = [
+                pool.submit(contextvars.copy_context().run, self.write_story, outline, variation)
+                for variation in variations
+            ]
+
+        variants = []
+        for future in futures:
+            try:
+                variants.append(future.result())
+            except Exception as e:
+                print(f"Error writing story variant: {e}")
+        return variants, outline
+
+    def _paragraphs(self, text: str) -> List[str]:
+        return [p.strip() for p in text.split("\n\n") if p.strip()]
+
+    def _apply_edits(self, story: Dict, edits: List[Dict]) -> Dict:
+        """Apply paragraph edits against the original numbering, raising ValueError if any is invalid"""
+        paragraphs = self._paragraphs(story["story"])
+        count = len(paragraphs)
+
+        if not isinstance(edits, list) or not edits:
+            raise ValueError("No edits returned")
+        if len(edits) > count // 2 + 2:
+            raise ValueError(f"Too many edits ({len(edits)}) for a minor change")
+
+        targeted = set()
+        for edit in edits:
+            action = edit.get("action")
+            index = edit.get("paragraph")
+            text = edit.get("text", "")
+
+            if action not in self.PATCH_ACTIONS:
+                raise ValueError(f"Unknown edit action: {action}")
+            if not isinstance(index, int) or isinstance(index, bool):
+                raise ValueError(f"Paragraph number must be an integer: {index}")
+
+            lowest = 0 if action == "insert_after" else 1
+            if not lowest <= index <= count:
+                raise ValueError(f"Paragraph {index} out of range 1-{count}")
+            if action != "delete" and (not isinstance(text, str) or not text.strip()):
+                raise ValueError(f"Empty text for {action} on paragraph {index}")
+            if action != "insert_after":
+                if index in targeted:
+                    raise ValueError(f"Paragraph {index} edited twice")
+                targeted.add(index)
+
+        # bottom-up so edits don't shift the numbers of paragraphs still to be edited;
+        # at the same N the insert goes first so a delete of N can't move it
+        order = {"insert_after": 1, "replace": 0, "delete": 0}
+        for edit in sorted(edits, key=lambda e: (e["paragraph"], order[e["action"]]), reverse=True):
+            index = edit["paragraph"]
+            if edit["action"] == "replace":
+                paragraphs[index - 1] = edit["text"].strip()
+            elif edit["action"] == "delete":
+                del paragraphs[index - 1]
+            else:
+                paragraphs.insert(index, edit["text"].strip())
+
+        patched_text = "\n\n".join(paragraphs)
+        if len(patched_text.split()) < 0.8 * len(story["story"].split()):
+            raise ValueError("Edits removed too much of the story")
+
+        return {**story, "story": patched_text}
+
+    def _patch_story(self, story: Dict, improvement_suggestion: str) -> Dict:
+        response = self._clean_json(
+            self.call_model(
+                StoryGenerationPrompts.story_patch_prompt(story, improvement_suggestion),
+                max_tokens=800,
+                temperature=0.2,
+            ),
+            "patch",
+        )
+        return self._apply_edits(story, response.get("edits"))
+
+    @metrics.observed
     def refine_story(self, story: Dict, improvement_suggestion: str) -> Dict:
+        if self.refine_mode == "patch":
+            try:
+                patched = self._patch_story(story, improvement_suggestion)
+                self.refine_stats["patched"] += 1
+                return patched
+            except self.REPLY_ERRORS as e:
+                print(f"Patch refinement failed, rewriting story: {e}")
+                metrics.fallback()
+                self.refine_stats["patch_failed"] += 1
+
+        self.refine_stats["full"] += 1
         try:
             # ref to the prompt library at utils/prompts.py
             refined = self._clean_json(
@@ -96,7 +269,8 @@ class StoryGenerator:
             if all(key in refined for key in ["title", "story", "moral"]):
                 return refined
 
-        except Exception as e:
+        except self.REPLY_ERRORS as e:
             print(f"Error refining story: {e}")
 
+        metrics.fallback()
         return story
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Analytics benchmark: time every report statistic over a synthetic story index
+of N rows, and the resident memory it takes.
+
+The index is written directly (no story bodies), so multi-million row sizes
+take seconds to set up. Max RSS includes the index pages NumPy touched through
+the memory map (84 bytes per story); those are file-backed and reclaimable.
+
+Usage:
+    python -m benchmarks.bench_analytics [--sizes 10000 1000000 5000000]
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from utils.analytics import INDEX_DTYPE, StoryAnalytics
+from utils.story_store import (
+    INDEX_HEADER, INDEX_MAGIC, INDEX_VERSION, LIKED, PASSED, REFINE_ATTEMPTED, REFINE_KEPT, SAFETY_PASSED,
+    SCORE_DIMENSIONS, StoryStore,
+)
+
+
+def synthetic_rows(rng, first_id: int, count: int, started: float) -> np.ndarray:
+    rows = np.zeros(count, dtype=INDEX_DTYPE)
+    rows["id"] = np.arange(first_id, first_id + count)
+    rows["word_count"] = rng.integers(400, 900, count)
+    rows["initial_word_count"] = rows["word_count"]
+    rows["timestamp"] = started + np.sort(rng.uniform(0, 86400, count))
+    for dim in SCORE_DIMENSIONS:
+        rows[dim] = rng.integers(3, 11, count)
+        rows[f"initial_{dim}"] = rows[dim] - rng.integers(0, 2, count)
+    rows["overall"] = sum(rows[dim] for dim in SCORE_DIMENSIONS) / 4
+    rows["initial_overall"] = sum(rows[f"initial_{dim}"] for dim in SCORE_DIMENSIONS) / 4
+    rows["predicted_win_rate"] = np.nan
+    refined = rng.random(count) < 0.5
+    rows["flags"] = (SAFETY_PASSED
+                     | np.where(rows["overall"] >= 7, PASSED, 0)
+                     | np.where(rng.random(count) < rows["overall"] / 12, LIKED, 0)
+                     | np.where(refined, REFINE_ATTEMPTED, 0)
+                     | np.where(refined & (rows["overall"] > rows["initial_overall"]), REFINE_KEPT, 0))
+    return rows
+
+
+def write_index(directory: str, count: int, chunk: int = 100000):
+    """Write the index a chunk (one synthetic day) at a time so setup does not inflate RSS"""
+    rng = np.random.default_rng(0)
+    with open(os.path.join(directory, "stories.idx"), "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION))
+        for day, first in enumerate(range(0, count, chunk)):
+            synthetic_rows(rng, first + 1, min(chunk, count - first), 1.75e9 + day * 86400).tofile(f)
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench(sizes):
+    print(f"{'stories':>10}{'distributions':>15}{'trends':>10}{'likes':>10}{'refinement':>12}{'report html':>13}{'max RSS':>11}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            write_index(tmp, size)
+            analytics = StoryAnalytics.from_store(StoryStore(tmp))
+            timings = []
+            for method in (analytics.score_distributions, analytics.trends,
+                           analytics.like_correlation, analytics.refinement, analytics.render_html):
+                started = time.perf_counter()
+                method()
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"{size:>10}" + "".join(f"{t:>{w}.0f} ms" for t, w in zip(timings, (12, 7, 7, 9, 10)))
+                  + f"{max_rss_mb():>8.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 1000000, 5000000])
+    args = parser.parse_args()
+    bench(args.sizes)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Judge + questions benchmark: runs the recorded pipeline twice. The first run
+uses a judge call plus a separate questions call for each passing story (the
+default). The second run has the judge write the questions in the same call
+(BEANSTALK_COMBINED_JUDGE=1). Both go through main.create_story. Compares LLM
+calls and estimated tokens, plus the questions each path produced.
+
+Questions are scored with simple checks:
+- there are three of them
+- each one is a question
+- each is short enough for a child (at most 14 words)
+- each is about this story, sharing a content word with it
+
+The bundled cassette was seeded by hand and has no real latencies, so none
+are reported. Re-record it against the live API for real replies (see
+tests/recorded_model.py).
+
+Usage:
+    python -m benchmarks.bench_judge_questions
+"""
+
+import argparse
+import os
+import tempfile
+from typing import Dict, List
+
+from tests.recorded_model import recorded_model
+from tests.test_pipeline import build_agents, offered_questions, run_story
+from utils.budget import estimate_tokens
+from utils.json_repair import family_of
+from utils.search_index import tokenize
+from utils.story_tracker import StoryTracker
+
+REQUESTS = ["A story about a mouse who lives in a library", "dragon"]
+JUDGING = ("judge", "judge_questions", "questions")
+QUESTION_WORDS = frozenset("what why how does did when where which would could really ever again".split())
+MAX_QUESTION_WORDS = 14
+
+
+class MeteredCall:
+    """Replays the cassette, noting each call's family and tokens"""
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+        self.calls: List[Dict] = []
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        response = self.cassette(prompt, max_tokens=max_tokens, temperature=temperature, **kwargs)
+        self.calls.append({
+            "family": family_of(prompt) or "answer",
+            "prompt_tokens": estimate_tokens(prompt),
+            "output_tokens": estimate_tokens(response),
+        })
+        return response
+
+
+def question_quality(questions: List[str], story: Dict) -> Dict:
+    story_terms = set(tokenize(f"{story['title']} {story['content']} {story['moral']}"))
+
+    def grounded(question: str) -> bool:
+        terms = [t for t in tokenize(question) if len(t) >= 4 and t not in QUESTION_WORDS]
+        return any(t in story_terms for t in terms)
+
+    return {
+        "count": len(questions),
+        "questions": sum(q.strip().endswith("?") for q in questions),
+        "short": sum(len(q.split()) <= MAX_QUESTION_WORDS for q in questions),
+        "grounded": sum(grounded(q) for q in questions),
+    }
+
+
+def run(combined: bool) -> Dict:
+    model = MeteredCall(recorded_model("pipeline"))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "story_metrics.json"))
+        agents = build_agents(model, tracker, combined_judge=combined)
+        for request in REQUESTS:
+            # liked it, no question, Enter to continue
+            output = run_story(agents, tracker, [request, "Y", "", ""])
+            results.append({"questions": offered_questions(output)})
+        for result, saved in zip(results, tracker.iter_stories()):
+            result["story"] = saved["story"]
+        tracker.close()
+
+    judging = [c for c in model.calls if c["family"] in JUDGING]
+    quality = [question_quality(r["questions"], r["story"]) for r in results if r["questions"]]
+    return {
+        "calls": len(model.calls),
+        "judging_calls": len(judging),
+        "prompt_tokens": sum(c["prompt_tokens"] for c in judging),
+        "output_tokens": sum(c["output_tokens"] for c in judging),
+        "quality": {key: sum(q[key] for q in quality) for key in ("count", "questions", "short", "grounded")},
+        "results": results,
+    }
+
+
+def bench():
+    paths = {"two calls": run(False), "combined": run(True)}
+
+    print(f"Pipeline replay, {len(REQUESTS)} passing stories; judging = judge and questions calls")
+    print("two calls: judge, then questions for a passing story | combined: judge writes the questions\n")
+    print(f"{'path':<24}{'LLM calls':>10}{'judging':>9}{'prompt tok':>12}{'output tok':>12}")
+    for name, path in paths.items():
+        print(
+            f"{name:<24}{path['calls']:>10}{path['judging_calls']:>9}{path['prompt_tokens']:>12,}"
+            f"{path['output_tokens']:>12,}"
+        )
+
+    print(f"\n{'questions':<24}{'asked':>10}{'end in ?':>10}{'<=14 words':>12}{'on story':>10}")
+    for name, path in paths.items():
+        q = path["quality"]
+        print(f"{name:<24}{q['count']:>10}{q['questions']:>10}{q['short']:>12}{q['grounded']:>10}")
+
+    for i, request in enumerate(REQUESTS):
+        print(f"\n{request}")
+        for name, path in paths.items():
+            for question in path["results"][i]["questions"]:
+                print(f"  {name:<10}{question}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    bench()
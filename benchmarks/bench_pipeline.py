@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Offline pipeline benchmark: replays the recorded pipeline cassette through
+main.create_story and reports the local time the orchestration adds on top of
+the model calls.
+
+The bundled cassettes were seeded by hand, without upstream latencies, so this
+measures local overhead only. Re-record them against the live API (see
+tests/recorded_model.py) before drawing conclusions about end-to-end latency.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--runs 20]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from tests.recorded_model import recorded_model
+from tests.test_pipeline import build_agents, run_story
+from utils.story_tracker import StoryTracker
+
+# what a user types at each prompt of create_story
+SESSIONS = [
+    ["A story about a mouse who lives in a library", "Y", "", ""],
+    ["dragon", "Y", "", ""],
+    ["sdfdfgg"],
+]
+
+
+def bench(runs: int):
+    timings = []
+    for _ in range(runs):
+        # a fresh cassette and history per run so recordings play back from the start
+        call_model = recorded_model("pipeline")
+        with tempfile.TemporaryDirectory() as tmp:
+            tracker = StoryTracker(os.path.join(tmp, "story_metrics.json"))
+            agents = build_agents(call_model, tracker)
+            started = time.perf_counter()
+            for answers in SESSIONS:
+                run_story(agents, tracker, answers)
+            timings.append(time.perf_counter() - started)
+            tracker.close()
+
+    timings.sort()
+    print(f"Pipeline replay ({len(SESSIONS)} requests, {call_model.stats['hits']} LLM calls per run)")
+    print(f"  runs:            {runs}")
+    print(f"  median:          {timings[len(timings) // 2] * 1000:.1f} ms")
+    print(f"  p95:             {timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    bench(args.runs)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Search benchmark: query latency of the full-text story index at several
+history sizes, for rare, common and multi-word queries with and without filters.
+
+Postings are generated directly from a Zipf-distributed vocabulary (about 60
+distinct terms per story) on top of a synthetic story index, so no story
+bodies are written. Each timed query starts with an empty term-weight cache,
+so repeated queries are faster than shown.
+
+Usage:
+    python -m benchmarks.bench_search [--sizes 10000 100000 500000] [--runs 50]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_analytics import write_index
+from utils.search_index import SearchIndex
+from utils.story_store import StoryStore
+
+VOCABULARY = 20000
+QUERIES = {
+    "rare term": ("w15000", {}),
+    "common term": ("w3", {}),
+    "three terms": ("w3 w40 w900", {}),
+    "common + filters": ("w3", {"liked": True, "min_score": 7, "min_scores": {"creative_spark": 8}}),
+    "filters only": ("", {"liked": True, "min_score": 9}),
+}
+
+
+def build_index(directory: str, count: int) -> SearchIndex:
+    write_index(directory, count)
+    index = SearchIndex(StoryStore(directory))
+    index._loaded = True
+    rng = np.random.default_rng(0)
+    for position in range(count):
+        terms = np.unique(np.minimum(rng.zipf(1.3, 80), VOCABULARY))[:60]
+        index._add_terms(position, {f"w{term}": 1 + position % 3 for term in terms}, 600)
+    return index
+
+
+def bench(sizes, runs: int):
+    print(f"{'stories':>10}" + "".join(f"{name:>20}" for name in QUERIES) + "   (median ms)")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = build_index(tmp, size)
+            row = []
+            for query, filters in QUERIES.values():
+                timings = []
+                for _ in range(runs):
+                    index._weight_cache.clear()
+                    started = time.perf_counter()
+                    index.search(query, limit=10, **filters)
+                    timings.append((time.perf_counter() - started) * 1000)
+                row.append(np.median(timings))
+            print(f"{size:>10}" + "".join(f"{t:>20.2f}" for t in row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+    bench(args.sizes, args.runs)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Similarity benchmark: top-k cosine search latency over the request-vector
+matrix at several history sizes.
+
+Rows are random unit vectors written straight to the matrix file on top of a
+synthetic story index, so no story bodies are written.
+
+Usage:
+    python -m benchmarks.bench_similarity [--sizes 1000 10000 100000] [--runs 20]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_analytics import write_index
+from utils.similarity_index import DIMENSIONS, SimilarityIndex
+from utils.story_store import StoryStore
+
+
+def write_matrix(index: SimilarityIndex, count: int, chunk: int = 100000):
+    rng = np.random.default_rng(0)
+    with open(index.matrix_file, "wb") as f:
+        for start in range(0, count, chunk):
+            rows = rng.random((min(chunk, count - start), DIMENSIONS), dtype=np.float32)
+            rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+            f.write(rows.tobytes())
+
+
+def bench(sizes, runs: int):
+    print(f"{'stories':>10}{'top-3 search':>16}{'matrix size':>14}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            write_index(tmp, size)
+            index = SimilarityIndex(StoryStore(tmp))
+            write_matrix(index, size)
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                index.search("a dragon who loves books A story about a dragon who loves reading books")
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"{size:>10}{np.median(timings):>13.1f} ms{size * index.row_bytes / 2 ** 20:>11.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    bench(args.sizes, args.runs)
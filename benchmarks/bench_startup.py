@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: time from launching `python main.py` to the first menu, for
+several history sizes, plus the import cost of main.py itself.
+
+Each size gets a throwaway working directory with a synthetic story_metrics.json.
+The first launch imports it into the story store and builds the summary file;
+the "warm" column is what users see on every launch after that.
+
+Usage:
+    python -m benchmarks.bench_startup [--sizes 0 1000 20000] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+
+
+def write_history(path: str, count: int):
+    story = {"title": "Pip", "content": "Pip the mouse read a book. " * 100, "moral": "Read.", "word_count": 600}
+    evaluation = {"pass": True, "safety_passed": True, "reason": "", "overall": 7.5, "feedback": "",
+                  "scores": {"bedtime_readiness": 8, "creative_spark": 7, "story_quality": 7, "age_readability": 8},
+                  "length_check": {}}
+    records = [
+        {"id": i, "timestamp": "2025-08-04T16:31:38", "user_request": "a mouse", "user_liked": i % 2 == 0,
+         "story": story, "evaluation": evaluation}
+        for i in range(1, count + 1)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f, indent=2)
+
+
+def time_to_menu(workdir: str) -> float:
+    """Launch main.py, choose Exit, and time until the process is done"""
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, MAIN], input="4\n", cwd=workdir, capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - started
+
+
+def run_python(code: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+    return time.perf_counter() - started
+
+
+def bench(sizes, runs: int):
+    print(f"Interpreter start:      {min(run_python('pass') for _ in range(runs)) * 1000:.0f} ms")
+    print(f"import main:            {min(run_python('import main') for _ in range(runs)) * 1000:.0f} ms\n")
+    print(f"{'stories':>10}{'cold (first launch)':>22}{'warm':>10}")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            write_history(os.path.join(workdir, "story_metrics.json"), size)
+            cold = time_to_menu(workdir)
+            warm = min(time_to_menu(workdir) for _ in range(runs))
+            print(f"{size:>10}{cold * 1000:>19.0f} ms{warm * 1000:>7.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 1000, 20000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    bench(args.sizes, args.runs)
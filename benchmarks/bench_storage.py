@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Storage benchmark: disk footprint and load I/O of the story history as the
+old pretty-printed story_metrics.json, as store records with inline bodies,
+and as store records pointing into the compressed blob store.
+
+Uses the real stories in story_metrics.json and bedtime_stories_ds.jsonl.
+With --repeat, that fraction of stories is saved a second time, as when a
+pool or library story is served again.
+
+Usage:
+    python -m benchmarks.bench_storage [--repeat 0.25] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from utils.story_store import StoryStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def corpus(repeat: float):
+    with open(os.path.join(ROOT, "story_metrics.json"), encoding="utf-8") as f:
+        records = json.load(f)
+    template = records[0]
+    with open(os.path.join(ROOT, "bedtime_stories_ds.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            text = json.loads(line)["inputs"]["story"]
+            story = dict(template["story"], title=text.split(".")[0][:60], content=text, word_count=len(text.split()))
+            records.append(dict(template, story=story))
+
+    rng = random.Random(0)
+    records += [dict(record) for record in records if rng.random() < repeat]
+    for i, record in enumerate(records):
+        record["id"] = i + 1
+    return records
+
+
+def directory_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def timed(load, runs: int) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        load()
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def bench(repeat: float, runs: int):
+    records = corpus(repeat)
+    raw_text = sum(len(r["story"]["content"].encode("utf-8")) for r in records)
+    print(f"{len(records)} stories, {raw_text:,} bytes of story text\n")
+    print(f"{'layout':<26}{'on disk':>12}{'read to list':>14}{'read all':>12}{'load all':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file = os.path.join(tmp, "story_metrics.json")
+        with open(legacy_file, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=2)
+
+        def load_legacy():
+            with open(legacy_file, encoding="utf-8") as f:
+                return json.load(f)
+
+        size = os.path.getsize(legacy_file)
+        print(f"{'story_metrics.json':<26}{size:>12,}{size:>14,}{size:>12,}{timed(load_legacy, runs):>10.1f}ms")
+
+        inline = StoryStore(os.path.join(tmp, "inline"))
+        inline.store_bodies = dict
+        blobs = StoryStore(os.path.join(tmp, "blobs"))
+        for record in records:
+            inline.append(dict(record))
+            blobs.append(dict(record))
+
+        for name, store in (("store, inline bodies", inline), ("store + blob store", blobs)):
+            size = directory_size(store.directory)
+            listing = os.path.getsize(store.index_file)
+            bodies = os.path.getsize(store.blobs.pack_file) if os.path.exists(store.blobs.pack_file) else 0
+            read_all = os.path.getsize(store.records_file) + listing + bodies
+            load_ms = timed(lambda: list(store.iter_records()), runs)
+            print(f"{name:<26}{size:>12,}{listing:>14,}{read_all:>12,}{load_ms:>10.1f}ms")
+
+        stats = blobs.blobs.stats()
+        print(
+            f"\nblob store: {stats['blobs']} blobs, {stats['raw_bytes']:,} -> {stats['stored_bytes']:,} bytes "
+            f"({stats['raw_bytes'] / stats['stored_bytes']:.1f}x, {stats['codec']}, "
+            f"dictionary {stats['dictionary'] or 'none'})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark story history footprint and load I/O")
+    parser.add_argument("--repeat", type=float, default=0.25, help="Fraction of stories saved a second time")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    bench(args.repeat, args.runs)
+
+
+if __name__ == "__main__":
+    main()
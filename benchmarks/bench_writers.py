@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Concurrent writer benchmark: StoryTracker.add_story from several processes
+sharing one store, then an integrity check (ids unique and increasing, summary,
+search log and similarity rows in step with the index).
+
+With --tenants, writers are spread over that many tenant shards
+(utils/tenant_router.py), each with its own files and lock, so throughput
+should grow with the tenant count instead of queueing on one lock.
+
+Usage:
+    python -m benchmarks.bench_writers [--writers 1 4 8] [--stories 500] [--tenants 1 8]
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+from utils.tenant_router import TenantRouter
+
+EVALUATION = {
+    "pass": True, "safety_passed": True, "overall": 7.5,
+    "scores": {"bedtime_readiness": 8, "creative_spark": 7, "story_quality": 7, "age_readability": 8},
+}
+
+
+def tenant_of(writer: int, tenants: int) -> str:
+    return f"family-{writer % tenants}"
+
+
+def write_stories(storage_file: str, writer: int, count: int, tenant: str):
+    tracker = TenantRouter(storage_file).tracker(tenant)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(count):
+            tracker.add_story(
+                {"title": f"Story {writer}-{i}", "story": "The moon rose over the quiet hills. " * 60, "moral": "m"},
+                EVALUATION, user_request=f"a sleepy fox number {i} from writer {writer}",
+            )
+
+
+def check(storage_file: str, tenant: str, expected: int) -> bool:
+    tracker = TenantRouter(storage_file).tracker(tenant)
+    ids = [entry.id for entry in tracker.store.entries()]
+    return (
+        ids == list(range(1, expected + 1))
+        and tracker.summary() == tracker._summarize(tracker.store.entries())
+        and len(tracker.search_index) == expected
+        and len(tracker.similarity_index) == expected
+    )
+
+
+def bench(writer_counts, stories: int, tenant_counts):
+    print(f"{'tenants':>8}{'writers':>8}{'stories':>10}{'inserts/s':>12}{'intact':>8}")
+    for tenants in tenant_counts:
+        for writers in writer_counts:
+            run(writers, stories, tenants)
+
+
+def run(writers: int, stories: int, tenants: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage_file = os.path.join(tmp, "story_metrics.json")
+        per_writer = stories // writers
+        processes = [
+            multiprocessing.Process(target=write_stories, args=(storage_file, w, per_writer, tenant_of(w, tenants)))
+            for w in range(writers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        total = per_writer * writers
+        written = {}
+        for w in range(writers):
+            written[tenant_of(w, tenants)] = written.get(tenant_of(w, tenants), 0) + per_writer
+        intact = all(check(storage_file, tenant, count) for tenant, count in written.items())
+        print(f"{tenants:>8}{writers:>8}{total:>10}{total / elapsed:>12.0f}{'yes' if intact else 'NO':>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent StoryTracker writers")
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--stories", type=int, default=500, help="Total stories per run, split across writers")
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1],
+                        help="Tenant shards the writers are spread over (writer i writes to tenant i %% n)")
+    args = parser.parse_args()
+    bench(args.writers, args.stories, args.tenants)
+
+
+if __name__ == "__main__":
+    main()
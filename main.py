@@ -1,13 +1,33 @@
+import argparse
 import os
-import openai
-from dotenv import load_dotenv
-from agents.input_handler import InputHandler
-from agents.story_generator import StoryGenerator
-from agents.judge import JudgeSystem
-from agents.qa import QAAgent
-from utils.story_tracker import StoryTracker
+import time
+from utils import metrics, profiling
+from utils.tenant_router import DEFAULT_TENANT, TenantRouter
 
-load_dotenv()
+# openai, dotenv and the agents are imported on first use so the menu renders
+# straight away; see benchmarks/bench_startup.py
+_env_loaded = False
+
+
+def load_env():
+    """Load .env once, the first time a setting or the API key is needed"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _env_loaded = True
+
+
+def story_budget():
+    """Budget for one story, from idea to displayed story; refinement uses what's left"""
+    from utils.budget import Budget
+
+    load_env()
+    return Budget(
+        seconds=float(os.getenv("BEANSTALK_LATENCY_SLO", "90")),
+        tokens=int(os.getenv("BEANSTALK_TOKEN_BUDGET", "0")) or None,
+    )
 
 """
 Before submitting the assignment, describe here in a few sentences what you would have built next if you spent 2 more hours on this project:
@@ -19,18 +39,24 @@ With 2 additional hours, I would focus on three key areas:
 """
 
 
-def call_model(prompt: str, max_tokens=3000, temperature=0.7) -> str:
+def call_model(prompt: str, max_tokens=3000, temperature=0.7, timeout=None, model="gpt-3.5-turbo", endpoint=None) -> str:
+    import openai
+
+    load_env()
     openai.api_key = os.getenv("OPENAI_API_KEY")
 
     if not openai.api_key:
         print("\n No API key found")
         return '{"title": "NA", "story": "NA", "moral": "NA"}'
 
+    # endpoint, when a route sets one, is an OpenAI-compatible base URL
     resp = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
+        model=model,
         messages=[{"role": "user", "content": prompt}],
         max_tokens=max_tokens,
         temperature=temperature,
+        request_timeout=timeout,
+        **({"api_base": endpoint} if endpoint else {}),
     )
     return resp.choices[0].message["content"]
 
@@ -42,7 +68,8 @@ def show_menu():
     print("=" * 50)
     print("\n  📖  1. Create a new story")
     print("  📊  2. View story report")
-    print("  🌙  3. Exit\n")
+    print("  🔎  3. Search stories")
+    print("  🌙  4. Exit\n")
 
 
 def display_scores(evaluation):
@@ -64,11 +91,48 @@ def display_story(story):
     print(f"\n📚 {story['title']}")
     print("-" * 50)
     print(f"\n{story['story']}")
-    print(f"\n💫 {story['moral']}")
+    if story["moral"]:
+        print(f"\n💫 {story['moral']}")
     print("-" * 50)
 
 
-def create_story(input_handler, story_generator, judge_system, qa_agent, story_tracker):
+def ask_questions(qa_agent, story, qa_questions):
+    if qa_questions:
+        print("Here are some things you could ask:")
+        for i, q in enumerate(qa_questions[:3], 1):
+            print(f"  {i}. {q}")
+
+        print("\n(Ask a question or press Enter to skip)")
+
+        question = input("\n❓ ").strip()
+        if question:
+            with profiling.stage("create_story.answer"):
+                answer = qa_agent.answer_question(question, story)
+            print(f"\n💡 {answer}")
+
+
+def serve_library_story(story, qa_agent):
+    """Show a story from the fallback library with the evaluation it was stored with; no judge call"""
+    evaluation = story.pop("evaluation")
+    questions = story.pop("questions", [])
+    print("\n📚 Our storyteller is resting, so here's a favourite from the story library")
+    display_story(story)
+    display_scores(evaluation)
+    if questions:
+        print("\n💬 Got questions about the story?")
+        ask_questions(qa_agent, story, questions)
+    input("\nPress Enter to continue...")
+    return True
+
+
+def create_story(
+    input_handler,
+    story_generator,
+    judge_system,
+    qa_agent,
+    story_tracker,
+    refinement_loop,
+):
     print("\n📖 What story shall we create tonight?")
     print(
         "💡 Try: 'a girl named Luna and her best friend Max, who happens to be a dragon' or \n   'a boy named Pete who loves to play pickleball'"
@@ -81,39 +145,78 @@ def create_story(input_handler, story_generator, judge_system, qa_agent, story_t
 
     try:
         print("\n✨ Creating your story...")
-        processed = input_handler.process_input(user_input)
+        budget = story_budget()
 
-        if not processed["valid"]:
-            print(f"\n💭 {processed['suggestion']}")
-            return True
+        try:
+            with profiling.stage("create_story.input"), budget.activate():
+                processed = input_handler.process_input(user_input)
+        except Exception as e:
+            from utils.story_library import failure_kind
 
-        story, outline = story_generator.generate_story(processed["story_elements"])
-        initial_evaluation = judge_system.evaluate_story(story)
+            # the model is out of reach; a library story needs no validation or judging
+            served = story_generator.serve_from_library(user_input, e) if failure_kind(e) != "error" else None
+            if served is None:
+                raise
+            return serve_library_story(served, qa_agent)
 
-        if not initial_evaluation.get("safety_passed", True):
-            print("\nOops! Let's try a different story idea!")
-            print(f"   Reason: {initial_evaluation.get('reason', 'Safety concern')}")
+        if not processed["valid"]:
+            print(f"\n💭 {processed['suggestion']}")
             return True
 
-        improvement = initial_evaluation.get("improvement", "")
-        final_story = story
-        final_evaluation = initial_evaluation
-
-        if improvement and improvement.lower() not in [
-            "story is excellent as is.",
-            "no improvements needed.",
-            "",
-        ]:
-            print("Improving story...")
-            # print(improvement)
-            refined_story = story_generator.refine_story(story, improvement)
-            refined_evaluation = judge_system.evaluate_story(refined_story)
-
-            if refined_evaluation.get("overall", 0) > initial_evaluation.get(
-                "overall", 0
-            ):
-                final_story = refined_story
-                final_evaluation = refined_evaluation
+        # a near-repeat of an earlier passing story can skip most or all generation
+        from utils.similarity_index import DUPLICATE_THRESHOLD, OUTLINE_THRESHOLD
+
+        outline = None
+        with profiling.stage("create_story.similar"):
+            similar = story_tracker.find_similar(user_input, processed["story_elements"], k=1)
+        if similar and similar[0]["similarity"] >= DUPLICATE_THRESHOLD:
+            earlier = similar[0]
+            print(f"\n🔁 This sounds like \"{earlier['story']['title']}\" "
+                  f"(story #{earlier['id']}, {earlier['evaluation'].get('overall', 0)}/10)")
+            if input("➤ Read that one again instead of writing a new one? (Y/N): ").strip().upper() == "Y":
+                display_story({
+                    "title": earlier["story"]["title"],
+                    "story": earlier["story"]["content"],
+                    "moral": earlier["story"]["moral"],
+                })
+                display_scores(earlier["evaluation"])
+                input("\nPress Enter to continue...")
+                return True
+            # time spent deciding doesn't count against the SLO
+            budget = story_budget()
+        elif similar and similar[0]["similarity"] >= OUTLINE_THRESHOLD and similar[0].get("outline"):
+            earlier = similar[0]
+            print(f"\n♻️  This is close to \"{earlier['story']['title']}\" (story #{earlier['id']})")
+            if input("➤ Build the new story on that one's outline? (Y/N): ").strip().upper() == "Y":
+                outline = earlier["outline"]
+            budget = story_budget()
+
+        with profiling.stage("create_story.generate"), budget.activate():
+            story, outline = story_generator.generate_story(processed["story_elements"], outline)
+            if "evaluation" in story:
+                # served from the fallback library, judged already
+                return serve_library_story(story, qa_agent)
+            try:
+                initial_evaluation = judge_system.evaluate_story(story)
+            except Exception as e:
+                from utils.story_library import failure_kind
+
+                # the story was written but can't be judged in time; serve one judged already
+                served = story_generator.serve_from_library(user_input, e) if failure_kind(e) != "error" else None
+                if served is None:
+                    raise
+                return serve_library_story(served, qa_agent)
+
+            if not initial_evaluation.get("safety_passed", True):
+                print("\nOops! Let's try a different story idea!")
+                print(f"   Reason: {initial_evaluation.get('reason', 'Safety concern')}")
+                return True
+
+            # spare time before the SLO goes to refine/judge rounds
+            refinement = refinement_loop.run(story, initial_evaluation, budget)
+
+        final_story = refinement["story"]
+        final_evaluation = refinement["evaluation"]
 
         display_story(final_story)
         display_scores(final_evaluation)
@@ -126,28 +229,24 @@ def create_story(input_handler, story_generator, judge_system, qa_agent, story_t
                 user_liked = feedback == "Y"
                 break
 
-        story_tracker.add_story(
-            story=final_story,
-            evaluation=final_evaluation,
-            user_request=user_input,
-            user_liked=user_liked,
-        )
+        with profiling.stage("create_story.save"):
+            story_tracker.add_story(
+                story=final_story,
+                evaluation=final_evaluation,
+                user_request=user_input,
+                user_liked=user_liked,
+                refinement=refinement,
+                story_elements=processed["story_elements"],
+                outline=outline,
+            )
 
         if final_evaluation.get("pass", False):
             print("\n💬 Got questions about the story?")
-            qa_questions = qa_agent.generate_question_opportunities(final_story)
-
-            if qa_questions:
-                print("Here are some things you could ask:")
-                for i, q in enumerate(qa_questions[:3], 1):
-                    print(f"  {i}. {q}")
+            with profiling.stage("create_story.questions"):
+                # in combined mode the judge already wrote them
+                qa_questions = final_evaluation.get("questions") or qa_agent.generate_question_opportunities(final_story)
 
-                print("\n(Ask a question or press Enter to skip)")
-
-                question = input("\n❓ ").strip()
-                if question:
-                    answer = qa_agent.answer_question(question, final_story)
-                    print(f"\n💡 {answer}")
+            ask_questions(qa_agent, final_story, qa_questions)
 
         input("\nPress Enter to continue...")
         return True
@@ -157,13 +256,92 @@ def create_story(input_handler, story_generator, judge_system, qa_agent, story_t
         return True
 
 
-def main():
-    input_handler = InputHandler(call_model)
-    story_generator = StoryGenerator(call_model)
-    judge_system = JudgeSystem(call_model)
-    qa_agent = QAAgent(call_model)
-    story_tracker = StoryTracker()
-
+def search_stories(story_tracker):
+    from utils.search_index import parse_query
+
+    print("\n🔎 Search titles, stories, morals and requests")
+    print("   Filters: liked:yes  passed:no  score>=7  creative>=8  since:2025-08-01  until:2025-08-31")
+    query = input("\n➤ Search: ").strip()
+    if not query:
+        return
+
+    keywords, filters = parse_query(query)
+    started = time.perf_counter()
+    with profiling.stage("search"):
+        hits = story_tracker.search(keywords, limit=10, **filters)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    if not hits:
+        print(f"\n-> No stories match ({elapsed:.1f} ms)")
+    else:
+        print(f"\n-> {len(hits)} best matches ({elapsed:.1f} ms):\n")
+        for story in hits:
+            liked = "👍" if story.get("user_liked") else "  "
+            date = story["timestamp"][:10]
+            print(f"  {liked} #{story['id']:<5} {story['story']['title'][:40]:<40} "
+                  f"{story['evaluation'].get('overall', 0)}/10  {date}")
+
+        if input("\n➤ Save these as a report page? (Y/N): ").strip().upper() == "Y":
+            # beside the tenant's stories, so daemon sessions don't overwrite each other's reports
+            report = os.path.abspath(os.path.join(story_tracker.data_dir, "search_report.html"))
+            with profiling.stage("search.report"):
+                story_tracker.generate_search_report(query, hits, report)
+            print(f"\n-> Results saved as '{report}'")
+    input("\nPress Enter to continue...")
+
+
+def build_llm():
+    """The model call every agent shares; the daemon builds one for all tenants"""
+    from utils.single_flight import SingleFlight
+    from utils.budget import BudgetedCall
+    from utils.model_router import ModelRouter
+
+    load_env()
+    # identical in-flight prompts share one upstream call; the active story
+    # budget sets each call's timeout and max_tokens; calls are counted and timed per agent method;
+    # each agent method's calls go to the model its route picks (see utils/model_router.py)
+    return metrics.InstrumentedCall(BudgetedCall(SingleFlight(ModelRouter.from_env(call_model))))
+
+
+def build_agents(story_tracker, llm=None):
+    """Import and wire up the agents; deferred until the first story is requested"""
+    from agents.input_handler import InputHandler
+    from agents.story_generator import StoryGenerator
+    from agents.judge import JudgeSystem
+    from agents.qa import QAAgent
+    from utils.refinement_policy import RefinementPolicy
+    from utils.refinement_loop import RefinementLoop
+    from utils.outline_cache import OutlineCache
+    from utils.story_library import LIBRARY_FILE, StoryLibrary
+
+    if llm is None:
+        llm = build_llm()
+    # built from the history and the dataset the first time; rebuild with python -m utils.story_library build
+    story_library = StoryLibrary.open(os.path.join(story_tracker.data_dir, LIBRARY_FILE), story_tracker)
+    story_generator = StoryGenerator(
+        llm,
+        outline_cache=OutlineCache(os.path.join(story_tracker.data_dir, "outlines.jsonl")),
+        story_library=story_library,
+    )
+    judge_system = JudgeSystem(llm, with_questions=os.getenv("BEANSTALK_COMBINED_JUDGE", "0") == "1")
+    refinement_policy = RefinementPolicy().fit(story_tracker.refinement_history())
+
+    return {
+        "input_handler": InputHandler(llm),
+        "story_generator": story_generator,
+        "judge_system": judge_system,
+        "qa_agent": QAAgent(llm),
+        "refinement_loop": RefinementLoop(
+            story_generator,
+            judge_system,
+            refinement_policy,
+            target_score=float(os.getenv("BEANSTALK_TARGET_SCORE", "8.0")),
+        ),
+    }
+
+
+def run_menu(story_tracker, agents=None):
+    """The menu loop for one user; agents are built before the first story unless warm ones are passed in"""
     while True:
         show_menu()
 
@@ -174,26 +352,152 @@ def main():
         choice = input("\n➤ Choose: ").strip()
 
         if choice == "1":
-            create_story(
-                input_handler, story_generator, judge_system, qa_agent, story_tracker
-            )
+            if agents is None:
+                with profiling.stage("build_agents"):
+                    agents = build_agents(story_tracker)
+            create_story(story_tracker=story_tracker, **agents)
 
         elif choice == "2":
             if stats["total"] == 0:
                 print("\n->  No stories yet! Create one first.")
             else:
-                story_tracker.generate_html_report()
-                print("\n-> Report saved as 'story_report.html'")
+                report = os.path.abspath(os.path.join(story_tracker.data_dir, "story_report.html"))
+                with profiling.stage("report"):
+                    story_tracker.generate_html_report(report)
+                print(f"\n-> Report saved as '{report}'")
                 print("   Open it in your browser to see your stories!")
             input("\nPress Enter to continue...")
 
         elif choice == "3":
+            if stats["total"] == 0:
+                print("\n->  No stories yet! Create one first.")
+                input("\nPress Enter to continue...")
+            else:
+                search_stories(story_tracker)
+
+        elif choice == "4":
             print("\n🌙 Sweet dreams!")
             print("   Thanks for using Beanstalk AI")
             break
 
         else:
-            print("\n Just type 1, 2, or 3")
+            print("\n Just type 1, 2, 3, or 4")
+
+
+def warm_connections():
+    """One pooled HTTPS session for every thread, connected to the API before the first story needs it"""
+    import threading
+
+    import openai
+    import requests
+
+    load_env()
+    openai.requestssession = requests.Session()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    if not openai.api_key:
+        return
+
+    def connect():
+        try:
+            # free and small; leaves a TLS connection in the pool
+            openai.Model.list(request_timeout=10)
+        except Exception as e:
+            print(f"Couldn't reach the API yet: {e}")
+
+    threading.Thread(target=connect, daemon=True).start()
+
+
+def serve_daemon():
+    """Serve the menu to main.py clients with agents, shards and connections kept warm (see utils/daemon.py)"""
+    import threading
+    from collections import OrderedDict
+    from utils.daemon import StoryDaemon
+
+    router = TenantRouter()
+    # one model stack for every tenant: identical prompts coalesce across
+    # sessions and route health is learned once, whichever tenants come and go
+    llm = build_llm()
+    warm = OrderedDict()
+    building = {}
+    lock = threading.Lock()
+
+    def agents_for(tenant, story_tracker):
+        with lock:
+            tenant_lock = building.setdefault(tenant, threading.Lock())
+        # a tenant's first build reads its history and library; only its own sessions wait for it
+        with tenant_lock:
+            with lock:
+                agents = warm.get(tenant)
+            if agents is None:
+                agents = build_agents(story_tracker, llm)
+            with lock:
+                warm[tenant] = agents
+                warm.move_to_end(tenant)
+                # one set per open shard
+                while len(warm) > router.max_open:
+                    evicted, _ = warm.popitem(last=False)
+                    building.pop(evicted, None)
+                    metrics.untrack(evicted)
+                # every warm tenant's totals are exported; a shard reopened since has a new tracker
+                metrics.track(story_tracker, tenant)
+        return agents
+
+    def warm_tenants():
+        with lock:
+            return ", ".join(warm)
+
+    def run_session(hello):
+        tenant = hello.get("tenant") or DEFAULT_TENANT
+        # a client's --profile applies to the stages of its own session
+        profiler = profiling.new_profiler(hello["profile"]) if hello.get("profile") else profiling.get_profiler()
+        if hello.get("profile"):
+            print(f"📊 Profiling this session into {os.path.abspath(profiler.session_dir)}")
+        # the shard stays open for the whole session, however many other tenants connect meanwhile
+        with profiling.using(profiler), router.using(tenant) as story_tracker:
+            run_menu(story_tracker, agents_for(tenant, story_tracker))
+
+    warm_connections()
+    with router.using(DEFAULT_TENANT) as story_tracker:
+        agents_for(DEFAULT_TENANT, story_tracker)
+        story_tracker.similarity_index.sync()
+    metrics.start_from_env()
+
+    daemon = StoryDaemon(run_session, status=lambda: {"tenants": warm_tenants()})
+    print(f"🌱 Beanstalk daemon serving {daemon.path} (Ctrl+C to stop)")
+    daemon.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Beanstalk AI: bedtime stories for kids 5-10")
+    profiling.add_profile_argument(parser)
+    parser.add_argument(
+        "--tenant",
+        default=os.getenv("BEANSTALK_TENANT", DEFAULT_TENANT),
+        help="Family or user whose story history to use (default: the shared single-user history)",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--daemon", action="store_true", help="Keep agents and history warm for later launches")
+    mode.add_argument("--in-process", action="store_true", help="Don't use a running daemon")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.configure(args.profile)
+
+    if args.daemon:
+        serve_daemon()
+        return
+    if not args.in_process:
+        from utils.daemon import run_client
+
+        # a running daemon has everything loaded already; the menu runs there
+        if run_client({"tenant": args.tenant, "profile": args.profile}):
+            return
+
+    # each tenant's history is its own shard (see utils/tenant_router.py);
+    # only its small summary file is read until a story or report needs the history
+    story_tracker = TenantRouter().tracker(args.tenant)
+    metrics.track(story_tracker, args.tenant)
+    metrics.start_from_env()
+    run_menu(story_tracker)
 
 
 if __name__ == "__main__":
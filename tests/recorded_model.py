@@ -0,0 +1,23 @@
+"""
+Recorded LLM responses for the test suite and benchmarks.
+
+Tests replay tests/cassettes/<name>.jsonl.gz offline. To re-record against the
+live API after changing a prompt, delete the cassette and run the tests with
+BEANSTALK_RECORD=1 and OPENAI_API_KEY set.
+"""
+
+import os
+from utils.cassette import Cassette
+
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes")
+
+
+def recorded_model(name: str, replay_latency: bool = False) -> Cassette:
+    path = os.path.join(CASSETTE_DIR, f"{name}.jsonl.gz")
+
+    if os.getenv("BEANSTALK_RECORD"):
+        from main import call_model
+
+        return Cassette(path, call_model, mode="auto")
+
+    return Cassette(path, mode="replay", replay_latency=replay_latency)
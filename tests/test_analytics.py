@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Test script for vectorized story analytics over the StoryStore index
+"""
+
+import os
+import tempfile
+from utils.analytics import StoryAnalytics
+from utils.story_tracker import StoryTracker
+
+
+def evaluation(overall, safe=True):
+    return {
+        "pass": safe and overall >= 7, "safety_passed": safe, "reason": "", "overall": overall, "feedback": "",
+        "scores": {"bedtime_readiness": overall, "creative_spark": overall - 1, "story_quality": overall,
+                   "age_readability": overall + 1},
+        "length_check": {},
+    }
+
+
+def test_analytics_match_the_records():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "metrics.json"))
+        story = {"title": "Pip", "story": "word " * 500, "moral": "Be kind."}
+        for overall, liked in [(4.0, False), (6.0, False), (8.0, True), (9.0, True)]:
+            tracker.add_story(story, evaluation(overall), user_liked=liked)
+        tracker.add_story(story, evaluation(0.0, safe=False))
+        tracker.add_story(story, evaluation(7.0), refinement={"initial_evaluation": evaluation(6.0), "rounds": 1})
+
+        analytics = tracker.analytics()
+        assert len(analytics) == 6
+
+        distributions = analytics.score_distributions()
+        # the safety failure has no scores and is left out
+        assert sum(distributions["overall"]["histogram"]) == 5
+        assert distributions["overall"]["histogram"][8] == 1
+        assert distributions["overall"]["mean"] == round((4 + 6 + 8 + 9 + 7) / 5, 2)
+        assert distributions["creative_spark"]["mean"] == round((3 + 5 + 7 + 8 + 6) / 5, 2)
+
+        likes = analytics.like_correlation()
+        assert likes["correlation"]["overall"] > 0.5
+        assert likes["like_rate_by_score"][8] == 100.0 and likes["like_rate_by_score"][4] == 0.0
+
+        trends = analytics.trends(period="day")
+        assert len(trends) == 1 and trends[0]["stories"] == 6
+        assert trends[0]["pass_rate"] == round(3 / 6 * 100, 1)
+
+        refinement = analytics.refinement()
+        assert refinement == tracker.get_refinement_stats()
+        assert refinement["attempted"] == 1 and refinement["win_rate"] == 100.0 and refinement["average_gain"] == 1.0
+
+        assert "Analytics" in analytics.render_html()
+        assert StoryAnalytics(analytics.index[:0]).render_html() == ""
+
+
+if __name__ == "__main__":
+    test_analytics_match_the_records()
+    print("✨ Analytics test complete!")
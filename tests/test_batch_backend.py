@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for the batch execution backend (BatchRunner + LocalBatchProcessor)
+"""
+
+import json
+import os
+import tempfile
+import threading
+from agents.judge import JudgeSystem
+from agents.story_generator import StoryGenerator
+from utils.batch_backend import BatchRequestFailed, BatchRunner, LocalBatchProcessor, OpenAIBatchBackend
+
+STORY_TEXT = " ".join(["The owl hummed softly to the sleepy moon."] * 70)
+
+
+def scripted_model(prompt, max_tokens=3000, temperature=0.7, **kwargs):
+    if "generate an outline" in prompt:
+        theme = prompt.split("You are given this - ")[1].split(".")[0]
+        return json.dumps({"outline": f"Outline for {theme}", "characters": "Owl", "instruction": "Calm."})
+    if "expert evaluator" in prompt:
+        return json.dumps({
+            "pass": True, "overall": 8, "feedback": "Lovely.", "improvement": "None needed.",
+            "scores": {"bedtime_readiness": 8, "creative_spark": 8, "story_quality": 8, "age_readability": 8},
+        })
+    if "fail me" in prompt:
+        raise RuntimeError("upstream exploded")
+    outline = prompt.split("Outline - ")[1].split(",")[0]
+    return json.dumps({"title": outline.replace("Outline for ", "").title(), "story": STORY_TEXT, "moral": "Rest."})
+
+
+def test_pipeline_stages_go_out_as_batches_and_join_back():
+    with tempfile.TemporaryDirectory() as tmp:
+        runner = BatchRunner(LocalBatchProcessor(scripted_model), work_dir=tmp, linger=0.2)
+        generator, judge = StoryGenerator(runner), JudgeSystem(runner)
+        themes = ["a sleepy owl", "a brave mouse", "a kind whale", "a quiet fox"]
+        results = {}
+
+        def pipeline(theme):
+            story, _ = generator.generate_story(theme)
+            results[theme] = (story, judge.evaluate_story(story))
+
+        threads = [threading.Thread(target=pipeline, args=(theme,)) for theme in themes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # outline, story and judge stages: one batch each for all four pipelines
+        assert runner.stats == {"batches": 3, "requests": 12, "failed": 0}
+        for theme, (story, evaluation) in results.items():
+            assert story["title"] == theme.title()
+            assert evaluation["overall"] == 8
+
+        batch_files = sorted(name for name in os.listdir(tmp) if not name.endswith(".output.jsonl"))
+        with open(os.path.join(tmp, batch_files[0]), encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        assert len(lines) == 4
+        assert lines[0]["url"] == "/v1/chat/completions" and lines[0]["body"]["model"] == "gpt-3.5-turbo"
+        assert len({line["custom_id"] for line in lines}) == 4
+
+
+def test_failed_requests_raise_in_their_caller():
+    with tempfile.TemporaryDirectory() as tmp:
+        runner = BatchRunner(LocalBatchProcessor(scripted_model), work_dir=tmp, linger=0.05)
+        try:
+            runner("please fail me")
+            assert False, "expected BatchRequestFailed"
+        except BatchRequestFailed as e:
+            assert "upstream exploded" in str(e)
+        assert runner.stats["failed"] == 1
+
+
+class FakeResponse:
+    def __init__(self, payload=None, text=""):
+        self.payload, self.text = payload, text
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeOpenAI:
+    """Just enough of the files and batches endpoints, answering from a LocalBatchProcessor"""
+
+    def __init__(self):
+        self.local = LocalBatchProcessor(scripted_model)
+        self.uploads = {}
+        self.calls = []
+
+    def post(self, url, headers=None, files=None, data=None, json=None, timeout=None):
+        self.calls.append(url.rsplit("/", 1)[-1])
+        if url.endswith("/files"):
+            assert data == {"purpose": "batch"}
+            self.uploads["file-1"] = files["file"][1].name
+            return FakeResponse({"id": "file-1"})
+        assert json["endpoint"] == "/v1/chat/completions" and json["completion_window"] == "24h"
+        return FakeResponse({"id": self.local.submit(self.uploads[json["input_file_id"]])})
+
+    def get(self, url, headers=None, timeout=None):
+        if url.endswith("/content"):
+            with open(self.output_file, encoding="utf-8") as f:
+                return FakeResponse(text=f.read())
+        status = self.local.status(url.rsplit("/", 1)[-1])
+        if status["status"] == "completed":
+            self.output_file = status["output_file"]
+            status["output_file_id"] = "file-2"
+        return FakeResponse(status)
+
+
+def test_openai_backend_request_flow():
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = OpenAIBatchBackend(api_key="test")
+        backend.requests = FakeOpenAI()
+        runner = BatchRunner(backend, work_dir=tmp, linger=0.05, poll_interval=0.01)
+
+        evaluation = JudgeSystem(runner).evaluate_story({"title": "Owl", "story": STORY_TEXT, "moral": "Rest."})
+        assert evaluation["overall"] == 8
+        assert backend.requests.calls == ["files", "batches"]
+
+
+if __name__ == "__main__":
+    test_pipeline_stages_go_out_as_batches_and_join_back()
+    test_failed_requests_raise_in_their_caller()
+    test_openai_backend_request_flow()
+    print("✨ Batch backend test complete!")
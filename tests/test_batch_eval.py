@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for the batch judge evaluation runner over the bundled datasets
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from utils.batch_eval import BatchJudgeEvaluator, iter_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeJudgeModel:
+    """Fails the shadow monster story, passes the rest with noisy scores"""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7) -> str:
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+
+        if "Evaluate each story below" in prompt:
+            return self._judge_many(prompt)
+        return json.dumps(self._judge(prompt))
+
+    def _judge(self, story: str) -> dict:
+        if "shadow monster" in story.lower():
+            return {"pass": False, "reason": "Scary monster", "scores": None}
+        score = round(random.uniform(6, 8), 1)
+        scores = {dim: score for dim in ["bedtime_readiness", "creative_spark", "story_quality", "age_readability"]}
+        return {"pass": True, "scores": scores, "overall": score, "feedback": "", "improvement": ""}
+
+    def _judge_many(self, prompt: str) -> str:
+        """Judges every tagged story but drops the last one's entry, as a cut-off reply would"""
+        tagged = prompt.split("=== Story ")[1:]
+        entries = [{"id": f"Story {i}", **self._judge(story)} for i, story in enumerate(tagged, 1)]
+        return json.dumps({"evaluations": entries[:-1]})
+
+
+def test_datasets_normalize_to_the_same_items():
+    json_items = list(iter_dataset(os.path.join(ROOT, "bedtime_stories_ds.json")))
+    jsonl_items = list(iter_dataset(os.path.join(ROOT, "bedtime_stories_ds.jsonl")))
+
+    assert len(json_items) == len(jsonl_items) == 20
+    assert json_items[0]["story"]["story"] == jsonl_items[0]["story"]["story"]
+    assert json_items[0]["category"] == jsonl_items[0]["category"] == "safety_failure"
+    assert {item["category"] for item in json_items} == {
+        "safety_failure", "quality_failure", "length_variety_pass", "excellent"
+    }
+
+
+def test_json_dataset_is_streamed():
+    from utils import batch_eval
+
+    path = os.path.join(ROOT, "bedtime_stories_ds.json")
+    with open(path, encoding="utf-8") as f:
+        stories = json.load(f)["stories"]
+
+    chunk = batch_eval.READ_CHUNK
+    # chunk boundaries land inside strings, escapes and numbers
+    batch_eval.READ_CHUNK = 7
+    try:
+        items = iter_dataset(path)
+        first = next(items)
+        assert first["story"]["title"] == stories[0]["title"]
+        assert [first["id"]] + [item["id"] for item in items] == [row["id"] for row in stories]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            other = os.path.join(tmp, "ds.json")
+            with open(other, "w", encoding="utf-8") as f:
+                json.dump({"stories": stories[:2], "version": 12345, "notes": {"stories": []}}, f)
+            assert [item["id"] for item in iter_dataset(other)] == [row["id"] for row in stories[:2]]
+    finally:
+        batch_eval.READ_CHUNK = chunk
+
+
+def test_batch_eval_bounds_concurrency_and_reports_agreement():
+    model = FakeJudgeModel()
+    evaluator = BatchJudgeEvaluator(model, concurrency=4, samples=3)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "results.jsonl")
+        summary = evaluator.run(iter_dataset(os.path.join(ROOT, "bedtime_stories_ds.json")), output)
+        with open(output, encoding="utf-8") as f:
+            assert sum(1 for _ in f) == 20
+
+    assert model.peak <= 4
+    assert summary["items"] == 20 and summary["judge_calls"] == 60
+    assert summary["tokens"] > 0
+    assert summary["categories"]["excellent"]["pass_agreement"] == 100.0
+    assert summary["categories"]["excellent"]["mean_variance"] > 0
+    assert summary["categories"]["quality_failure"]["pass_agreement"] < 100.0
+    assert 0 < summary["overall"]["pass_agreement"] < 100
+
+
+def test_bulk_judging_rejudges_missing_entries_and_measures_agreement():
+    evaluator = BatchJudgeEvaluator(FakeJudgeModel(delay=0), concurrency=2, bulk=5, compare_single=True)
+    summary = evaluator.run(iter_dataset(os.path.join(ROOT, "bedtime_stories_ds.json")))
+
+    # 4 groups of 5: one multi-story call each plus a re-judge for the dropped entry
+    assert summary["bulk"] == {"stories_per_group": 5, "requests": 4, "stories": 20, "rejudged": 4}
+    assert summary["judge_calls"] == 8
+
+    agreement = summary["single_agreement"]
+    assert agreement["items"] == 20 and agreement["single_calls"] == 20
+    assert agreement["pass_agreement"] == agreement["safety_agreement"] == 100.0
+    assert agreement["overall_mad"] is not None
+    assert agreement["single_tokens"] > 0 and summary["tokens"] > 0
+
+
+if __name__ == "__main__":
+    test_datasets_normalize_to_the_same_items()
+    test_json_dataset_is_streamed()
+    test_batch_eval_bounds_concurrency_and_reports_agreement()
+    test_bulk_judging_rejudges_missing_entries_and_measures_agreement()
+    print("✨ Batch evaluation test complete!")
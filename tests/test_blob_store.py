@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for content-addressed story bodies (BlobStore) and the StoryStore records that point at them
+"""
+
+import json
+import os
+import tempfile
+from utils.blob_store import BLOB_ENTRY, TRAIN_AFTER, BlobStore
+from utils.story_store import StoryStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_records():
+    with open(os.path.join(ROOT, "story_metrics.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_blobs_are_deduplicated_and_survive_reopening():
+    with tempfile.TemporaryDirectory() as tmp:
+        blobs = BlobStore(tmp)
+        key = blobs.put("Once upon a time, a sleepy owl. ".encode("utf-8") * 20)
+        assert blobs.put("Once upon a time, a sleepy owl. ".encode("utf-8") * 20) == key
+        assert len(blobs) == 1 and key in blobs
+        assert blobs.stats()["stored_bytes"] < blobs.stats()["raw_bytes"] / 5
+
+        # a writer that died mid-entry leaves a partial entry that is overwritten
+        with open(blobs.index_file, "ab") as f:
+            f.write(b"\0" * (BLOB_ENTRY.size // 2))
+        reopened = BlobStore(tmp)
+        assert reopened.get(key).startswith(b"Once upon a time")
+        second = reopened.put(b"The moon hummed a lullaby.")
+        assert BlobStore(tmp).get(second) == b"The moon hummed a lullaby."
+        assert blobs.get(second) == b"The moon hummed a lullaby."
+
+        try:
+            blobs.get("00" * 32)
+            assert False, "missing blob should raise"
+        except KeyError:
+            pass
+
+
+def test_trained_dictionary_improves_compression():
+    stories = [r["story"]["content"].encode("utf-8") for r in legacy_records()]
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = BlobStore(os.path.join(tmp, "plain"))
+        for story in stories[20:]:
+            plain.put(story)
+
+        trained = BlobStore(os.path.join(tmp, "trained"))
+        assert trained.train(stories[:20]) == 1
+        keys = [trained.put(story) for story in stories[20:]]
+        assert [trained.get(key) for key in keys] == stories[20:]
+        assert trained.stats()["stored_bytes"] < 0.85 * plain.stats()["stored_bytes"]
+
+        # once enough bodies are stored a dictionary is trained without being asked
+        auto = BlobStore(os.path.join(tmp, "auto"))
+        for i in range(TRAIN_AFTER - 1):
+            auto.put(stories[i % len(stories)] + f" ({i})".encode("utf-8"))
+        assert auto.stats()["dictionary"] == 0
+        auto.put(b"one more story")
+        assert auto.stats()["dictionary"] == 1
+        assert auto.get(auto.put(stories[0])) == stories[0]
+
+
+def test_story_records_keep_only_hashes():
+    records = legacy_records()[:5]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StoryStore(tmp)
+        for record in records[:3]:
+            store.append(dict(record, outline={"outline": "An owl learns to sleep", "characters": "Owl"}))
+        assert len(store.blobs) == 4  # three stories, one shared outline
+
+        with open(store.records_file, encoding="utf-8") as f:
+            raw = [json.loads(line) for line in f]
+        assert all("content" not in r["story"] and "outline" not in r for r in raw)
+        assert list(raw[0]["story"]) == ["title", "content_hash", "moral", "word_count"]
+
+        story = store.get(records[1]["id"])
+        assert story["story"]["content"] == records[1]["story"]["content"]
+        assert story["outline"]["characters"] == "Owl"
+        assert "content" not in store.read(store.entry(0), bodies=False)["story"]
+
+
+def test_migrate_moves_inline_bodies():
+    records = legacy_records()[:4]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StoryStore(tmp)
+        # a store written before bodies moved out: records appended with their text inline
+        store.store_bodies = lambda record: dict(record)
+        for record in records:
+            store.append(dict(record))
+        del store.store_bodies
+        size_before = os.path.getsize(store.records_file)
+
+        assert store.migrate_bodies() == 4
+        assert os.path.getsize(store.records_file) < size_before / 3
+        assert [store.get(r["id"])["story"]["content"] for r in records] == [r["story"]["content"] for r in records]
+        assert store.migrate_bodies() == 0
+
+
+if __name__ == "__main__":
+    test_blobs_are_deduplicated_and_survive_reopening()
+    test_trained_dictionary_improves_compression()
+    test_story_records_keep_only_hashes()
+    test_migrate_moves_inline_bodies()
+    print("✨ BlobStore test complete!")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script for the record/replay Cassette layer
+"""
+
+import os
+import tempfile
+import time
+from utils.cassette import Cassette, CassetteMiss
+
+
+def test_record_then_replay_in_order():
+    responses = iter(["first", "second"])
+    calls = []
+
+    def model(prompt, max_tokens=3000, temperature=0.7):
+        calls.append(prompt)
+        time.sleep(0.05)
+        return next(responses)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "nested", "calls.jsonl.gz")
+
+        recorder = Cassette(path, model, mode="record")
+        assert recorder("tell a story", max_tokens=100) == "first"
+        assert recorder("tell a story", max_tokens=100) == "second"
+        assert recorder.stats["recorded"] == 2
+
+        player = Cassette(path, mode="replay")
+        # max_tokens is not part of the key, so a shrunk budget still replays
+        assert player("tell a story", max_tokens=50) == "first"
+        assert player("tell a story") == "second"
+        assert player("tell a story") == "second"
+        assert player.stats["hits"] == 3
+        assert player.recorded_latency() >= 0.1
+        assert len(calls) == 2
+
+        try:
+            player("tell a story", temperature=0.1)
+            assert False, "expected CassetteMiss"
+        except CassetteMiss:
+            pass
+
+
+def test_auto_mode_records_only_misses_and_can_replay_latency():
+    calls = []
+
+    def model(prompt, max_tokens=3000, temperature=0.7):
+        calls.append(prompt)
+        time.sleep(0.1)
+        return prompt.upper()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "calls.jsonl.gz")
+        auto = Cassette(path, model, mode="auto")
+        auto("a")
+        auto("a")
+        auto("b")
+        assert calls == ["a", "b"]
+
+        fast = Cassette(path, mode="replay")
+        started = time.monotonic()
+        assert fast("b") == "B"
+        assert time.monotonic() - started < 0.05
+
+        slow = Cassette(path, mode="replay", replay_latency=True)
+        started = time.monotonic()
+        assert slow("b") == "B"
+        assert time.monotonic() - started >= 0.09
+
+
+if __name__ == "__main__":
+    test_record_then_replay_in_order()
+    test_auto_mode_records_only_misses_and_can_replay_latency()
+    print("✨ Cassette test complete!")
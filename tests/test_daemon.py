@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test script for the warm daemon: a client's terminal relayed to a menu running in the daemon
+"""
+
+import contextvars
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.daemon import StoryDaemon, _Session, run_client, status
+
+
+def test_client_session_runs_in_the_daemon():
+    seen = []
+
+    def run_session(hello):
+        print(f"Hello {hello['tenant']}, thread {threading.current_thread().name != 'MainThread'}")
+        seen.append(input("➤ Your idea: "))
+        # worker threads started with a copy of the context print to the session, as write_story's do
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            routed = pool.submit(contextvars.copy_context().run, lambda: sys.stdout._target()).result()
+            seen.append(routed is not sys.stdout._stream)
+        seen.append(input("➤ Again: "))
+        input("➤ One more: ")  # the client has no more input: EOFError ends the session
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "b.sock")
+        daemon = StoryDaemon(run_session, path, status=lambda: {"tenants": "default"})
+        server = threading.Thread(target=daemon.serve_forever, daemon=True)
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin, sys.stdout = io.StringIO("a sleepy owl\n\n"), io.StringIO()
+        try:
+            server.start()
+            while not os.path.exists(path):
+                time.sleep(0.01)
+            assert run_client({"tenant": "smith-family"}, path)
+            output = sys.stdout.getvalue()
+            info = status(path)
+        finally:
+            daemon.shutdown()
+            server.join()
+            sys.stdin, sys.stdout = stdin, stdout
+
+        assert seen == ["a sleepy owl", True, ""]
+        assert "Hello smith-family, thread True\n➤ Your idea: ➤ Again: ➤ One more: " == output
+        assert info["sessions"] == 1 and info["active"] == 0 and info["tenants"] == "default"
+        assert not os.path.exists(path)
+
+
+def test_no_daemon_falls_back():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "b.sock")
+        assert not run_client({"tenant": "default"}, path) and status(path) is None
+        # a socket file left by a daemon that was killed
+        open(path, "w").close()
+        assert not run_client({"tenant": "default"}, path)
+
+
+def test_session_output_from_worker_threads():
+    """Variant writers print to one session at once; every line arrives once and whole"""
+    wfile = io.BytesIO()
+    session = _Session(io.BytesIO(), wfile)
+
+    def write(worker):
+        for i in range(200):
+            session.write(f"variant {worker} line {i}\n")
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(4)]
+    interval = sys.getswitchinterval()
+    # switch threads often enough that unguarded buffer swaps would lose lines
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    session.flush()
+
+    text = "".join(json.loads(line)["out"] for line in wfile.getvalue().decode("utf-8").splitlines())
+    assert sorted(text.splitlines()) == sorted(f"variant {w} line {i}" for w in range(4) for i in range(200))
+
+
+if __name__ == "__main__":
+    test_client_session_runs_in_the_daemon()
+    test_no_daemon_falls_back()
+    test_session_output_from_worker_threads()
+    print("✨ Daemon test complete!")
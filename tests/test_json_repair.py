@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared JSON repair parser and its per-family schemas
+"""
+
+import json
+from agents.input_handler import InputHandler
+from agents.judge import JudgeSystem
+from utils import json_repair
+from utils.json_repair import JSONRepairError, parse, repair_json
+
+
+def test_repairs_common_defects():
+    cases = [
+        # fence and prose around the object
+        ('Sure! Here it is:\n```json\n{"title": "Pip", "story": "Once.", "moral": "Read"}\n```\nEnjoy!', []),
+        # trailing commas with whitespace
+        ('{"edits": [\n  {"paragraph": 2, "action": "delete"},\n  ],\n}', ["trailing_comma"]),
+        # typographic quotes as delimiters, kept inside the text
+        ('{“title”: “Pip”, “story”: “Pip said “hello” softly.”, “moral”: “Read”}', ["smart_quotes"]),
+        # raw newlines and unescaped quotes inside a story
+        ('{"title": "Pip", "story": "Pip said "goodnight" to the moon.\n\nThe end.", "moral": "Rest"}',
+         ["control_chars", "inner_quotes"]),
+    ]
+    for source, repairs in cases:
+        value, made = repair_json(source)
+        assert set(repairs) <= set(made), (source, made)
+        assert isinstance(value, dict)
+
+    value, _ = repair_json('{“title”: “Pip”, “story”: “Pip said “hello” softly.”, “moral”: “Read”}')
+    assert value["story"] == "Pip said “hello” softly."
+    value, _ = repair_json('{"title": "Pip", "story": "Pip said "goodnight" to the moon.\n\nThe end.", "moral": "Rest"}')
+    assert value["story"] == 'Pip said "goodnight" to the moon.\n\nThe end.'
+    assert repair_json("{'valid': True, 'story_elements': 'A dragon', 'suggestion': None}")[0] == {
+        "valid": True, "story_elements": "A dragon", "suggestion": None}
+
+    # braces in the prose before the object are not where it starts
+    value, _ = repair_json('My {honest} verdict, {as asked}: {"valid": true, "story_elements": "A dragon"}')
+    assert value == {"valid": True, "story_elements": "A dragon"}
+
+    try:
+        repair_json("I'm sorry, I can't help with that.")
+        assert False, "no JSON should raise"
+    except JSONRepairError:
+        pass
+
+
+def test_truncated_replies_keep_what_is_complete():
+    value, repairs = repair_json('{"questions": ["Why is the moon round?", "Can mice rea')
+    assert "truncated" in repairs
+    assert value["questions"] == ["Why is the moon round?", "Can mice rea"]
+
+    value, _ = repair_json('{"pass": true, "scores": {"bedtime_readiness": 8, "creative_spark": 7.')
+    assert value == {"pass": True, "scores": {"bedtime_readiness": 8}}
+
+    # a story cut off before its moral fails the story schema
+    try:
+        parse('{"title": "Pip", "story": "Once upon a time, Pip', "story")
+        assert False, "missing moral should fail validation"
+    except JSONRepairError as e:
+        assert e.family == "story" and "moral" in str(e)
+
+
+def test_schemas_coerce_and_stats_count_saved_calls():
+    json_repair.reset_stats()
+    scores = '{"bedtime_readiness": 8, "creative_spark": "7", "story_quality": "7.5", "age_readability": 9}'
+    judge = parse('{"pass": "true", "scores": %s, "overall": "7.5/10"}' % scores, "judge")
+    assert judge["pass"] is True and judge["scores"]["story_quality"] == 7.5 and judge["overall"] == 7.5
+    assert parse('{"pass": false, "reason": "Scary", "scores": null}', "judge")["scores"] is None
+    # a verdict with scores needs all four and the overall; null scores can't pass
+    for incomplete in ('{"pass": true, "scores": {"story_quality": 7.5}, "overall": 7.5}',
+                       '{"pass": true, "scores": %s}' % scores,
+                       '{"pass": true, "overall": 8}',
+                       '{"pass": true, "scores": null}'):
+        try:
+            parse(incomplete, "judge_questions")
+            assert False, incomplete
+        except JSONRepairError as e:
+            assert e.family == "judge_questions"
+    outline = parse('{"outline": "o", "characters": ["Pip: brave", "Lumi: kind"]}', "outline")
+    assert outline == {"outline": "o", "characters": "Pip: brave; Lumi: kind", "instruction": ""}
+
+    for bad in ('{"valid": "maybe", "story_elements": ""}', "no json here"):
+        try:
+            parse(bad, "input")
+            assert False, "should raise"
+        except ValueError:
+            pass
+    parse('```json\n{"valid": true, "story_elements": "A dragon"}\n```', "input")
+
+    stats = json_repair.stats()
+    assert stats["judge"]["clean"] == 2 and stats["judge_questions"]["invalid"] == 4 and stats["outline"]["clean"] == 1
+    assert stats["input"] == {
+        "responses": 3, "clean": 0, "extracted": 1, "repaired": 0, "failed": 1, "invalid": 1,
+        "repairs": {}, "parse_rate": 33.3, "strict_parse_rate": 0.0, "calls_saved": 1,
+    }
+
+
+def test_agents_use_repaired_replies():
+    fenced = "```json\n" + json.dumps({"valid": True, "story_elements": "A story about a dragon"}) + "\n```"
+    result = InputHandler(lambda prompt, **kwargs: fenced).process_input("dragon")
+    assert result == {"valid": True, "story_elements": "A story about a dragon", "suggestion": ""}
+
+    reply = ('Here is my evaluation: {"pass": true, "scores": {"bedtime_readiness": 8, "creative_spark": 7, '
+             '"story_quality": 8, "age_readability": 9,}, "overall": 8, "feedback": "Lovely", "improvement": "More calm",}')
+    evaluation = JudgeSystem(lambda prompt, **kwargs: reply).evaluate_story(
+        {"title": "Owl", "story": "Once upon a time " * 150, "moral": "Rest"})
+    assert evaluation["pass"] and evaluation["overall"] == 8
+
+
+if __name__ == "__main__":
+    test_repairs_common_defects()
+    test_truncated_replies_keep_what_is_complete()
+    test_schemas_coerce_and_stats_count_saved_calls()
+    test_agents_use_repaired_replies()
+    print("✨ JSON repair test complete!")
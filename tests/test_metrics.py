@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for the Prometheus-style metrics registry, agent instrumentation and exporters
+"""
+
+import os
+import tempfile
+import urllib.request
+from agents.judge import JudgeSystem
+from agents.qa import QAAgent
+from utils import metrics
+from utils.metrics import FileDumper, InstrumentedCall, MetricsRegistry, start_http_server
+from utils.story_tracker import StoryTracker
+
+REGISTRY = metrics.REGISTRY
+
+
+def value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_render_text_format():
+    registry = MetricsRegistry()
+    calls = registry.counter("demo_calls_total", "Calls", ("site",))
+    latency = registry.histogram("demo_seconds", "Latency", buckets=(0.1, 1.0))
+    calls.labels(site='Judge "unified"\n').inc(2)
+    for seconds in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(seconds)
+
+    text = registry.render()
+    assert "# TYPE demo_calls_total counter" in text
+    assert 'demo_calls_total{site="Judge \\"unified\\"\\n"} 2' in text
+    assert 'demo_seconds_bucket{le="0.1"} 2' in text
+    assert 'demo_seconds_bucket{le="1"} 3' in text
+    assert 'demo_seconds_bucket{le="+Inf"} 4' in text
+    assert "demo_seconds_sum 3.65" in text and "demo_seconds_count 4" in text
+    assert registry.get_sample_value("demo_seconds_count") == 4
+
+    try:
+        calls.inc()
+        assert False, "labelled counter needs labels"
+    except ValueError:
+        pass
+
+
+def test_agent_calls_fallbacks_and_parse_failures():
+    responses = iter([
+        '{"pass": true, "scores": {"bedtime_readiness": 8, "creative_spark": 8, '
+        '"story_quality": 8, "age_readability": 8}, "overall": 8}',
+        "Sure! Here is my evaluation:",
+    ])
+    judge = JudgeSystem(InstrumentedCall(lambda prompt, **kwargs: next(responses)))
+    site = "JudgeSystem.evaluate_story"
+    before = {
+        "ok": value("beanstalk_agent_calls_total", agent="JudgeSystem", method="evaluate_story", outcome="ok"),
+        "fallback": value("beanstalk_agent_calls_total", agent="JudgeSystem", method="evaluate_story", outcome="fallback"),
+        "llm": value("beanstalk_llm_calls_total", site=site, outcome="ok"),
+        "parse": value("beanstalk_json_parse_failures_total", site=site),
+        "pass": value("beanstalk_judge_verdicts_total", verdict="pass"),
+    }
+
+    story = {"title": "Owl", "story": "Once upon a time " * 100, "moral": "Sleep well"}
+    assert judge.evaluate_story(story)["pass"]
+    assert not judge.evaluate_story(story)["pass"]
+
+    assert value("beanstalk_agent_calls_total", agent="JudgeSystem", method="evaluate_story", outcome="ok") == before["ok"] + 1
+    assert value("beanstalk_agent_calls_total", agent="JudgeSystem", method="evaluate_story", outcome="fallback") == before["fallback"] + 1
+    assert value("beanstalk_llm_calls_total", site=site, outcome="ok") == before["llm"] + 2
+    assert value("beanstalk_json_parse_failures_total", site=site) == before["parse"] + 1
+    assert value("beanstalk_judge_verdicts_total", verdict="pass") == before["pass"] + 1
+    assert value("beanstalk_agent_call_seconds_count", agent="JudgeSystem", method="evaluate_story") >= 2
+
+    # an exception escaping the method is an error, and the call site is reset afterwards
+    def broken(prompt, **kwargs):
+        raise TimeoutError("upstream timed out")
+
+    errors = value("beanstalk_llm_calls_total", site="QAAgent.answer_question", outcome="timeout")
+    assert QAAgent(InstrumentedCall(broken)).answer_question("Why?", story).startswith("That's such")
+    assert value("beanstalk_llm_calls_total", site="QAAgent.answer_question", outcome="timeout") == errors + 1
+    assert metrics.current_site() == "other"
+
+
+def test_tracker_writes_and_exporters():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "missing.json"), data_dir=os.path.join(tmp, "store"))
+        saved = value("beanstalk_stories_saved_total", passed="true")
+        commits = value("beanstalk_tracker_write_seconds_count", phase="commit")
+        tracker.add_story({"title": "Owl", "story": "The owl slept.", "moral": "Rest"}, {"pass": True, "overall": 8})
+        assert value("beanstalk_stories_saved_total", passed="true") == saved + 1
+        assert value("beanstalk_tracker_write_seconds_count", phase="commit") == commits + 1
+
+        metrics.track(tracker)
+        metrics.track(tracker, "smith-family")
+        server = start_http_server(0)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            with urllib.request.urlopen(url, timeout=5) as response:
+                assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                body = response.read().decode("utf-8")
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert 'beanstalk_stories{tenant="default",state="total"} 1' in body
+        assert 'beanstalk_stories{tenant="smith-family",state="total"} 1' in body
+        metrics.untrack("smith-family")
+        assert 'tenant="smith-family"' not in metrics.REGISTRY.render()
+        assert "# TYPE beanstalk_tracker_write_seconds histogram" in body
+
+        dump = os.path.join(tmp, "metrics", "beanstalk.prom")
+        dumper = FileDumper(dump, interval=60).start()
+        dumper.stop()
+        with open(dump, encoding="utf-8") as f:
+            assert 'beanstalk_stories{tenant="default",state="passed"} 1' in f.read()
+        assert os.listdir(os.path.dirname(dump)) == ["beanstalk.prom"]
+
+
+if __name__ == "__main__":
+    test_render_text_format()
+    test_agent_calls_fallbacks_and_parse_failures()
+    test_tracker_writes_and_exporters()
+    print("✨ Metrics test complete!")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test script for per-call-site model routing: policies, latency learning and failover
+"""
+
+from utils import metrics
+from utils.model_router import ModelRouter
+
+CONFIG = {
+    "routes": {
+        "big": {"model": "big-model"},
+        "small": {"model": "small-model"},
+        "local": {"model": "llama", "endpoint": "http://localhost:8000/v1"},
+    },
+    "sites": {"Agent.process_input": {"policy": "fastest", "routes": ["small", "local"]}},
+    "default": {"policy": "ordered", "routes": ["big", "small"]},
+}
+
+
+class FakeUpstream:
+    """Each model answers after its own latency on a fake clock; down models raise"""
+
+    def __init__(self, latency):
+        self.latency = dict(latency)
+        self.down = set()
+        self.now = 0.0
+        self.calls = []
+
+    def clock(self):
+        return self.now
+
+    def __call__(self, prompt, max_tokens=3000, temperature=0.7, model=None, endpoint=None, timeout=None):
+        self.calls.append((model, endpoint, timeout))
+        self.now += self.latency[model]
+        if model in self.down:
+            raise ConnectionError(f"{model} unavailable")
+        return f"{model}: ok"
+
+
+class Agent:
+    """Stands in for an agent so calls are made under a call site"""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    @metrics.observed
+    def process_input(self):
+        return self.llm("validate")
+
+    @metrics.observed
+    def generate_story(self):
+        return self.llm("write", max_tokens=3000)
+
+
+def test_fastest_policy_learns_latency_and_probes():
+    upstream = FakeUpstream({"small-model": 0.8, "llama": 0.3, "big-model": 4.0})
+    router = ModelRouter(upstream, CONFIG, probe_every=5, clock=upstream.clock)
+    agent = Agent(router)
+
+    # both unknown routes are timed once, then the faster one wins
+    answers = [agent.process_input() for _ in range(4)]
+    assert answers[:2] == ["small-model: ok", "llama: ok"]
+    assert answers[2:] == ["llama: ok", "llama: ok"]
+    assert upstream.calls[1] == ("llama", "http://localhost:8000/v1", None)
+
+    # every probe_every-th call re-times the route not used lately
+    assert agent.process_input() == "small-model: ok"
+    upstream.latency["small-model"] = 0.1
+    for _ in range(30):
+        agent.process_input()
+    latency = router.stats()["latency"]["Agent.process_input"]
+    assert latency["small"] < latency["local"]
+    assert agent.process_input() == "small-model: ok"
+
+    # sites without their own entry use the default, ordered
+    assert agent.generate_story() == "big-model: ok"
+    assert metrics.REGISTRY.get_sample_value(
+        "beanstalk_route_decisions_total",
+        {"site": "Agent.process_input", "route": "local", "reason": "fastest"}) >= 2
+
+
+def test_failover_and_cooldown():
+    upstream = FakeUpstream({"small-model": 0.5, "llama": 0.3, "big-model": 2.0})
+    router = ModelRouter(upstream, CONFIG, cooldown=30, clock=upstream.clock)
+    agent = Agent(router)
+
+    upstream.down.add("big-model")
+    # each failure is retried on the next route within the same call
+    for _ in range(4):
+        assert agent.generate_story() == "small-model: ok"
+    assert router.stats()["routes"]["big"]["open"]
+    calls = len(upstream.calls)
+    assert agent.generate_story() == "small-model: ok"
+    assert len(upstream.calls) == calls + 1  # the open route is skipped
+
+    # after the cooldown it gets another chance and recovers
+    upstream.down.clear()
+    upstream.now += 31
+    assert agent.generate_story() == "big-model: ok"
+
+    # a failover only gets what is left of the caller's timeout
+    upstream.down.add("big-model")
+    router = ModelRouter(upstream, CONFIG, clock=upstream.clock)
+    router("write", timeout=10)
+    assert upstream.calls[-1] == ("small-model", None, 8.0)
+    try:
+        router("write", timeout=2.5)
+        assert False, "no time left for a failover"
+    except ConnectionError:
+        pass
+
+
+if __name__ == "__main__":
+    test_fastest_policy_learns_latency_and_probes()
+    test_failover_and_cooldown()
+    print("✨ Model router test complete!")
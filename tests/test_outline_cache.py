@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test script for the outline cache, multi-variant generation and the library builder
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from agents.judge import JudgeSystem
+from agents.story_generator import StoryGenerator
+from utils.library_builder import LibraryBuilder
+from utils.outline_cache import OutlineCache, normalize_elements
+
+OUTLINE = {"outline": "Ember reads to the forest.", "characters": "Ember", "instruction": "Keep it calm."}
+STORY_TEXT = " ".join(["Ember the dragon read softly to the owls."] * 70)
+
+
+class FakeModel:
+    """Scripted LLM that counts calls by kind and records how many overlap"""
+
+    def __init__(self):
+        self.calls = {"outline": 0, "story": 0, "judge": 0}
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, max_tokens=3000, temperature=0.7, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.prompts.append(prompt)
+        try:
+            time.sleep(0.05)
+            if "generate an outline" in prompt:
+                kind, response = "outline", json.dumps(OUTLINE)
+            elif "expert evaluator" in prompt:
+                kind, response = "judge", json.dumps({
+                    "pass": True, "overall": 8,
+                    "scores": {"bedtime_readiness": 8, "creative_spark": 8, "story_quality": 8, "age_readability": 8},
+                    "feedback": "Lovely.", "improvement": "None needed.",
+                })
+            else:
+                kind, response = "story", json.dumps({"title": "Ember Reads", "story": STORY_TEXT, "moral": "Share stories."})
+            with self.lock:
+                self.calls[kind] += 1
+            return response
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def test_outline_cache_keys_persistence_and_eviction():
+    assert normalize_elements("A story about two Dragons who love books") == "book dragon love two"
+    assert normalize_elements("books, love, two dragons!") == "book dragon love two"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "outlines.jsonl")
+        cache = OutlineCache(path, max_entries=2)
+        cache.put("A story about a dragon", OUTLINE)
+        assert cache.get("dragon") == OUTLINE
+        assert cache.get("a unicorn") is None
+        assert cache.stats == {"hits": 1, "misses": 1, "stored": 1}
+
+        cache.put("a unicorn", dict(OUTLINE, outline="Unicorn"))
+        cache.put("a mouse", dict(OUTLINE, outline="Mouse"))
+        # least recently used (the dragon) is evicted, in memory and after a reload
+        assert cache.get("dragon") is None
+        reloaded = OutlineCache(path, max_entries=2)
+        assert len(reloaded) == 2 and reloaded.get("mouse")["outline"] == "Mouse"
+
+        for i in range(5):
+            cache.put(f"theme {i}", OUTLINE)
+        with open(path, encoding="utf-8") as f:
+            assert sum(1 for _ in f) <= 4
+
+
+def test_variants_share_one_cached_outline():
+    with tempfile.TemporaryDirectory() as tmp:
+        model = FakeModel()
+        generator = StoryGenerator(model, outline_cache=OutlineCache(os.path.join(tmp, "outlines.jsonl")))
+
+        variants, outline = generator.generate_variants("A story about a dragon who reads", count=3)
+        assert len(variants) == 3 and outline == OUTLINE
+        assert model.calls == {"outline": 1, "story": 3, "judge": 0}
+        assert model.max_in_flight == 3
+        # every variant asks for a different telling
+        assert len(set(model.prompts[1:])) == 3
+
+        story, _ = generator.generate_story("a dragon who reads")
+        assert story["title"] == "Ember Reads"
+        assert model.calls["outline"] == 1
+
+
+def test_library_builder_fans_out_themes():
+    with tempfile.TemporaryDirectory() as tmp:
+        model = FakeModel()
+        generator = StoryGenerator(model, outline_cache=OutlineCache(os.path.join(tmp, "outlines.jsonl")))
+        builder = LibraryBuilder(generator, JudgeSystem(model), variants=2, concurrency=2)
+        library = os.path.join(tmp, "library.jsonl")
+
+        summary = builder.build(["a dragon who reads", "a sleepy owl", "A story about a dragon who reads"], library)
+        assert summary["themes"] == 3 and summary["stories"] == 6 and summary["passed"] == 6
+        assert summary["outline_cache_hits"] + summary["outline_calls"] == 3
+        assert summary["llm_calls"] == sum(model.calls.values())
+
+        with open(library, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == 6 and records[0]["outline"] == OUTLINE
+
+
+if __name__ == "__main__":
+    test_outline_cache_keys_persistence_and_eviction()
+    test_variants_share_one_cached_outline()
+    test_library_builder_fans_out_themes()
+    print("✨ Outline cache test complete!")
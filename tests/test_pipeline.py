@@ -1,154 +1,177 @@
 #!/usr/bin/env python3
 """
-Test the complete Beanstalk AI pipeline end-to-end
+Test the complete Beanstalk AI pipeline end-to-end, through main.create_story
 """
 
+import builtins
+import contextlib
+import io
 import os
-import openai
-from dotenv import load_dotenv
-from agents.input_handler import InputHandler
-from agents.story_generator import StoryGenerator
-from agents.judge import JudgeSystem
-from agents.qa import QAAgent
-
-# Load environment variables
-load_dotenv()
-
-def call_model(prompt: str, max_tokens=3000, temperature=0.1) -> str:
-    """LLM call function"""
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    
-    if not openai.api_key:
-        print("❌ No OpenAI API key found. Set OPENAI_API_KEY in your .env file")
-        print("   Using mock responses for demo...")
-        return mock_response(prompt)
-    
-    # Real OpenAI call
-    resp = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        stream=False,
-        max_tokens=max_tokens,
-        temperature=temperature,
-    )
-    return resp.choices[0].message["content"]
-
-def mock_response(prompt: str) -> str:
-    """Mock responses for testing without API key"""
-    if "analyze this user input" in prompt.lower():
-        return '{"valid": true, "story_elements": "A story about a brave mouse in a library", "suggestion": ""}'
-    elif "safety" in prompt.lower():
-        return '{"passed": true, "issues": ""}'
-    elif "generate example questions" in prompt.lower():
-        return '{"questions": ["What books does the mouse like to read?", "How did the mouse learn to be brave?", "What other animals live in the library?"]}'
-    elif "answer" in prompt.lower():
-        return "That's a wonderful question! I think the mouse probably loves adventure books the most."
-    else:
-        return '{"title": "The Brave Library Mouse", "story": "Once upon a time, there was a little mouse named Pip who lived in the corner of the town library...", "moral": "Even the smallest among us can be heroes."}'
+import re
+import tempfile
+import main
+from utils.story_tracker import StoryTracker
+from tests.recorded_model import recorded_model
+
+MOUSE = "A story about a mouse who lives in a library"
+
+
+def build_agents(call_model, story_tracker, combined_judge: bool = False):
+    """main.build_agents over call_model; recordings don't depend on the model route, so it's dropped"""
+    routed_call = main.call_model
+    combined = os.environ.get("BEANSTALK_COMBINED_JUDGE")
+    main.call_model = lambda prompt, model=None, endpoint=None, **kwargs: call_model(prompt, **kwargs)
+    os.environ["BEANSTALK_COMBINED_JUDGE"] = "1" if combined_judge else "0"
+    try:
+        return main.build_agents(story_tracker)
+    finally:
+        main.call_model = routed_call
+        if combined is None:
+            del os.environ["BEANSTALK_COMBINED_JUDGE"]
+        else:
+            os.environ["BEANSTALK_COMBINED_JUDGE"] = combined
+
+
+def run_story(agents, story_tracker, answers) -> str:
+    """main.create_story with answers typed at its prompts in order; returns what it printed"""
+    replies = iter(answers)
+    typed_input = builtins.input
+    builtins.input = lambda prompt="": next(replies)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            main.create_story(story_tracker=story_tracker, **agents)
+    finally:
+        builtins.input = typed_input
+    assert "Oops" not in output.getvalue(), output.getvalue()
+    assert next(replies, None) is None, "create_story asked fewer questions than expected"
+    return output.getvalue()
+
+
+def offered_questions(output: str):
+    return re.findall(r"^  \d\. (.+)$", output, re.MULTILINE)
+
 
 def test_full_pipeline():
     """Test the complete Beanstalk AI system"""
-    
+
     print("🌱 BEANSTALK AI - FULL PIPELINE TEST")
     print("=" * 60)
-    
-    # Initialize all agents
-    input_handler = InputHandler(call_model)
-    story_generator = StoryGenerator(call_model)
-    judge_system = JudgeSystem(call_model)
-    qa_agent = QAAgent(call_model)
-    
-    # Test inputs
-    test_inputs = [
-        "A story about a mouse who lives in a library",
-        "dragon",
-        "sdfdfgg"  # Should get enhanced by input handler
-    ]
-    
-    for i, user_input in enumerate(test_inputs, 1):
-        print(f"\n🎬 TEST {i}: '{user_input}'")
-        print("=" * 50)
-        
-        try:
-            # STEP 1: Input Processing
-            print("1️⃣  Processing input...")
-            processed = input_handler.process_input(user_input)
-            
-            if not processed["valid"]:
-                print(f"❌ Invalid input: {processed['suggestion']}")
-                continue
-            
-            print(f"✅ Input processed: {processed['story_elements']}")
-            
-            # STEP 2: Story Generation
-            print("\n2️⃣  Generating story...")
-            story = story_generator.generate_story(processed["story_elements"])
-            print(f"✅ Story generated: '{story['title']}'")
-            print(f"   Word count: {len(story['story'].split())} words")
-            
-            # STEP 3: Judge Evaluation
-            print("\n3️⃣  Evaluating with judge...")
-            evaluation = judge_system.evaluate_story(story)
-            
-            if not evaluation.get("safety_passed", True):
-                print(f"❌ Failed safety gate: {evaluation.get('safety_issues', 'Unknown')}")
-                continue
-            
-            print(f"✅ Safety passed")
-            print(f"📊 Overall score: {evaluation.get('overall_score', 'N/A')}/5")
-            
-            refinement_count = 0
-            while judge_system.needs_refinement(evaluation) and refinement_count < 2:
-                print(f"\n🔄 Refinement needed (attempt {refinement_count + 1})...")
-                instructions = judge_system.generate_refinement_instructions(evaluation)
-                print(f"   Instructions: {instructions[:100]}...")
-                
-                story = story_generator.refine_story(story, instructions)
-                evaluation = judge_system.evaluate_story(story)
-                refinement_count += 1
-            
-            if evaluation.get("passed", False):
-                print("🎉 Story approved by judge!")
-            else:
-                print("⚠️  Story accepted after max refinements")
-            
-            # STEP 4: Present Story
-            print(f"\n4️⃣  Final Story:")
-            print(f"📚 {story['title']}")
-            print("-" * 30)
-            print(story['story'][:200] + "..." if len(story['story']) > 200 else story['story'])
-            print(f"\n💭 Moral: {story['moral']}")
-            
-            # STEP 5: Q&A Session
-            print(f"\n5️⃣  Q&A Opportunity:")
-            questions = qa_agent.generate_question_opportunities(story)
-            print("🤔 Example questions you could ask:")
-            for j, q in enumerate(questions, 1):
-                print(f"   {j}. {q}")
-            
-            # Simulate asking a question
-            if questions:
-                sample_question = questions[0]
-                print(f"\n❓ Let's try asking: '{sample_question}'")
-                answer = qa_agent.answer_question(sample_question, story)
-                print(f"💡 Answer: {answer}")
-            
-            print(f"\n✨ Test {i} completed successfully!")
-            
-        except Exception as e:
-            print(f"💥 Error in test {i}: {e}")
-        
-        if i < len(test_inputs):
-            input(f"\n➡️  Press Enter for next test...")
-    
+
+    call_model = recorded_model("pipeline")
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "story_metrics.json"))
+        agents = build_agents(call_model, tracker)
+
+        # idea, liked it, one question, Enter to continue
+        mouse = run_story(agents, tracker, [MOUSE, "Y", "What other books do Pip and Lumi read together?", ""])
+        dragon = run_story(agents, tracker, ["dragon", "N", "", ""])
+        gibberish = run_story(agents, tracker, ["sdfdfgg"])
+        print(mouse + dragon + gibberish)
+
+        first, second = tracker.iter_stories()
+        assert first["story"]["title"] == "Pip and the Whispering Shelves" and first["user_liked"]
+        assert first["outline"].get("outline")
+        assert first["refinement"]["rounds"] >= 1
+        assert first["evaluation"]["overall"] >= first["refinement"]["initial_overall"]
+        assert len(offered_questions(mouse)) == 3 and "💡 I think Pip and Lumi" in mouse
+
+        assert second["evaluation"]["pass"] and not second["user_liked"]
+        assert second["refinement"]["rounds"] == 0 and second["refinement"]["stop_reason"] == "target_reached"
+
+        assert "💭 I didn't quite catch that" in gibberish
+        assert tracker.get_stats()["total"] == 2
+
+        # asking for the mouse again offers the saved story without calling the model
+        calls = call_model.stats["hits"]
+        again = run_story(agents, tracker, [MOUSE, "Y", ""])
+        assert "🔁 This sounds like \"Pip and the Whispering Shelves\"" in again
+        assert call_model.stats["hits"] == calls + 1  # only the input check
+        assert tracker.get_stats()["total"] == 2
+
     print("\n" + "=" * 60)
     print("🎉 FULL PIPELINE TEST COMPLETE!")
-    print("\nBeanstalk AI successfully demonstrated:")
-    print("✅ Smart input handling")
-    print("✅ Story generation") 
-    print("✅ Research-backed quality evaluation")
-    print("✅ Story refinement")
-    print("✅ Interactive Q&A")
+
+
+def test_combined_judge_pipeline():
+    """In combined mode the judge writes the questions, saving one call per passing story"""
+    two_calls = recorded_model("pipeline")
+    combined = recorded_model("pipeline")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        separate_tracker = StoryTracker(os.path.join(tmp, "separate", "story_metrics.json"))
+        together_tracker = StoryTracker(os.path.join(tmp, "together", "story_metrics.json"))
+        separate_agents = build_agents(two_calls, separate_tracker)
+        together_agents = build_agents(combined, together_tracker, combined_judge=True)
+
+        for user_input in [MOUSE, "dragon"]:
+            separate = run_story(separate_agents, separate_tracker, [user_input, "Y", "", ""])
+            together = run_story(together_agents, together_tracker, [user_input, "Y", "", ""])
+            assert len(offered_questions(together)) == 3
+            assert offered_questions(together) != offered_questions(separate)
+
+        for kept_separate, kept_together in zip(separate_tracker.iter_stories(), together_tracker.iter_stories()):
+            assert kept_separate["evaluation"]["pass"] and kept_together["evaluation"]["pass"]
+            assert kept_separate["evaluation"]["overall"] == kept_together["evaluation"]["overall"]
+            assert kept_separate["refinement"]["rounds"] == kept_together["refinement"]["rounds"]
+
+    calls = lambda cassette: cassette.stats["hits"] + cassette.stats["recorded"]
+    assert calls(combined) == calls(two_calls) - 2
+
+
+def test_library_story_when_the_model_times_out():
+    """A model that can't answer in time gets a vetted library story, scores and all"""
+
+    def timing_out(prompt, max_tokens=3000, temperature=0.7, **kwargs):
+        raise TimeoutError("read timed out")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "story_metrics.json"))
+        output = run_story(build_agents(timing_out, tracker), tracker, ["a dragon who is afraid of the dark", ""])
+        assert "here's a favourite from the story library" in output
+        assert "Story Quality" in output
+        assert tracker.get_stats()["total"] == 0
+
+
+def test_library_story_when_the_judge_times_out():
+    """A story that was written but can't be judged in time is swapped for a library story"""
+    call_model = recorded_model("pipeline")
+
+    def judge_times_out(prompt, max_tokens=3000, temperature=0.7, **kwargs):
+        if prompt.startswith("You are an expert evaluator"):
+            raise TimeoutError("read timed out")
+        return call_model(prompt, max_tokens=max_tokens, temperature=temperature, **kwargs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "story_metrics.json"))
+        output = run_story(build_agents(judge_times_out, tracker), tracker, ["dragon", ""])
+        assert "here's a favourite from the story library" in output
+        assert "Story Quality" in output
+        assert tracker.get_stats()["total"] == 0
+
+
+def test_tenants_share_one_model_stack():
+    """The daemon passes one llm to every tenant's agents; caches and history stay per tenant"""
+    call_model = recorded_model("pipeline")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        smiths = StoryTracker(os.path.join(tmp, "smiths", "story_metrics.json"))
+        joneses = StoryTracker(os.path.join(tmp, "joneses", "story_metrics.json"))
+        smith_agents = build_agents(call_model, smiths)
+        llm = smith_agents["judge_system"].call_model
+        jones_agents = main.build_agents(joneses, llm)
+
+        assert all(jones_agents[name].call_model is llm
+                   for name in ["input_handler", "story_generator", "judge_system", "qa_agent"])
+        assert jones_agents["story_generator"].outline_cache is not smith_agents["story_generator"].outline_cache
+
+        run_story(jones_agents, joneses, ["dragon", "Y", "", ""])
+        assert joneses.get_stats()["total"] == 1 and smiths.get_stats()["total"] == 0
+
 
 if __name__ == "__main__":
-    test_full_pipeline()
\ No newline at end of file
+    test_full_pipeline()
+    test_combined_judge_pipeline()
+    test_library_story_when_the_model_times_out()
+    test_library_story_when_the_judge_times_out()
+    test_tenants_share_one_model_stack()
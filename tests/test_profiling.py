@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script for the opt-in stage profiler (cProfile, folded stacks, tracemalloc)
+"""
+
+import contextvars
+import json
+import os
+import pstats
+import random
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from utils import profiling
+from utils.profiling import Profiler, load_stages
+
+
+def busy_parse(seconds):
+    deadline = time.perf_counter() + seconds
+    blobs = []
+    while time.perf_counter() < deadline:
+        blobs.append(json.loads(json.dumps({"story": "Once upon a time " * 50})))
+    return len(blobs)
+
+
+def test_full_profile_separates_cpu_from_waiting():
+    with tempfile.TemporaryDirectory() as tmp:
+        profiler = Profiler(rate=1.0, mode="full", directory=tmp, session_id="session")
+        with profiler.stage("create_story.generate"):
+            busy_parse(0.15)
+            time.sleep(0.2)  # standing in for the model call
+            with profiler.stage("nested"):
+                pass
+
+        [record] = load_stages(os.path.join(tmp, "session"))
+        assert record["stage"] == "create_story.generate" and record["run"] == 1
+        assert record["cpu"] >= 0.05 and record["wait"] >= 0.15
+        assert abs(record["wall"] - record["cpu"] - record["wait"]) < 0.01
+        assert record["peak_memory"] > 0 and record["samples"] > 10
+        assert not tracemalloc.is_tracing()
+
+        base = os.path.join(tmp, "session", "create_story.generate-1")
+        functions = {name for _, _, name in pstats.Stats(base + ".pstats").stats}
+        assert "busy_parse" in functions
+        with open(base + ".folded", encoding="utf-8") as f:
+            folded = f.read().splitlines()
+        assert any("test_profiling.py:busy_parse" in line for line in folded)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded)
+        assert tracemalloc.Snapshot.load(base + ".tracemalloc").traces
+
+
+def test_sampling_and_modes():
+    with tempfile.TemporaryDirectory() as tmp:
+        off = Profiler(rate=0.0, directory=tmp, session_id="off")
+        with off.stage("report"):
+            busy_parse(0.01)
+        assert not os.path.exists(os.path.join(tmp, "off"))
+
+        random.seed(7)
+        sampled = Profiler(rate=0.25, mode="sample", directory=tmp, session_id="sampled")
+        for _ in range(40):
+            with sampled.stage("report"):
+                pass
+        records = load_stages(os.path.join(tmp, "sampled"))
+        assert 3 <= len(records) <= 20
+        assert records[-1]["files"] == [f"report-{len(records)}.folded"]
+
+        failing = Profiler(rate=1.0, mode="cpu", directory=tmp, session_id="failing")
+        try:
+            with failing.stage("batch_eval"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+        [record] = load_stages(os.path.join(tmp, "failing"))
+        assert record["error"] == "ValueError" and "peak_memory" not in record
+
+
+def test_session_profiler_stays_in_its_context():
+    with tempfile.TemporaryDirectory() as tmp:
+        session = Profiler(rate=1.0, mode="sample", directory=tmp, session_id="session")
+        process_wide = profiling.get_profiler()
+        with profiling.using(session):
+            with profiling.stage("create_story.generate"):
+                pass
+            # worker threads started with a copy of the context profile into the session too
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                assert pool.submit(profiling.get_profiler).result() is process_wide
+                assert pool.submit(contextvars.copy_context().run, profiling.get_profiler).result() is session
+        assert profiling.get_profiler() is process_wide
+        assert [record["stage"] for record in load_stages(os.path.join(tmp, "session"))] == ["create_story.generate"]
+
+
+if __name__ == "__main__":
+    test_full_profile_separates_cpu_from_waiting()
+    test_sampling_and_modes()
+    test_session_profiler_stays_in_its_context()
+    print("✨ Profiling test complete!")
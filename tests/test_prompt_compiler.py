@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script for prompt templates, token accounting and the cached-prefix metric
+"""
+
+import os
+from agents.input_handler import InputHandler
+from utils import metrics
+from utils.metrics import InstrumentedCall
+from utils.prompt_compiler import TEMPLATES, PromptTemplate, account, count_tokens, site_report
+from utils.prompts import JudgePrompts, QAPrompts, StoryGenerationPrompts
+
+STORY = {"title": "Pip's {Quiet} Night", "story": "Pip yawned.\n\nThe moon said \"goodnight\".", "moral": "Rest"}
+
+
+def value(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_every_prompt_starts_with_its_static_prefix():
+    prompts = [
+        StoryGenerationPrompts.generate_outline_prompt("a dragon who is afraid of the dark"),
+        StoryGenerationPrompts.write_story_from_outline_prompt({"outline": "o", "characters": "c"}, "in rhyme"),
+        StoryGenerationPrompts.story_patch_prompt(STORY, "Slow the ending down"),
+        StoryGenerationPrompts.story_refinement_prompt(STORY, "Slow the ending down"),
+        JudgePrompts.unified_evaluation_prompt(STORY),
+        JudgePrompts.evaluation_with_questions_prompt(STORY),
+        JudgePrompts.multi_story_evaluation_prompt([STORY, STORY]),
+        QAPrompts.generate_questions_prompt(STORY),
+        QAPrompts.answer_question_prompt("Where does the moon sleep?", STORY),
+    ]
+    for prompt in prompts:
+        template = prompt.template
+        assert prompt.startswith(template.prefix) and template.prefix_tokens == count_tokens(template.prefix)
+        # the story (braces and all) is only in the suffix
+        assert "Pip" not in template.prefix
+    assert "[2] The moon said" in prompts[2] and "=== Story 2 ===" in prompts[6]
+    assert "Pip's {Quiet} Night" in prompts[4]
+
+    report = site_report([{"prompt": str(p), "response": "ok"} for p in prompts] + [{"prompt": "hello"}])
+    assert report["JudgeSystem.evaluate_story"]["calls"] == 2
+    assert report["(unstructured)"] == {"calls": 1, "prefix": 0, "suffix": count_tokens("hello"), "response": 0}
+
+
+def test_prefix_cache_metric():
+    long_prefix = PromptTemplate("test_long", "Rules. " * 800, "Request - {request}")
+    assert long_prefix.prefix_tokens >= 1024 and TEMPLATES["test_long"] is long_prefix
+
+    def hits(result, template="test_long"):
+        return value("beanstalk_prompt_prefix_total", template=template, result=result)
+
+    account(long_prefix.render(request="an owl"), "test.site")
+    account(long_prefix.render(request="a whale"), "test.site")
+    assert (hits("miss"), hits("hit")) == (1, 1)
+    assert value("beanstalk_prompt_tokens_total", site="test.site", part="prefix") == 2 * long_prefix.prefix_tokens
+
+    os.environ["BEANSTALK_PREFIX_CACHE_TTL"] = "0"
+    try:
+        account(long_prefix.render(request="a fox"), "test.site")
+    finally:
+        del os.environ["BEANSTALK_PREFIX_CACHE_TTL"]
+    assert hits("miss") == 2
+
+    # through InstrumentedCall, under the agent's call site; today's prompts are below the 1024-token minimum
+    before = hits("short", "validation")
+    tokens = value("beanstalk_prompt_tokens_total", site="InputHandler.process_input", part="suffix")
+    InputHandler(InstrumentedCall(lambda prompt, **kwargs: '{"valid": true, "story_elements": "x"}')).process_input("owl")
+    assert hits("short", "validation") == before + 1
+    assert value("beanstalk_prompt_tokens_total", site="InputHandler.process_input", part="suffix") > tokens
+
+
+if __name__ == "__main__":
+    test_every_prompt_starts_with_its_static_prefix()
+    test_prefix_cache_metric()
+    print("✨ Prompt compiler test complete!")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test script for the budget-driven RefinementLoop and deadline propagation
+"""
+
+import time
+from utils.budget import Budget, BudgetedCall, BudgetExhausted
+from utils.refinement_loop import RefinementLoop
+
+
+def evaluation(overall, improvement="Add a calmer ending."):
+    return {"pass": overall >= 5, "overall": overall, "scores": {}, "improvement": improvement}
+
+
+class FakeGenerator:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def refine_story(self, story, improvement):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {**story, "story": story["story"] + " more"}
+
+
+class FakeJudge:
+    """Returns the next overall score from a script"""
+
+    def __init__(self, overalls):
+        self.overalls = list(overalls)
+
+    def evaluate_story(self, story):
+        return evaluation(self.overalls.pop(0))
+
+
+STORY = {"title": "Pip", "story": "Pip slept.", "moral": "Rest well."}
+
+
+def test_loop_stops_at_target_score():
+    generator = FakeGenerator()
+    loop = RefinementLoop(generator, FakeJudge([7.0, 8.5, 9.0]), target_score=8.0)
+    result = loop.run(STORY, evaluation(6.0))
+
+    assert result["rounds"] == 2
+    assert result["stop_reason"] == "target_reached"
+    assert result["evaluation"]["overall"] == 8.5
+    assert result["story"]["story"] == "Pip slept. more more"
+
+
+def test_loop_stops_on_plateau_and_keeps_best():
+    loop = RefinementLoop(FakeGenerator(), FakeJudge([7.0, 6.5]), target_score=9.5)
+    result = loop.run(STORY, evaluation(6.0))
+
+    assert result["rounds"] == 2
+    assert result["stop_reason"] == "plateau"
+    assert result["evaluation"]["overall"] == 7.0
+
+
+def test_loop_respects_wall_clock_budget():
+    generator = FakeGenerator(delay=0.15)
+    loop = RefinementLoop(generator, FakeJudge([6.5, 7.0, 7.5]), target_score=9.5, max_rounds=5)
+    result = loop.run(STORY, evaluation(6.0), Budget(seconds=0.25))
+
+    # the second round would not fit in what was left after the first
+    assert generator.calls == 1
+    assert result["stop_reason"] == "budget_exhausted"
+
+
+def test_loop_stops_when_refining_times_out():
+    class TimingOutGenerator:
+        def refine_story(self, story, improvement):
+            raise TimeoutError("read timed out")
+
+    judge = FakeJudge([9.0])
+    result = RefinementLoop(TimingOutGenerator(), judge, target_score=8.0).run(STORY, evaluation(6.0))
+
+    # no re-judge of an unchanged story; the judged original is kept
+    assert judge.overalls == [9.0]
+    assert result["stop_reason"] == "model_unavailable" and result["rounds"] == 0
+    assert result["story"] is STORY and result["evaluation"]["overall"] == 6.0
+
+
+def test_budgeted_call_propagates_deadline():
+    seen = []
+
+    def model(prompt, max_tokens=3000, temperature=0.7, timeout=None):
+        seen.append((max_tokens, timeout))
+        return "x" * 400
+
+    llm = BudgetedCall(model)
+    llm("no budget active", max_tokens=3000)
+    assert seen[-1] == (3000, None)
+
+    budget = Budget(seconds=10, tokens=1000, output_tokens_per_second=50)
+    with budget.activate():
+        llm("hello", max_tokens=3000)
+        max_tokens, timeout = seen[-1]
+        assert max_tokens <= 500 and 9 < timeout <= 10
+        assert budget.tokens_used == 101
+
+    with Budget(seconds=10, tokens=50).activate():
+        try:
+            llm("too little left", max_tokens=3000)
+            assert False, "expected BudgetExhausted"
+        except BudgetExhausted:
+            pass
+
+
+if __name__ == "__main__":
+    test_loop_stops_at_target_score()
+    test_loop_stops_on_plateau_and_keeps_best()
+    test_loop_respects_wall_clock_budget()
+    test_loop_stops_when_refining_times_out()
+    test_budgeted_call_propagates_deadline()
+    print("✨ RefinementLoop test complete!")
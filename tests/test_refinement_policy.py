@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test script for RefinementPolicy and the refinement history StoryTracker records
+"""
+
+import os
+import tempfile
+from utils.refinement_policy import RefinementPolicy
+from utils.story_tracker import StoryTracker
+
+
+def evaluation(score, overall=None):
+    scores = {
+        "bedtime_readiness": score,
+        "creative_spark": score,
+        "story_quality": score,
+        "age_readability": score,
+    }
+    return {"pass": score >= 5, "scores": scores, "overall": overall or score, "feedback": ""}
+
+
+def test_policy_refines_without_history():
+    policy = RefinementPolicy(min_samples=5)
+    refine, win_rate = policy.should_refine(evaluation(6.0), 550)
+    assert refine and win_rate is None
+
+
+def test_policy_learns_when_refinement_helps():
+    policy = RefinementPolicy(min_samples=10, neighbours=5, explore_rate=0.0)
+    # low drafts improve, high drafts don't
+    for _ in range(10):
+        policy.observe(evaluation(4.0)["scores"], 4.0, 400, 6.0)
+        policy.observe(evaluation(8.5)["scores"], 8.5, 600, 8.0)
+
+    refine_low, low_rate = policy.should_refine(evaluation(4.2), 420)
+    refine_high, high_rate = policy.should_refine(evaluation(8.4), 610)
+    assert refine_low and low_rate > 0.8
+    assert not refine_high and high_rate < 0.2
+
+
+def test_tracker_records_refinement_outcomes():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "metrics.json"))
+        story = {"title": "Pip", "story": "word " * 500, "moral": "Be kind."}
+
+        tracker.add_story(
+            story, evaluation(7.0), refinement={"initial_evaluation": evaluation(6.0), "rounds": 1}
+        )
+        tracker.add_story(
+            story, evaluation(8.0), refinement={"skipped": True, "predicted_win_rate": 0.2}
+        )
+
+        refinement = tracker.get_story(1)["refinement"]
+        assert refinement["attempted"] and refinement["kept"]
+        assert refinement["initial_overall"] == 6.0 and refinement["refined_overall"] == 7.0
+
+        stats = tracker.get_refinement_stats()
+        assert stats["attempted"] == 1 and stats["skipped"] == 1
+        assert stats["calls_saved"] == 2
+        assert stats["average_gain"] == 1.0
+        assert stats["estimated_forgone_gain"] == 0.2
+
+        policy = RefinementPolicy(min_samples=1).fit(tracker.refinement_history())
+        assert len(policy.examples) == 1
+
+
+if __name__ == "__main__":
+    test_policy_refines_without_history()
+    test_policy_learns_when_refinement_helps()
+    test_tracker_records_refinement_outcomes()
+    print("✨ RefinementPolicy test complete!")
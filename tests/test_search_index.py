@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Test script for full-text story search over the StoryTracker store
+"""
+
+import builtins
+import contextlib
+import io
+import os
+import tempfile
+import threading
+from datetime import datetime
+from utils.search_index import SearchIndex, parse_query
+from utils.story_tracker import StoryTracker
+
+
+def evaluation(overall):
+    return {
+        "pass": overall >= 7, "safety_passed": True, "reason": "", "overall": overall, "feedback": "",
+        "scores": {"bedtime_readiness": overall, "creative_spark": overall, "story_quality": overall,
+                   "age_readability": overall},
+        "length_check": {},
+    }
+
+
+def story(title, text, moral="Be kind."):
+    return {"title": title, "story": text, "moral": moral}
+
+
+def fill(tracker):
+    tracker.add_story(story("The Sleepy Dragon", "A dragon yawned under the stars. " * 40), evaluation(8.0),
+                      user_request="a dragon", user_liked=True)
+    tracker.add_story(story("Pip and the Library", "Pip the mouse read about dragons all night. " * 40),
+                      evaluation(6.0), user_request="a mouse")
+    tracker.add_story(story("Luna's Garden", "Luna planted moon flowers in the garden. " * 40), evaluation(9.0),
+                      user_request="a garden", user_liked=True)
+
+
+def test_ranked_search_with_filters():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "metrics.json"))
+        fill(tracker)
+
+        hits = tracker.search("dragons")
+        # the title and request match outweighs a mention in the text
+        assert [hit["id"] for hit in hits] == [1, 2]
+        assert hits[0]["search_score"] > hits[1]["search_score"]
+
+        assert [hit["id"] for hit in tracker.search("dragon", liked=False)] == [2]
+        assert [hit["id"] for hit in tracker.search("dragon", min_score=7)] == [1]
+        assert [hit["id"] for hit in tracker.search("", liked=True)] == [3, 1]
+        assert tracker.search("dragon", since=datetime(2999, 1, 1)) == []
+        assert tracker.search("unicorn") == []
+
+        report = os.path.join(tmp, "search.html")
+        tracker.generate_search_report("dragon", hits, report)
+        with open(report, encoding="utf-8") as f:
+            html = f.read()
+        assert "2 stories matching" in html and "The Sleepy Dragon" in html and "Luna" not in html
+
+
+def test_search_report_is_saved_with_the_tenant():
+    """Saved matches go beside the tenant's stories, not in the working directory"""
+    import main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "smiths", "story_metrics.json"))
+        fill(tracker)
+        replies = iter(["dragon", "Y", ""])
+        typed_input, cwd = builtins.input, os.getcwd()
+        builtins.input = lambda prompt="": next(replies)
+        output = io.StringIO()
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(output):
+                main.search_stories(tracker)
+        finally:
+            builtins.input = typed_input
+            os.chdir(cwd)
+
+        report = os.path.abspath(os.path.join(tracker.data_dir, "search_report.html"))
+        assert os.path.exists(report) and not os.path.exists(os.path.join(tmp, "search_report.html"))
+        assert f"Results saved as '{report}'" in output.getvalue()
+
+
+def test_index_persists_and_catches_up_with_the_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "metrics.json"))
+        fill(tracker)
+        tracker.search("dragon")  # loads the index, which then indexes new stories in memory
+        tracker.add_story(story("Dragon Dreams", "Soft dragon dreams. " * 40), evaluation(7.0))
+        assert tracker.search("dragon")[0]["id"] == 4
+
+        # a new process replays the log; a story written straight to the store is indexed from it
+        reopened = StoryTracker(os.path.join(tmp, "metrics.json"))
+        record = reopened.get_story(3)
+        record["id"] = 5
+        reopened.store.append(record)
+        index = SearchIndex(reopened.store)
+        assert len(index) == 5
+        assert [entry.id for entry, _ in index.search("luna")] == [5, 3]
+        assert os.path.exists(index.snapshot_file)
+
+        index.compact()
+        assert len(SearchIndex(reopened.store)) == 5
+
+
+def test_parse_query():
+    keywords, filters = parse_query("brave dragon liked:yes score>=7 creative>=8 since:2025-08-01 until:2025-08-31")
+    assert keywords == "brave dragon"
+    assert filters["liked"] is True and filters["min_score"] == 7.0
+    assert filters["min_scores"] == {"creative_spark": 8.0}
+    assert filters["since"] == datetime(2025, 8, 1) and filters["until"] == datetime(2025, 9, 1)
+    assert parse_query("time:later") == ("time:later", {})
+
+
+def test_sessions_sharing_an_index():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "metrics.json"))
+        fill(tracker)
+        # snapshot often, so searches replay and pickle while other threads add
+        tracker.search_index.compact_every = 3
+        errors = []
+
+        def write(writer):
+            try:
+                for i in range(10):
+                    tracker.add_story(story(f"Dragon {writer}-{i}", "A dragon hummed to the moon. " * 20),
+                                      evaluation(8.0), user_request=f"dragon {writer} {i}")
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                for _ in range(30):
+                    tracker.search("dragon moon")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(w,)) for w in range(2)]
+        threads += [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+
+        index = tracker.search_index
+        # every story's terms were added once: no position repeats in a posting list
+        assert len(index) == 23
+        for positions, _ in index.postings.values():
+            assert list(positions) == sorted(set(positions))
+        assert len(SearchIndex(tracker.store).search("dragon", limit=50)) == 22
+
+
+if __name__ == "__main__":
+    test_ranked_search_with_filters()
+    test_search_report_is_saved_with_the_tenant()
+    test_index_persists_and_catches_up_with_the_store()
+    test_sessions_sharing_an_index()
+    test_parse_query()
+    print("✨ Search test complete!")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for near-duplicate request detection with the SimilarityIndex
+"""
+
+import os
+import tempfile
+from utils.similarity_index import DUPLICATE_THRESHOLD, OUTLINE_THRESHOLD, POLARITY_WEIGHT, SimilarityIndex, embed
+from utils.story_tracker import StoryTracker
+
+
+def evaluation(overall):
+    return {
+        "pass": overall >= 7, "safety_passed": True, "reason": "", "overall": overall, "feedback": "",
+        "scores": {"bedtime_readiness": overall, "creative_spark": overall, "story_quality": overall,
+                   "age_readability": overall},
+        "length_check": {},
+    }
+
+
+def about(request, elements=None):
+    """A request as find_similar sees it: the raw request plus InputHandler's story elements"""
+    return f"{request} {elements or 'A story about ' + request}"
+
+
+# the calibration set for DUPLICATE_THRESHOLD and OUTLINE_THRESHOLD
+PARAPHRASES = [
+    (about("a dragon who loves books", "A story about a dragon who loves reading books"),
+     about("book-loving dragon", "A story about a dragon who loves books")),
+    (about("a girl named Luna and her dragon friend Max", "A story about a girl named Luna and her best friend Max, a dragon"),
+     about("Luna and her best friend Max who is a dragon", "A story about Luna and her dragon best friend Max")),
+    (about("a brave mouse", "A story about a brave little mouse"),
+     about("a mouse who is very brave", "A story about a very brave mouse")),
+    (about("a cat who wants to fly", "A story about a cat who dreams of flying"),
+     about("a cat that dreams of flying", "A story about a cat who wishes it could fly")),
+    (about("a boy named Pete who loves to play pickleball", "A story about a boy named Pete who loves playing pickleball"),
+     about("Pete loves pickleball", "A story about Pete, a boy who loves pickleball")),
+    (about("a robot who learns to paint", "A story about a friendly robot who learns to paint"),
+     about("robot learning to paint", "A story about a robot learning how to paint pictures")),
+    (about("an owl who is learning to read"), about("owl learns to read", "A story about a little owl learning to read books")),
+    (about("a mouse who lives in a library", "A story about a curious mouse who lives in a cozy library and loves books"),
+     about("library mouse", "A story about a mouse living in a library")),
+    (about("a princess who loves to dance"), about("a dancing princess who loves dancing")),
+    (about("a turtle who wants to win a race"), about("a turtle trying to win the race")),
+    (about("two best friends, a fox and a rabbit"), about("a fox and a rabbit who are best friends")),
+    (about("a unicorn at the beach"), about("a unicorn visiting the beach")),
+    (about("a dinosaur who goes to school"), about("a dinosaur going to school")),
+    (about("a penguin who is afraid of the water"), about("a penguin scared of the water")),
+]
+OPPOSITES = [
+    (about("a dragon who hates books", "A story about a dragon who hates reading books"),
+     about("a dragon who loves books", "A story about a dragon who loves reading books")),
+    (about("a puppy who is afraid of the dark", "A story about a puppy who is scared of the dark"),
+     about("a puppy who is not afraid of the dark", "A story about a brave puppy who is not afraid of the dark")),
+    (about("a happy whale", "A story about a happy whale in the ocean"), about("a sad whale", "A story about a sad whale in the ocean")),
+    (about("a tiny elephant"), about("a giant elephant")),
+    (about("a cat who likes baths", "A story about a cat who likes taking baths"),
+     about("a cat who doesn't like baths", "A story about a cat who doesn't like taking baths")),
+    (about("a noisy owl", "A story about a noisy owl who hoots all night"),
+     about("a quiet owl", "A story about a quiet owl who hoots softly at night")),
+    (about("a brave knight"), about("a scared knight")),
+    (about("a fast turtle"), about("a slow turtle")),
+    (about("a dog who loves bath time"), about("a dog who hates bath time")),
+    (about("a grumpy bear"), about("a cheerful bear")),
+]
+# the same character in a different story: neither the story nor its outline fits
+DIFFERENT = [
+    (about("a dragon who loves books", "A story about a dragon who loves reading books"),
+     about("a dragon who loves to bake", "A story about a dragon who loves baking cakes")),
+    (about("a robot who learns to paint", "A story about a friendly robot who learns to paint"),
+     about("a robot who learns to dance", "A story about a friendly robot who learns to dance")),
+    (about("a bunny who builds a treehouse"), about("a bunny who plants a garden")),
+    (about("a princess who loves to dance"), about("a princess who loves to sing")),
+    (about("a fox who loves the snow"), about("a fox who loves the sea")),
+    (about("a unicorn at the beach"), about("a unicorn in the forest")),
+    (about("a dinosaur who goes to school"), about("a dinosaur who goes to the moon")),
+    (about("a penguin who is afraid of the water"), about("a penguin who is afraid of the dark")),
+    (about("a dragon who loves books"), about("a brave mouse", "A story about a brave mouse in a library")),
+]
+
+
+def similarity(a, b):
+    return float(embed(a) @ embed(b))
+
+
+def test_thresholds_separate_paraphrases_from_new_ideas():
+    for a, b in PARAPHRASES:
+        assert similarity(a, b) >= DUPLICATE_THRESHOLD, (a, b, similarity(a, b))
+    for a, b in OPPOSITES + DIFFERENT:
+        assert similarity(a, b) < OUTLINE_THRESHOLD, (a, b, similarity(a, b))
+    # an opposite keeps everything else in common, yet scores well below the outline threshold
+    assert similarity(*OPPOSITES[0]) <= 1 - 2 * POLARITY_WEIGHT + 1e-6 < OUTLINE_THRESHOLD
+
+
+def test_tracker_finds_earlier_passing_stories():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "metrics.json"))
+        story = {"title": "Ember's Library", "story": "word " * 500, "moral": "Read."}
+        outline = {"outline": "Ember reads.", "characters": "Ember", "instruction": "Calm."}
+        tracker.add_story(story, evaluation(8.0), user_request="a dragon who loves books",
+                          story_elements="A story about a dragon who loves reading books", outline=outline)
+        tracker.add_story(dict(story, title="Failed"), evaluation(4.0), user_request="a dragon who loves books")
+        tracker.add_story(dict(story, title="Pip"), evaluation(8.0), user_request="a brave mouse",
+                          story_elements="A story about a brave mouse")
+
+        matches = tracker.find_similar("book-loving dragon", "A story about a dragon who loves books")
+        # the failed story with the same request is never offered
+        assert matches[0]["id"] == 1 and matches[0]["similarity"] >= DUPLICATE_THRESHOLD
+        assert matches[0]["outline"] == outline
+        assert all(match["id"] != 2 for match in matches)
+        # the opposite wish gets neither the story nor its outline
+        opposite = tracker.find_similar("a dragon who hates books", "A story about a dragon who hates reading books")
+        assert opposite[0]["id"] == 1 and opposite[0]["similarity"] < OUTLINE_THRESHOLD
+        assert tracker.find_similar("a unicorn at the beach")[0]["similarity"] < OUTLINE_THRESHOLD
+
+        # stories stored without a vector (e.g. imported history) are embedded on the next search
+        record = tracker.get_story(3)
+        record["id"] = 4
+        tracker.store.append(record)
+        index = SimilarityIndex(tracker.store)
+        assert {position for position, _ in index.search("brave mouse", k=2)} == {2, 3}
+        assert len(index) == 4
+
+
+if __name__ == "__main__":
+    test_thresholds_separate_paraphrases_from_new_ideas()
+    test_tracker_finds_earlier_passing_stories()
+    print("✨ SimilarityIndex test complete!")
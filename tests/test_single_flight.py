@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test script for SingleFlight request coalescing
+"""
+
+import asyncio
+import threading
+import time
+from utils.single_flight import SingleFlight
+
+
+class SlowModel:
+    """Fake LLM call that blocks long enough for callers to overlap"""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7, timeout=None) -> str:
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if "explode" in prompt:
+            raise RuntimeError("upstream failed")
+        return f'{{"echo": "{prompt}", "max_tokens": {max_tokens}}}'
+
+
+def test_threaded_callers_share_one_call():
+    model = SlowModel()
+    llm = SingleFlight(model)
+    results = []
+
+    def worker():
+        results.append(llm("judge this story", max_tokens=1000, temperature=0.3))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert model.calls == 1
+    assert len(set(results)) == 1 and len(results) == 8
+
+    stats = llm.get_stats()
+    assert stats["calls"] == 8
+    assert stats["upstream_calls"] == 1
+    assert stats["coalesced"] == 7
+    assert stats["in_flight"] == 0
+
+
+def test_different_params_are_not_coalesced():
+    model = SlowModel(delay=0.05)
+    llm = SingleFlight(model)
+
+    threads = [
+        threading.Thread(target=llm, args=("same prompt",), kwargs={"temperature": t})
+        for t in (0.3, 0.7)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert model.calls == 2
+    assert llm.get_stats()["coalesced"] == 0
+
+
+def test_budgeted_max_tokens_still_coalesce():
+    model = SlowModel(delay=0.2)
+    llm = SingleFlight(model)
+    results = {}
+
+    def call(max_tokens):
+        results[max_tokens] = llm("same prompt", max_tokens=max_tokens)
+
+    # callers whose budgets left them fewer tokens join the flight that asked for more
+    leader = threading.Thread(target=call, args=(1000,))
+    leader.start()
+    time.sleep(0.05)
+    shrunk = [threading.Thread(target=call, args=(n,)) for n in (600, 900)]
+    for t in shrunk:
+        t.start()
+    time.sleep(0.05)
+    # a caller that needs more than the flight asked for runs its own call
+    larger = threading.Thread(target=call, args=(1500,))
+    larger.start()
+    for t in [leader, larger] + shrunk:
+        t.join()
+
+    assert model.calls == 2 and llm.get_stats()["coalesced"] == 2
+    assert results[600] == results[900] == results[1000] != results[1500]
+    assert llm.get_stats()["in_flight"] == 0
+
+
+def test_asyncio_callers_share_one_call():
+    model = SlowModel()
+    llm = SingleFlight(model)
+
+    async def run():
+        return await asyncio.gather(*[llm.acall("validate dragon") for _ in range(5)])
+
+    results = asyncio.run(run())
+    assert model.calls == 1
+    assert len(set(results)) == 1
+    assert llm.get_stats()["coalesced"] == 4
+
+
+def test_errors_reach_every_waiter():
+    model = SlowModel()
+    llm = SingleFlight(model)
+    errors = []
+
+    def worker():
+        try:
+            llm("explode please")
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert model.calls == 1
+    assert len(errors) == 4
+    assert llm.get_stats()["errors"] == 1
+
+    # a finished flight is not reused
+    assert llm("fine now") != llm("fine now again")
+    assert model.calls == 3
+
+
+def test_cancelled_leader_does_not_strand_waiters():
+    model = SlowModel()
+    llm = SingleFlight(model)
+
+    async def run():
+        leader = asyncio.ensure_future(llm.acall("p"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(llm.acall("p"))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        # the follower runs the call itself instead of waiting on the abandoned flight
+        result = await asyncio.wait_for(follower, 2)
+        assert llm.get_stats()["in_flight"] == 0
+        return result, await asyncio.wait_for(llm.acall("p"), 2)
+
+    results = asyncio.run(run())
+    assert results[0] == results[1] and model.calls == 3
+
+
+def test_waiters_keep_their_own_timeout():
+    model = SlowModel(delay=0.5)
+    llm = SingleFlight(model)
+    leader = threading.Thread(target=llm, args=("slow story",), kwargs={"timeout": 30})
+    leader.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    try:
+        llm("slow story", timeout=0.1)
+        assert False, "the waiter should give up at its own deadline"
+    except TimeoutError:
+        pass
+    assert time.monotonic() - started < 0.4
+
+    async def wait():
+        await llm.acall("slow story", timeout=0.1)
+
+    try:
+        asyncio.run(wait())
+        assert False, "the async waiter should give up at its own deadline"
+    except TimeoutError:
+        pass
+    leader.join()
+    assert model.calls == 1 and llm.get_stats()["in_flight"] == 0
+
+
+if __name__ == "__main__":
+    test_threaded_callers_share_one_call()
+    test_different_params_are_not_coalesced()
+    test_budgeted_max_tokens_still_coalesce()
+    test_asyncio_callers_share_one_call()
+    test_errors_reach_every_waiter()
+    test_cancelled_leader_does_not_strand_waiters()
+    test_waiters_keep_their_own_timeout()
+    print("✨ SingleFlight test complete!")
@@ -3,31 +3,10 @@
 Test script for StoryGenerator
 """
 
-import os
-import openai
-from dotenv import load_dotenv
 from agents.story_generator import StoryGenerator
+from tests.recorded_model import recorded_model
 
-# Load environment variables
-load_dotenv()
-
-def call_model(prompt: str, max_tokens=3000, temperature=0.1) -> str:
-    """LLM call function"""
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    
-    if not openai.api_key:
-        print("❌ No OpenAI API key found. Please add OPENAI_API_KEY to your .env file")
-        return '{"title": "Mock Story", "story": "This is a mock story for testing without API key.", "moral": "Always test your code!"}'
-    
-    # Real OpenAI call
-    resp = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        stream=False,
-        max_tokens=max_tokens,
-        temperature=temperature,
-    )
-    return resp.choices[0].message["content"]
+call_model = recorded_model("story_generator")
 
 def test_story_generator():
     """Test the StoryGenerator with different story requests"""
@@ -47,26 +26,120 @@ def test_story_generator():
         print(f"\n{i}. Generating story for: '{request}'")
         print("-" * 50)
         
-        try:
-            story = generator.generate_story(request)
-            
-            print(f"📚 TITLE: {story['title']}")
-            print(f"\n📖 STORY:")
-            print(story['story'])
-            print(f"\n💭 MORAL: {story['moral']}")
-            print(f"\n📊 STATS:")
-            print(f"   Word count: {len(story['story'].split())} words")
-            print(f"   Character count: {len(story['story'])} characters")
-            
-            # Ask if user wants to see the next one
-            if i < len(test_requests):
-                input(f"\n✨ Press Enter to generate the next story...")
-                
-        except Exception as e:
-            print(f"💥 ERROR: {e}")
-    
+        story, outline = generator.generate_story(request)
+
+        print(f"🗺️ OUTLINE: {outline['outline'][:120]}...")
+        print(f"📚 TITLE: {story['title']}")
+        print(f"\n📖 STORY:")
+        print(story['story'])
+        print(f"\n💭 MORAL: {story['moral']}")
+        print(f"\n📊 STATS:")
+        print(f"   Word count: {len(story['story'].split())} words")
+        print(f"   Character count: {len(story['story'])} characters")
+
+        assert all(outline.get(key) for key in ["outline", "characters", "instruction"])
+        assert all(story.get(key) for key in ["title", "story", "moral"])
+        # stories always come back split into paragraphs, even when the model writes one block
+        assert "\n\n" in story["story"]
+        assert story["title"] != "A Magical Adventure"
+
     print("\n" + "=" * 60)
     print("✨ StoryGenerator test complete!")
 
+PATCH_STORY = {
+    "title": "Pip and the Quiet Library",
+    "story": "Pip the mouse lived in the library.\n\n\"Hello,\" said Pip to the owl.\n\nThey read until the moon rose.\n\nPip curled up and fell asleep.",
+    "moral": "Books make good friends.",
+}
+
+
+def test_refine_story_applies_paragraph_edits():
+    """Patch mode edits only the numbered paragraphs the model targets"""
+    prompts = []
+
+    def patch_model(prompt: str, max_tokens=3000, temperature=0.1) -> str:
+        prompts.append((prompt, max_tokens))
+        return '{"edits": [{"paragraph": 3, "action": "replace", "text": "They read softly until the silver moon rose."}, {"paragraph": 4, "action": "insert_after", "text": "The library hummed a gentle lullaby."}]}'
+
+    generator = StoryGenerator(patch_model)
+    refined = generator.refine_story(PATCH_STORY, "Make the ending calmer.")
+
+    paragraphs = refined["story"].split("\n\n")
+    assert paragraphs[2] == "They read softly until the silver moon rose."
+    assert paragraphs[-1] == "The library hummed a gentle lullaby."
+    assert paragraphs[0] == "Pip the mouse lived in the library."
+    assert refined["title"] == PATCH_STORY["title"]
+    assert "[3] They read until the moon rose." in prompts[0][0]
+    assert prompts[0][1] < 3000
+    assert generator.refine_stats == {"patched": 1, "patch_failed": 0, "full": 0}
+
+
+def test_refine_story_falls_back_to_full_rewrite():
+    """Invalid edits are rejected and the story is rewritten in full"""
+
+    def bad_patch_model(prompt: str, max_tokens=3000, temperature=0.1) -> str:
+        if "numbered" in prompt:
+            return '{"edits": [{"paragraph": 9, "action": "replace", "text": "Out of range"}]}'
+        return '{"title": "Pip and the Quiet Library", "story": "A fully rewritten story.", "moral": "Books make good friends."}'
+
+    generator = StoryGenerator(bad_patch_model)
+    refined = generator.refine_story(PATCH_STORY, "Make the ending calmer.")
+
+    assert refined["story"] == "A fully rewritten story."
+    assert generator.refine_stats == {"patched": 0, "patch_failed": 1, "full": 1}
+
+
+def test_refine_story_lets_timeouts_through():
+    """An exhausted budget or a timeout reaches the caller instead of returning the story unchanged"""
+    from utils.budget import BudgetExhausted
+
+    for error in (BudgetExhausted("no time left"), TimeoutError("read timed out")):
+        def failing_model(prompt: str, max_tokens=3000, temperature=0.1) -> str:
+            raise error
+
+        generator = StoryGenerator(failing_model)
+        try:
+            generator.refine_story(PATCH_STORY, "Make the ending calmer.")
+            assert False, f"expected {type(error).__name__}"
+        except TimeoutError as e:
+            assert e is error
+        assert generator.refine_stats == {"patched": 0, "patch_failed": 0, "full": 0}
+
+
+def test_generate_story_reuses_a_given_outline():
+    """A reused outline skips the outline call and is returned unchanged"""
+    prompts = []
+
+    def story_model(prompt: str, max_tokens=3000, temperature=0.7) -> str:
+        prompts.append(prompt)
+        return '{"title": "Pip and the Quiet Library", "story": "Pip read until he fell asleep.", "moral": "Books make good friends."}'
+
+    outline = {"outline": "Pip reads in the library.", "characters": "Pip", "instruction": "Keep it calm."}
+    story, used_outline = StoryGenerator(story_model).generate_story("A mouse in a library", outline)
+
+    assert len(prompts) == 1 and "Pip reads in the library." in prompts[0]
+    assert used_outline == outline
+    assert story["title"] == "Pip and the Quiet Library"
+
+
+def test_generate_variants_with_no_count_calls_nothing():
+    """Asking for no variants returns none without writing an outline"""
+    prompts = []
+
+    def story_model(prompt: str, max_tokens=3000, temperature=0.7) -> str:
+        prompts.append(prompt)
+        return "{}"
+
+    outline = {"outline": "Pip reads in the library.", "characters": "Pip", "instruction": "Keep it calm."}
+    generator = StoryGenerator(story_model)
+    assert generator.generate_variants("A mouse in a library", count=0, outline=outline) == ([], outline)
+    assert generator.generate_variants("A mouse in a library", count=-1) == ([], {})
+    assert prompts == []
+
+
 if __name__ == "__main__":
-    test_story_generator()
\ No newline at end of file
+    test_story_generator()
+    test_refine_story_applies_paragraph_edits()
+    test_refine_story_falls_back_to_full_rewrite()
+    test_refine_story_lets_timeouts_through()
+    test_generate_story_reuses_a_given_outline()
\ No newline at end of file
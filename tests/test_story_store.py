@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Test script for the offset-indexed StoryStore and the StoryTracker built on it
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+from utils.story_store import INDEX_ENTRY, INDEX_ENTRY_V1, INDEX_HEADER, INDEX_MAGIC, StoryStore
+from utils.story_tracker import StoryTracker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def record(story_id, overall=7.0, liked=False):
+    return {
+        "id": story_id,
+        "timestamp": "2025-08-04T16:31:38.332540",
+        "user_request": f"request {story_id}",
+        "user_liked": liked,
+        "story": {"title": f"Story {story_id}", "content": "Once upon a time. " * 50, "moral": "m", "word_count": 200},
+        "evaluation": {
+            "pass": overall >= 5, "safety_passed": True, "reason": "", "overall": overall, "feedback": "",
+            "scores": {"bedtime_readiness": overall, "creative_spark": overall, "story_quality": overall, "age_readability": overall},
+            "length_check": {},
+        },
+    }
+
+
+def test_store_indexes_and_reads_records():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StoryStore(tmp)
+        for story_id in (1, 2, 5, 9):
+            store.append(record(story_id, overall=story_id, liked=story_id % 2 == 1))
+
+        assert len(store) == 4 and store.last_id() == 9
+        entry = store.find(5)
+        assert entry.overall == 5.0 and entry.liked and entry.passed and entry.word_count == 200
+        assert store.find(3) is None
+        assert store.get(9)["story"]["title"] == "Story 9"
+        assert [e.id for e in store.entries(newest_first=True)] == [9, 5, 2, 1]
+
+        # a second handle sees appends made through the first
+        reader = StoryStore(tmp)
+        store.append(record(10))
+        assert reader.get(10)["user_request"] == "request 10"
+        assert [r["id"] for r in reader.iter_records()] == [1, 2, 5, 9, 10]
+
+
+def test_index_keeps_the_initial_word_count():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StoryStore(tmp)
+        refined = record(1)
+        refined["refinement"] = {"attempted": True, "kept": True, "initial_overall": 6.0, "initial_word_count": 420}
+        store.append(refined)
+        store.append(record(2))
+        # the policy learns from the draft it was asked about, not the refined story
+        assert store.find(1).refinement()["initial_word_count"] == 420 and store.find(1).word_count == 200
+        assert store.find(2).refinement()["initial_word_count"] == 200
+
+        # a version 1 index (entries without the field) is rewritten when the store is opened
+        with open(store.index_file, "rb") as f:
+            data = f.read()
+        entries = [data[INDEX_HEADER.size + n * INDEX_ENTRY.size:][:INDEX_ENTRY_V1.size] for n in range(2)]
+        with open(store.index_file, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, 1) + b"".join(entries))
+        upgraded = StoryStore(tmp)
+        assert len(upgraded) == 2 and upgraded.find(1).refinement()["initial_word_count"] == 420
+        assert upgraded.get(2)["story"]["title"] == "Story 2"
+        with open(store.index_file, "rb") as f:
+            assert f.read() == data
+
+
+def test_tracker_imports_legacy_history_and_keeps_summary():
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "story_metrics.json")
+        shutil.copy(os.path.join(ROOT, "story_metrics.json"), legacy)
+
+        tracker = StoryTracker(legacy)
+        stats = tracker.get_stats()
+        imported = stats["total"]
+        assert imported > 0
+        assert os.path.exists(os.path.join(tmp, "story_metrics_store", "stories.idx"))
+        assert tracker.get_story(1)["user_request"]
+
+        tracker.add_story({"title": "Pip", "story": "word " * 500, "moral": "Be kind."},
+                          record(0, overall=9.0)["evaluation"], user_request="a mouse", user_liked=True)
+        assert tracker.get_story(imported + 1)["story"]["title"] == "Pip"
+
+        # a fresh tracker answers from the summary without re-importing
+        reopened = StoryTracker(legacy)
+        assert reopened.get_stats()["total"] == imported + 1
+        assert reopened.get_stats() == tracker.get_stats()
+        # ... and without opening the store
+        assert reopened._store is None
+
+        report = os.path.join(tmp, "report.html")
+        reopened.generate_html_report(report)
+        with open(report, encoding="utf-8") as f:
+            html = f.read()
+        assert html.index(f"#{imported + 1}: Pip") < html.index("#1: ")
+        assert html.rstrip().endswith("</html>")
+
+
+def test_empty_history_reads_no_store_at_startup():
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = StoryTracker(os.path.join(tmp, "story_metrics.json"))
+        assert tracker.get_stats()["total"] == 0
+        # no legacy file and no store: nothing is opened or created
+        assert tracker._store is None and not os.path.exists(tracker.data_dir)
+
+        legacy = os.path.join(tmp, "old.json")
+        with open(legacy, "w", encoding="utf-8") as f:
+            f.write("[]")
+        assert StoryTracker(legacy).get_stats()["total"] == 0
+        # the empty legacy file was read once; its summary now answers for the empty store
+        os.remove(legacy)
+        with open(legacy, "w", encoding="utf-8") as f:
+            f.write("not json, and not read again")
+        again = StoryTracker(legacy)
+        assert again.get_stats()["total"] == 0 and again._store is None
+
+
+def add_stories(storage_file, writer, count):
+    tracker = StoryTracker(storage_file)
+    for i in range(count):
+        tracker.add_story({"title": f"Writer {writer} story {i}", "story": "A quiet night. " * 20, "moral": "m"},
+                          record(0, overall=5.0 + writer)["evaluation"], user_request=f"writer {writer} request {i}")
+
+
+def test_concurrent_writers_get_unique_ids():
+    writers, per_writer = 4, 25
+    with tempfile.TemporaryDirectory() as tmp:
+        storage_file = os.path.join(tmp, "story_metrics.json")
+        processes = [multiprocessing.Process(target=add_stories, args=(storage_file, w, per_writer))
+                     for w in range(writers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert all(process.exitcode == 0 for process in processes)
+
+        tracker = StoryTracker(storage_file)
+        total = writers * per_writer
+        assert [e.id for e in tracker.store.entries()] == list(range(1, total + 1))
+        titles = {r["story"]["title"] for r in tracker.iter_stories()}
+        assert len(titles) == total
+        # summary, search log and similarity rows all stayed in step with the index
+        assert tracker.get_stats()["total"] == total
+        assert tracker._summarize(tracker.store.entries()) == tracker.summary()
+        assert len(tracker.search_index) == total
+        assert len(tracker.similarity_index) == total
+        hit = tracker.search("writer 2 request 7")[0]
+        assert hit["user_request"] == "writer 2 request 7"
+
+
+if __name__ == "__main__":
+    test_store_indexes_and_reads_records()
+    test_index_keeps_the_initial_word_count()
+    test_tracker_imports_legacy_history_and_keeps_summary()
+    test_empty_history_reads_no_store_at_startup()
+    test_concurrent_writers_get_unique_ids()
+    print("✨ StoryStore test complete!")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for per-tenant story shards and the LRU of open shards
+"""
+
+import os
+import tempfile
+import threading
+from utils.tenant_router import DEFAULT_TENANT, TenantRouter, tenant_dir
+
+SCORES = {"bedtime_readiness": 8, "creative_spark": 7, "story_quality": 8, "age_readability": 8}
+
+
+def add(tracker, title, overall=8.0, passed=True):
+    tracker.add_story(
+        story={"title": title, "story": f"{title} yawned and curled up under the stars. " * 40, "moral": "Rest"},
+        evaluation={"pass": passed, "safety_passed": True, "scores": SCORES, "overall": overall},
+        user_request=title.lower(),
+    )
+
+
+def test_tenants_are_isolated():
+    with tempfile.TemporaryDirectory() as tmp:
+        router = TenantRouter(os.path.join(tmp, "story_metrics.json"))
+        smiths, jones = router.tracker("smith-family"), router.tracker("jones@example.com")
+        add(smiths, "The Sleepy Owl")
+        add(smiths, "The Noisy Drum", overall=4.0, passed=False)
+        add(jones, "The Quiet Whale")
+
+        assert smiths.data_dir == tenant_dir(router.data_dir, "smith-family") != jones.data_dir
+        assert smiths.data_dir.startswith(os.path.join(router.data_dir, "tenants"))
+        # each shard numbers its own stories and searches only its own
+        assert [s["id"] for s in jones.iter_stories()] == [1]
+        assert [s["story"]["title"] for s in jones.search("owl")] == []
+        assert [s["story"]["title"] for s in smiths.search("owl")] == ["The Sleepy Owl"]
+
+        stats = router.stats()
+        # no default history was written, so only the two tenants are listed
+        assert set(stats) == {"jones@example.com", "smith-family"}
+        assert stats["smith-family"]["total"] == 2 and stats["smith-family"]["passed"] == 1
+        assert stats["jones@example.com"]["total"] == 1
+
+        report = os.path.join(tmp, "report.html")
+        smiths.generate_html_report(report)
+        with open(report, encoding="utf-8") as f:
+            page = f.read()
+        assert "The Sleepy Owl" in page and "The Quiet Whale" not in page
+
+        assert router.tracker(None).data_dir == router.data_dir == tenant_dir(router.data_dir, DEFAULT_TENANT)
+        for bad in ("../escape", ".hidden", "a/b", ""):
+            try:
+                tenant_dir(router.data_dir, bad)
+                assert False, bad
+            except ValueError:
+                pass
+
+
+def test_lru_closes_least_recent_shard():
+    with tempfile.TemporaryDirectory() as tmp:
+        router = TenantRouter(os.path.join(tmp, "story_metrics.json"), max_open=2)
+        first = router.tracker("family-1")
+        add(first, "The Sleepy Owl")
+        router.tracker("family-2")
+        assert router.tracker("family-1") is first  # a hit moves it to the front
+        router.tracker("family-3")
+
+        assert list(router._open) == ["family-1", "family-3"]
+        # opening a shard touches no files until it is used
+        assert not os.path.exists(tenant_dir(router.data_dir, "family-2"))
+
+        router.tracker("family-4")
+        assert "family-1" not in router._open and first._store._mapping[0] is None
+        # a caller still holding an evicted shard reopens its files on next use
+        add(first, "The Quiet Whale")
+        assert first.get_stats()["total"] == 2 and router.tracker("family-1").get_stats()["total"] == 2
+        router.close()
+        assert not router._open
+
+
+def test_busy_shards_stay_open():
+    with tempfile.TemporaryDirectory() as tmp:
+        router = TenantRouter(os.path.join(tmp, "story_metrics.json"), max_open=1)
+        with router.using("family-1") as first:
+            add(first, "The Sleepy Owl")
+            with router.using("family-2"):
+                router.tracker("family-3")
+                # family-3 went idle as soon as it was opened; both sessions keep theirs
+                assert list(router._open) == ["family-1", "family-2", "family-3"]
+                router.tracker("family-4")
+                assert list(router._open) == ["family-1", "family-2", "family-4"]
+            assert list(router._open) == ["family-1", "family-4"]
+            assert first._store._mapping[0] is not None
+        # the surplus is closed once the sessions end, least recent first
+        assert list(router._open) == ["family-4"] and first._store._mapping[0] is None
+
+        # writers and readers on more tenants than max_open, each holding its shard
+        errors = []
+
+        def write(tenant):
+            try:
+                for i in range(15):
+                    with router.using(tenant) as tracker:
+                        add(tracker, f"Story {i}")
+                        assert len(list(tracker.iter_stories())) == i + 1
+            except Exception as e:
+                errors.append(e)
+
+        writers = [threading.Thread(target=write, args=(f"writer-{n}",)) for n in range(3)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        assert not errors, errors
+        assert [router.tracker(f"writer-{n}").get_stats()["total"] for n in range(3)] == [15, 15, 15]
+
+
+if __name__ == "__main__":
+    test_tenants_are_isolated()
+    test_lru_closes_least_recent_shard()
+    test_busy_shards_stay_open()
+    print("✨ Tenant router test complete!")
@@ -0,0 +1,202 @@
+import html
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.story_store import (
+    INDEX_ENTRY, INDEX_HEADER, LIKED, PASSED, REFINE_ATTEMPTED, REFINE_KEPT, REFINE_SKIPPED,
+    SAFETY_PASSED, SCORE_DIMENSIONS, StoryStore,
+)
+
+# Column view of the story index; must match INDEX_ENTRY byte for byte
+INDEX_DTYPE = np.dtype([
+    ("id", "<u8"), ("offset", "<u8"), ("length", "<u4"), ("word_count", "<u4"), ("timestamp", "<f8"),
+    *[(dim, "<f4") for dim in SCORE_DIMENSIONS], ("overall", "<f4"),
+    *[(f"initial_{dim}", "<f4") for dim in SCORE_DIMENSIONS], ("initial_overall", "<f4"),
+    ("predicted_win_rate", "<f4"), ("flags", "u1"), ("_pad", "V3"), ("initial_word_count", "<u4"),
+])
+assert INDEX_DTYPE.itemsize == INDEX_ENTRY.size
+
+SCORE_COLUMNS = SCORE_DIMENSIONS + ["overall"]
+TREND_PERIODS = {"day": "datetime64[D]", "week": "datetime64[W]", "month": "datetime64[M]"}
+
+
+def load_index(store: StoryStore) -> np.ndarray:
+    """Memory-map the store's index as a structured array (no copy, pages load on demand)"""
+    count = len(store)
+    if not count:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.memmap(store.index_file, dtype=INDEX_DTYPE, mode="r", offset=INDEX_HEADER.size, shape=(count,))
+
+
+def _correlation(x: np.ndarray, y: np.ndarray) -> Optional[float]:
+    """Pearson correlation, None when either side is constant"""
+    if len(x) < 2 or x.std() == 0 or y.std() == 0:
+        return None
+    return round(float(np.corrcoef(x, y)[0, 1]), 3)
+
+
+class StoryAnalytics:
+    """
+    Vectorized statistics over the story index: score distributions, trends,
+    like-rate vs score and refinement outcomes. Only the columns a statistic
+    needs are read, so cost stays proportional to rows x columns touched.
+    """
+
+    def __init__(self, index: np.ndarray):
+        self.index = index
+        flags = index["flags"]
+        self.scored = (flags & SAFETY_PASSED) != 0
+        self.liked = (flags & LIKED) != 0
+        self.passed = (flags & PASSED) != 0
+
+    @classmethod
+    def from_store(cls, store: StoryStore) -> "StoryAnalytics":
+        return cls(load_index(store))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def score_distributions(self) -> Dict:
+        """Per-dimension histogram over whole points 0-10 plus mean and percentiles (safety failures excluded)"""
+        distributions = {}
+        for column in SCORE_COLUMNS:
+            scores = np.asarray(self.index[column])[self.scored]
+            if not len(scores):
+                distributions[column] = {"histogram": [0] * 11, "mean": 0, "p10": 0, "median": 0, "p90": 0}
+                continue
+            points = np.clip(np.rint(scores), 0, 10).astype(np.intp)
+            p10, median, p90 = np.percentile(scores, [10, 50, 90])
+            distributions[column] = {
+                "histogram": np.bincount(points, minlength=11).tolist(),
+                "mean": round(float(scores.mean()), 2),
+                "p10": round(float(p10), 1),
+                "median": round(float(median), 1),
+                "p90": round(float(p90), 1),
+            }
+        return distributions
+
+    def trends(self, period: str = "week", limit: int = 12) -> List[Dict]:
+        """Story count, average overall, pass rate and like rate per period, oldest first"""
+        if not len(self):
+            return []
+        seconds = np.asarray(self.index["timestamp"]).astype("datetime64[s]")
+        buckets = seconds.astype(TREND_PERIODS[period])
+        starts, inverse, counts = np.unique(buckets, return_inverse=True, return_counts=True)
+
+        overall = np.bincount(inverse, weights=self.index["overall"])
+        passed = np.bincount(inverse, weights=self.passed)
+        liked = np.bincount(inverse, weights=self.liked)
+
+        rows = []
+        for i in range(max(0, len(starts) - limit), len(starts)):
+            rows.append({
+                "period": str(starts[i]),
+                "stories": int(counts[i]),
+                "average_score": round(float(overall[i] / counts[i]), 2),
+                "pass_rate": round(float(passed[i] / counts[i]) * 100, 1),
+                "liked_percentage": round(float(liked[i] / counts[i]) * 100, 1),
+            })
+        return rows
+
+    def like_correlation(self) -> Dict:
+        """Correlation between liking a story and each score, and like rate per overall score band"""
+        liked = self.liked.astype(np.float64)
+        correlations = {column: _correlation(np.asarray(self.index[column], dtype=np.float64), liked)
+                        for column in SCORE_COLUMNS}
+
+        bands = np.clip(np.floor(self.index["overall"]), 0, 10).astype(np.intp)
+        counts = np.bincount(bands, minlength=11)
+        likes = np.bincount(bands, weights=liked, minlength=11)
+        like_rate = {
+            band: round(float(likes[band] / counts[band]) * 100, 1)
+            for band in range(11) if counts[band]
+        }
+        return {"correlation": correlations, "like_rate_by_score": like_rate}
+
+    def refinement(self) -> Dict:
+        """Refinement win rate and gains (same keys as StoryTracker.get_refinement_stats)"""
+        flags = self.index["flags"]
+        attempted = (flags & REFINE_ATTEMPTED) != 0
+        skipped = (flags & REFINE_SKIPPED) != 0
+        kept = (flags & REFINE_KEPT) != 0
+
+        gains = (np.asarray(self.index["overall"], dtype=np.float64)
+                 - np.asarray(self.index["initial_overall"], dtype=np.float64))[attempted]
+        # a refined draft is only kept when it scores higher, so losses count as 0
+        kept_gains = np.maximum(gains, 0)
+        wins = gains[gains > 0]
+        avg_win_gain = float(wins.mean()) if len(wins) else 0
+        # probability-weighted gain the skipped stories gave up
+        win_rates = np.nan_to_num(np.asarray(self.index["predicted_win_rate"], dtype=np.float64)[skipped])
+        n_attempted = int(attempted.sum())
+        n_skipped = int(skipped.sum())
+
+        return {
+            "attempted": n_attempted,
+            "skipped": n_skipped,
+            # each skip avoids one refine_story and one evaluate_story call
+            "calls_saved": n_skipped * 2,
+            "win_rate": round(float(kept[attempted].mean()) * 100, 1) if n_attempted else 0,
+            "average_gain": round(float(kept_gains.mean()), 2) if n_attempted else 0,
+            "estimated_forgone_gain": round(float(win_rates.mean()) * avg_win_gain, 2) if n_skipped else 0,
+        }
+
+    def summary(self) -> Dict:
+        return {
+            "stories": len(self),
+            "distributions": self.score_distributions(),
+            "trends": self.trends(),
+            "likes": self.like_correlation(),
+            "refinement": self.refinement(),
+        }
+
+    def render_html(self) -> str:
+        """Analytics section for the HTML report"""
+        if not len(self):
+            return ""
+        distributions = self.score_distributions()
+        likes = self.like_correlation()
+        trends = self.trends()
+
+        rows = []
+        for column in SCORE_COLUMNS:
+            stats = distributions[column]
+            peak = max(stats["histogram"]) or 1
+            bars = "".join(
+                f'<div class="bar" style="height:{count / peak * 100:.0f}%" title="{point}: {count}"></div>'
+                for point, count in enumerate(stats["histogram"])
+            )
+            correlation = likes["correlation"][column]
+            rows.append(f"""
+            <tr>
+                <td>{html.escape(column.replace("_", " ").title())}</td>
+                <td><div class="histogram">{bars}</div></td>
+                <td>{stats["mean"]}</td>
+                <td>{stats["p10"]} / {stats["median"]} / {stats["p90"]}</td>
+                <td>{"n/a" if correlation is None else correlation}</td>
+            </tr>""")
+
+        trend_rows = "".join(f"""
+            <tr>
+                <td>{row["period"]}</td>
+                <td>{row["stories"]}</td>
+                <td>{row["average_score"]}</td>
+                <td>{row["pass_rate"]}%</td>
+                <td>{row["liked_percentage"]}%</td>
+            </tr>""" for row in trends)
+
+        like_bands = " · ".join(f"{band}: {rate:.0f}%" for band, rate in likes["like_rate_by_score"].items())
+
+        return f"""
+    <div class="analytics">
+        <h2>📈 Analytics</h2>
+        <table>
+            <tr><th>Score</th><th>Distribution (0-10)</th><th>Mean</th><th>P10 / Median / P90</th><th>Like correlation</th></tr>{"".join(rows)}
+        </table>
+        <p><strong>Like rate by overall score:</strong> {like_bands}</p>
+        <table>
+            <tr><th>Week of</th><th>Stories</th><th>Average Score</th><th>Passed</th><th>Liked</th></tr>{trend_rows}
+        </table>
+    </div>
+"""
@@ -0,0 +1,281 @@
+"""
+Provider batch-API execution for offline jobs.
+
+BatchRunner is an LLM callable like call_model, but a call only queues the
+request. Once no new request has arrived for `linger` seconds, everything
+queued is written as one chat-completions batch JSONL file, submitted to a
+backend and polled; each result is handed back to the thread that made the
+call, so agents and pipelines run unchanged. Run many pipelines in threads
+(dataset evaluation, library building) and each stage of all of them goes out
+as one batch.
+
+Backends:
+    OpenAIBatchBackend    - /v1/files + /v1/batches over HTTP
+    LocalBatchProcessor   - processes batch files with a local llm, for tests and dry runs
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchRequestFailed(RuntimeError):
+    """A queued call came back from the batch with an error, or not at all"""
+
+
+def batch_line(custom_id: str, prompt: str, model: str, max_tokens: int, temperature: float) -> Dict:
+    """One request line of a chat-completions batch input file"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        },
+    }
+
+
+def _result(line: Dict) -> Tuple[str, str]:
+    """(content, error) from one batch output line"""
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        error = line.get("error") or response.get("body", {}).get("error") or {}
+        return None, error.get("message", "request failed") if isinstance(error, dict) else str(error)
+    return response["body"]["choices"][0]["message"]["content"], None
+
+
+class OpenAIBatchBackend:
+    """Uploads a batch file, creates the batch and downloads its output over the REST API"""
+
+    poll_interval = 30.0
+
+    def __init__(self, api_key: str = None, base_url: str = "https://api.openai.com/v1",
+                 completion_window: str = "24h"):
+        import requests
+
+        self.requests = requests
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url.rstrip("/")
+        self.completion_window = completion_window
+
+    def _headers(self) -> Dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            upload = self.requests.post(
+                f"{self.base_url}/files",
+                headers=self._headers(),
+                files={"file": (os.path.basename(path), f)},
+                data={"purpose": "batch"},
+                timeout=300,
+            )
+        upload.raise_for_status()
+        batch = self.requests.post(
+            f"{self.base_url}/batches",
+            headers=self._headers(),
+            json={
+                "input_file_id": upload.json()["id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": self.completion_window,
+            },
+            timeout=60,
+        )
+        batch.raise_for_status()
+        return batch.json()["id"]
+
+    def status(self, batch_id: str) -> Dict:
+        response = self.requests.get(f"{self.base_url}/batches/{batch_id}", headers=self._headers(), timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    def results(self, batch: Dict) -> Iterator[Dict]:
+        for key in ("output_file_id", "error_file_id"):
+            if batch.get(key):
+                response = self.requests.get(
+                    f"{self.base_url}/files/{batch[key]}/content", headers=self._headers(), timeout=300
+                )
+                response.raise_for_status()
+                for line in response.text.splitlines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class LocalBatchProcessor:
+    """
+    Stand-in backend: processes a batch input file in the background with a
+    local llm callable and writes an output file in the provider's format.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, llm: Callable, concurrency: int = 8):
+        self.llm = llm
+        self.concurrency = concurrency
+        self.batches: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _process(self, batch_id: str, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+
+        def run(request: Dict) -> Dict:
+            body = request["body"]
+            line = {"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"], "error": None}
+            try:
+                content = self.llm(
+                    body["messages"][0]["content"], max_tokens=body["max_tokens"], temperature=body["temperature"]
+                )
+                line["response"] = {
+                    "status_code": 200,
+                    "body": {"model": body["model"], "choices": [{"message": {"role": "assistant", "content": content}}]},
+                }
+            except Exception as e:
+                line["response"] = {"status_code": 500, "body": {"error": {"message": str(e)}}}
+            return line
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            lines = list(pool.map(run, requests))
+
+        output_file = path + ".output.jsonl"
+        with open(output_file, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        with self._lock:
+            self.batches[batch_id].update({
+                "status": "completed",
+                "output_file": output_file,
+                "request_counts": {
+                    "total": len(lines),
+                    "completed": sum(1 for line in lines if line["response"]["status_code"] == 200),
+                    "failed": sum(1 for line in lines if line["response"]["status_code"] != 200),
+                },
+            })
+
+    def submit(self, path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self.batches[batch_id] = {"id": batch_id, "status": "in_progress", "input_file": path}
+        threading.Thread(target=self._process, args=(batch_id, path), daemon=True).start()
+        return batch_id
+
+    def status(self, batch_id: str) -> Dict:
+        with self._lock:
+            return dict(self.batches[batch_id])
+
+    def results(self, batch: Dict) -> Iterator[Dict]:
+        with open(batch["output_file"], "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class BatchRunner:
+    """
+    LLM callable that queues calls from many threads and sends them as batches.
+    Each caller blocks until its own result is back, so a thread per pipeline
+    keeps that pipeline's state while its stage waits in the batch.
+    """
+
+    def __init__(self, backend, model: str = "gpt-3.5-turbo", work_dir: str = "batch_jobs",
+                 linger: float = 1.0, max_requests: int = 50000, poll_interval: float = None):
+        self.backend = backend
+        self.model = model
+        self.work_dir = work_dir
+        # a batch goes out once no new call has been queued for this long
+        self.linger = linger
+        # provider limit on requests per batch file
+        self.max_requests = max_requests
+        self.poll_interval = backend.poll_interval if poll_interval is None else poll_interval
+        self.stats = {"batches": 0, "requests": 0, "failed": 0}
+
+        self._run_id = uuid.uuid4().hex[:8]
+        self._ids = itertools.count(1)
+        self._pending: List[Tuple[Dict, Future]] = []
+        self._last_queued = 0.0
+        self._cond = threading.Condition()
+        self._dispatcher = None
+
+    def __call__(self, prompt: str, max_tokens: int = 3000, temperature: float = 0.7, **kwargs) -> str:
+        # per-call timeouts don't apply: a batch completes within its window
+        future = Future()
+        with self._cond:
+            line = batch_line(f"{self._run_id}-{next(self._ids)}", prompt, self.model, max_tokens, temperature)
+            self._pending.append((line, future))
+            self._last_queued = time.monotonic()
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+                self._dispatcher.start()
+            self._cond.notify_all()
+        return future.result()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                while len(self._pending) < self.max_requests:
+                    remaining = self._last_queued + self.linger - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self.max_requests], self._pending[self.max_requests:]
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(BatchRequestFailed(f"Batch failed: {e}"))
+
+    def _run_batch(self, batch: List[Tuple[Dict, Future]]):
+        """Write, submit and poll one batch, then resolve every caller's future"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.stats["batches"] += 1
+        path = os.path.join(self.work_dir, f"batch-{self._run_id}-{self.stats['batches']}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for line, _ in batch:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        batch_id = self.backend.submit(path)
+        print(f"📦 Submitted batch {batch_id} with {len(batch)} requests")
+        status = self.backend.status(batch_id)
+        while status["status"] not in TERMINAL_STATUSES:
+            time.sleep(self.poll_interval)
+            status = self.backend.status(batch_id)
+
+        futures = {line["custom_id"]: future for line, future in batch}
+        outcomes = []
+        # expired and cancelled batches still return whatever finished
+        for output in self.backend.results(status):
+            future = futures.pop(output.get("custom_id"), None)
+            if future is not None:
+                outcomes.append((future, *_result(output)))
+        missing = f"No result in batch {batch_id} ({status['status']})"
+        outcomes.extend((future, None, missing) for future in futures.values())
+
+        # stats first, so a caller that wakes up sees them
+        self.stats["requests"] += len(batch)
+        self.stats["failed"] += sum(1 for _, _, error in outcomes if error)
+        for future, content, error in outcomes:
+            if error:
+                future.set_exception(BatchRequestFailed(error))
+            else:
+                future.set_result(content)
+
+
+def batch_runner(backend: str, llm: Callable = None, **kwargs) -> BatchRunner:
+    """BatchRunner on the provider batch API ("openai") or the local stand-in ("local", which runs llm)"""
+    if backend == "openai":
+        return BatchRunner(OpenAIBatchBackend(), **kwargs)
+    if backend == "local":
+        return BatchRunner(LocalBatchProcessor(llm), **kwargs)
+    raise ValueError(f"Unknown batch backend: {backend}")
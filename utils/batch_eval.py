@@ -0,0 +1,469 @@
+"""
+Batch judge evaluation over a labelled story dataset.
+
+Runs JudgeSystem.evaluate_story over every story with bounded concurrency and
+reports agreement with the expected outputs per category, latency and token
+totals, and judge variance across repeated samples. Items are streamed, so
+only the in-flight window is held in memory.
+
+With --bulk N, groups of up to N stories are judged together through
+JudgeSystem.evaluate_stories (several stories per prompt, under a token
+budget). --compare-single also judges every story on its own and reports how
+often the two verdicts agree, so the accuracy cost of bulk judging is measured
+next to its call and token savings.
+
+Usage:
+    python -m utils.batch_eval bedtime_stories_ds.jsonl --concurrency 8 --samples 3
+    python -m utils.batch_eval bedtime_stories_ds.jsonl --batch openai    # provider batch API
+    python -m utils.batch_eval bedtime_stories_ds.jsonl --bulk 5 --compare-single
+    python -m utils.batch_eval bedtime_stories_ds.jsonl --profile         # see utils/profiling.py
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from agents.judge import JudgeSystem
+from utils import metrics, profiling
+from utils.budget import estimate_tokens
+
+
+def _expected_category(expected: Dict) -> str:
+    """Category for datasets (like the .jsonl export) that only carry expected outputs"""
+    if expected.get("scores") is None and not expected.get("pass", False):
+        return "safety_failure"
+    return "pass" if expected.get("pass", False) else "quality_failure"
+
+
+# .json datasets are read this many characters at a time
+READ_CHUNK = 1 << 16
+_DECODER = json.JSONDecoder()
+
+
+class _JSONReader:
+    """Reads a JSON document from a file a value at a time, holding one chunk and one value"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(READ_CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, "" at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def skip(self, char: str) -> bool:
+        if self.peek() != char:
+            return False
+        self.pos += 1
+        return True
+
+    def expect(self, char: str):
+        if not self.skip(char):
+            raise ValueError(f"Malformed dataset: expected {char!r}, found {self.peek()!r}")
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+                # a number cut off at the end of the chunk decodes short; read on to be sure
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _iter_json_stories(f) -> Iterator[Dict]:
+    """Rows of the top-level "stories" list, one at a time; other keys are skipped"""
+    reader = _JSONReader(f)
+    reader.expect("{")
+    while not reader.skip("}"):
+        key = reader.value()
+        reader.expect(":")
+        if key != "stories":
+            reader.value()
+        else:
+            reader.expect("[")
+            while not reader.skip("]"):
+                yield reader.value()
+                reader.skip(",")
+        reader.skip(",")
+
+
+def iter_dataset(path: str) -> Iterator[Dict]:
+    """Yield normalized items from a .json ({"stories": [...]}) or .jsonl dataset, one row in memory at a time"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                inputs, expected = row.get("inputs", {}), row.get("outputs", {})
+                yield {
+                    "id": row.get("id", line_number),
+                    "category": row.get("category") or _expected_category(expected),
+                    "story": {
+                        "title": inputs.get("title", ""),
+                        "story": inputs.get("story", ""),
+                        "moral": inputs.get("moral", ""),
+                    },
+                    "expected": expected,
+                }
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for row in _iter_json_stories(f):
+            expected = row.get("expected_output", {})
+            yield {
+                "id": row.get("id"),
+                "category": row.get("category") or _expected_category(expected),
+                "story": {
+                    "title": row.get("title", ""),
+                    "story": row.get("story", ""),
+                    "moral": row.get("moral", ""),
+                },
+                "expected": expected,
+            }
+
+
+class _CategoryStats:
+    def __init__(self):
+        self.items = 0
+        self.samples = 0
+        self.pass_agree = 0
+        self.safety_agree = 0
+        self.scored = 0
+        self.abs_error = 0.0
+        self.variance = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "items": self.items,
+            "pass_agreement": round((self.pass_agree / self.samples) * 100, 1) if self.samples else 0,
+            "safety_agreement": round((self.safety_agree / self.samples) * 100, 1) if self.samples else 0,
+            "overall_mae": round(self.abs_error / self.scored, 2) if self.scored else None,
+            "mean_variance": round(self.variance / self.items, 3) if self.items else 0,
+        }
+
+
+class _SingleAgreement:
+    """Bulk verdicts against the same stories judged one per call"""
+
+    def __init__(self):
+        self.items = 0
+        self.pass_agree = 0
+        self.safety_agree = 0
+        self.scored = 0
+        self.abs_difference = 0.0
+        self.calls = 0
+        self.tokens = 0
+
+    def add(self, bulk: Dict, single: Dict):
+        self.items += 1
+        self.pass_agree += bulk.get("pass", False) == single.get("pass", False)
+        self.safety_agree += bulk.get("safety_passed", True) == single.get("safety_passed", True)
+        if bulk.get("scores") and single.get("scores"):
+            self.scored += 1
+            self.abs_difference += abs(float(bulk.get("overall", 0) or 0) - float(single.get("overall", 0) or 0))
+
+    def to_dict(self) -> Dict:
+        return {
+            "items": self.items,
+            "pass_agreement": round((self.pass_agree / self.items) * 100, 1) if self.items else 0,
+            "safety_agreement": round((self.safety_agree / self.items) * 100, 1) if self.items else 0,
+            "overall_mad": round(self.abs_difference / self.scored, 2) if self.scored else None,
+            "single_calls": self.calls,
+            "single_tokens": self.tokens,
+        }
+
+
+class BatchJudgeEvaluator:
+    """
+    Evaluates a dataset with a pool of judge calls. Each item is judged
+    `samples` times so the spread of the judge's overall score can be measured.
+    With bulk > 1, each pool task judges up to `bulk` items in shared prompts.
+    """
+
+    def __init__(
+        self,
+        llm_call_function: Callable,
+        concurrency: int = 8,
+        samples: int = 1,
+        bulk: int = 1,
+        bulk_tokens: Optional[int] = None,
+        compare_single: bool = False,
+    ):
+        self.call_model = llm_call_function
+        self.concurrency = concurrency
+        self.samples = samples
+        self.bulk = bulk
+        self.bulk_tokens = bulk_tokens
+        self.compare_single = compare_single and bulk > 1
+        self.judge = JudgeSystem(self._metered_call)
+        self._local = threading.local()
+
+    def _metered_call(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        response = self.call_model(prompt, max_tokens=max_tokens, temperature=temperature, **kwargs)
+        self._local.calls = getattr(self._local, "calls", 0) + 1
+        self._local.tokens = getattr(self._local, "tokens", 0) + estimate_tokens(prompt) + estimate_tokens(response)
+        return response
+
+    def _metered(self, judge: Callable):
+        """judge(), with the calls and tokens it spent on this thread"""
+        self._local.calls = self._local.tokens = 0
+        result = judge()
+        return result, self._local.calls, self._local.tokens
+
+    def _evaluate_item(self, item: Dict) -> Dict:
+        started = time.monotonic()
+        evaluations, calls, tokens = self._metered(
+            lambda: [self.judge.evaluate_story(item["story"]) for _ in range(self.samples)]
+        )
+        result = {
+            "id": item["id"],
+            "category": item["category"],
+            "expected": item["expected"],
+            "evaluations": evaluations,
+            "latency": time.monotonic() - started,
+            "tokens": tokens,
+        }
+        return {"results": [result], "calls": calls}
+
+    def _evaluate_group(self, items: List[Dict]) -> Dict:
+        """One pool task in bulk mode; tokens and latency are shared by the group"""
+        stories = [item["story"] for item in items]
+        started = time.monotonic()
+        samples, calls, tokens = self._metered(
+            lambda: [self.judge.evaluate_stories(stories, self.bulk_tokens, self.bulk) for _ in range(self.samples)]
+        )
+        latency = time.monotonic() - started
+
+        results = [
+            {
+                "id": item["id"],
+                "category": item["category"],
+                "expected": item["expected"],
+                "evaluations": [sample[i] for sample in samples],
+                "latency": latency,
+                "tokens": tokens / len(items),
+            }
+            for i, item in enumerate(items)
+        ]
+        group = {"results": results, "calls": calls}
+
+        if self.compare_single:
+            singles, group["single_calls"], group["single_tokens"] = self._metered(
+                lambda: [self.judge.evaluate_story(story) for story in stories]
+            )
+            for result, single in zip(results, singles):
+                result["single"] = single
+        return group
+
+    def _score(self, result: Dict, stats: _CategoryStats):
+        expected = result["expected"]
+        expected_safe = expected.get("scores") is not None or expected.get("pass", False)
+        expected_overall = (expected.get("scores") or {}).get("overall")
+        overalls = []
+
+        for evaluation in result["evaluations"]:
+            stats.samples += 1
+            stats.pass_agree += evaluation.get("pass", False) == expected.get("pass", False)
+            stats.safety_agree += evaluation.get("safety_passed", True) == expected_safe
+            overalls.append(float(evaluation.get("overall", 0) or 0))
+            if expected_overall is not None and evaluation.get("scores"):
+                stats.scored += 1
+                stats.abs_error += abs(overalls[-1] - expected_overall)
+
+        mean = sum(overalls) / len(overalls)
+        stats.items += 1
+        stats.variance += sum((o - mean) ** 2 for o in overalls) / len(overalls)
+
+    def _tasks(self, items: Iterable[Dict]) -> Iterator[Tuple[Callable, object]]:
+        if self.bulk <= 1:
+            for item in items:
+                yield self._evaluate_item, item
+            return
+        group = []
+        for item in items:
+            group.append(item)
+            if len(group) == self.bulk:
+                yield self._evaluate_group, group
+                group = []
+        if group:
+            yield self._evaluate_group, group
+
+    def run(self, items: Iterable[Dict], output_file: Optional[str] = None) -> Dict:
+        categories: Dict[str, _CategoryStats] = {}
+        agreement = _SingleAgreement()
+        totals = {"items": 0, "judge_calls": 0, "latency": 0.0, "tokens": 0}
+        output = open(output_file, "w", encoding="utf-8") if output_file else None
+        bulk_before = dict(self.judge.bulk_stats)
+        started = time.monotonic()
+
+        def collect(future):
+            group = future.result()
+            totals["judge_calls"] += group["calls"]
+            agreement.calls += group.get("single_calls", 0)
+            agreement.tokens += group.get("single_tokens", 0)
+            for result in group["results"]:
+                self._score(result, categories.setdefault(result["category"], _CategoryStats()))
+                if "single" in result:
+                    agreement.add(result["evaluations"][0], result["single"])
+                totals["items"] += 1
+                totals["latency"] += result["latency"]
+                totals["tokens"] += result["tokens"]
+                if output:
+                    output.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                pending = set()
+                for task, work in self._tasks(items):
+                    # keep a bounded window in flight instead of queueing the whole dataset
+                    if len(pending) >= self.concurrency * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future)
+                    pending.add(pool.submit(task, work))
+
+                for future in wait(pending).done:
+                    collect(future)
+        finally:
+            if output:
+                output.close()
+
+        overall = _CategoryStats()
+        for stats in categories.values():
+            for field in vars(overall):
+                setattr(overall, field, getattr(overall, field) + getattr(stats, field))
+
+        wall_time = time.monotonic() - started
+        summary = {
+            "items": totals["items"],
+            "samples_per_item": self.samples,
+            "judge_calls": totals["judge_calls"],
+            "wall_time": round(wall_time, 2),
+            "items_per_second": round(totals["items"] / wall_time, 2) if wall_time else 0,
+            "mean_item_latency": round(totals["latency"] / totals["items"], 3) if totals["items"] else 0,
+            "tokens": round(totals["tokens"]),
+            "overall": overall.to_dict(),
+            "categories": {name: stats.to_dict() for name, stats in sorted(categories.items())},
+        }
+        if self.bulk > 1:
+            summary["bulk"] = {
+                "stories_per_group": self.bulk,
+                **{key: self.judge.bulk_stats[key] - bulk_before[key] for key in bulk_before},
+            }
+        if self.compare_single:
+            summary["single_agreement"] = agreement.to_dict()
+        return summary
+
+
+def print_summary(summary: Dict):
+    print("\n" + "=" * 70)
+    print("JUDGE BATCH EVALUATION".center(70))
+    print("=" * 70)
+    print(
+        f"{summary['items']} stories x {summary['samples_per_item']} samples = "
+        f"{summary['judge_calls']} judge calls in {summary['wall_time']}s "
+        f"({summary['items_per_second']} stories/s)"
+    )
+    print(f"Mean latency per story: {summary['mean_item_latency']}s | Tokens (est.): {summary['tokens']}")
+    if "bulk" in summary:
+        bulk = summary["bulk"]
+        print(
+            f"Bulk: up to {bulk['stories_per_group']} stories per prompt, {bulk['requests']} judge requests "
+            f"for {bulk['stories']} stories, {bulk['rejudged']} re-judged singly"
+        )
+    if "single_agreement" in summary:
+        agreement = summary["single_agreement"]
+        mad = "-" if agreement["overall_mad"] is None else agreement["overall_mad"]
+        print(
+            f"vs single-story judging: pass {agreement['pass_agreement']}% | safety "
+            f"{agreement['safety_agreement']}% | overall diff {mad} | single would cost "
+            f"{agreement['single_calls']} calls, {agreement['single_tokens']} tokens"
+        )
+    print("-" * 70)
+    print(f"{'category':<22}{'items':>6}{'pass agree':>12}{'safety agree':>14}{'MAE':>7}{'var':>8}")
+    rows = list(summary["categories"].items()) + [("ALL", summary["overall"])]
+    for name, stats in rows:
+        mae = "-" if stats["overall_mae"] is None else stats["overall_mae"]
+        print(
+            f"{name:<22}{stats['items']:>6}{stats['pass_agreement']:>11}%"
+            f"{stats['safety_agreement']:>13}%{mae:>7}{stats['mean_variance']:>8}"
+        )
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-evaluate the judge against a labelled dataset")
+    parser.add_argument("dataset", help="Path to a .json or .jsonl dataset")
+    parser.add_argument("--concurrency", type=int, default=8, help="Judge calls in flight")
+    parser.add_argument("--samples", type=int, default=1, help="Judge samples per story (for variance)")
+    parser.add_argument("--bulk", type=int, default=1, help="Judge up to N stories per prompt")
+    parser.add_argument("--bulk-tokens", type=int, help="Prompt token budget per multi-story call (default: the judge's)")
+    parser.add_argument("--compare-single", action="store_true",
+                        help="With --bulk, also judge each story alone and report agreement")
+    parser.add_argument("--output", help="Write per-story results as JSONL")
+    parser.add_argument("--summary", help="Write the summary as JSON")
+    parser.add_argument("--batch", choices=["openai", "local"],
+                        help="Send judge calls as provider batches (local processes batch files in-process)")
+    parser.add_argument("--batch-size", type=int, default=2000,
+                        help="Stories in flight per batch with --batch (replaces --concurrency)")
+    profiling.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    from main import call_model, load_env
+    from utils.single_flight import SingleFlight
+
+    if args.profile:
+        profiling.configure(args.profile)
+
+    load_env()
+    llm = SingleFlight(call_model)
+    concurrency = args.concurrency
+    if args.batch:
+        from utils.batch_backend import batch_runner
+
+        llm = batch_runner(args.batch, llm)
+        # the in-flight window is what goes out together; batches trade latency for price and rate limits
+        concurrency = args.batch_size
+    llm = metrics.InstrumentedCall(llm)
+    metrics.start_from_env()
+
+    evaluator = BatchJudgeEvaluator(
+        llm, concurrency, args.samples, bulk=args.bulk, bulk_tokens=args.bulk_tokens, compare_single=args.compare_single
+    )
+    with profiling.stage("batch_eval"):
+        summary = evaluator.run(iter_dataset(args.dataset), args.output)
+    print_summary(summary)
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Content-addressed, compressed storage for story bodies.
+
+Each body is stored once, keyed by the SHA-256 of its bytes, in an append-only
+pack file with a fixed-width index. Bodies are compressed one at a time with
+zstd when the zstandard package is installed and zlib otherwise, both primed
+with a dictionary trained on stored bodies: a single bedtime story repeats
+itself too little to compress well alone, but shares most of its phrasing
+with every other one.
+
+Usage:
+    python -m utils.blob_store stats story_metrics_store
+    python -m utils.blob_store train story_metrics_store     # retrain on the latest bodies
+    python -m utils.blob_store migrate story_metrics_store   # move inline bodies out of stories.jsonl
+"""
+
+import argparse
+import hashlib
+import os
+import struct
+import threading
+import zlib
+from typing import Callable, Dict, List, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOB_MAGIC = b"BBLB"
+BLOB_VERSION = 1
+# magic, version, id of the dictionary new blobs are compressed with (0: none yet)
+BLOB_HEADER = struct.Struct("<4sIH6x")
+# sha256, pack offset, compressed length, raw length, codec, dictionary id
+BLOB_ENTRY = struct.Struct("<32sQIIBxH")
+
+ZLIB = 1
+ZSTD = 2
+CODEC_NAMES = {ZLIB: "zlib", ZSTD: "zstd"}
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 10
+# deflate can't refer back further than its 32KB window
+ZLIB_DICT_SIZE = 32 * 1024
+ZSTD_DICT_SIZE = 110 * 1024
+# the first dictionary is trained once this many bodies are stored, and a new one
+# each time the count doubles after that, until RETRAIN_UNTIL
+TRAIN_AFTER = 32
+RETRAIN_UNTIL = 4096
+TRAIN_SAMPLES = 500
+
+
+def train_dictionary(samples: List[bytes], codec: int) -> bytes:
+    """
+    Compression dictionary for the codec. zstd trains a proper dictionary
+    when it has enough samples; otherwise the dictionary is raw sample text,
+    newest last. For deflate that is all a preset dictionary can be, and on our
+    stories it beat a list of the most frequent phrases.
+    """
+    if codec == ZSTD:
+        try:
+            return zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+        except zstandard.ZstdError:
+            pass  # too few samples to train on
+    size = ZSTD_DICT_SIZE if codec == ZSTD else ZLIB_DICT_SIZE
+    return b"\n\n".join(samples)[-size:]
+
+
+class BlobStore:
+    """
+    Bodies keyed by content hash in blobs.pack, indexed by blobs.idx. put()
+    returns the hex hash and stores nothing if the body is already there.
+
+    Writes take `lock` (a context manager factory, e.g. StoryStore.locked) so
+    several processes can share a store; without one, only threads are
+    serialized. Compression happens before the lock is taken.
+    """
+
+    def __init__(self, directory: str, lock: Callable = None):
+        self.directory = directory
+        self.pack_file = os.path.join(directory, "blobs.pack")
+        self.index_file = os.path.join(directory, "blobs.idx")
+        self.codec = ZSTD if zstandard is not None else ZLIB
+        os.makedirs(directory, exist_ok=True)
+
+        try:
+            with open(self.index_file, "xb") as f:
+                f.write(BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, 0))
+        except FileExistsError:
+            pass
+        with open(self.index_file, "rb") as f:
+            magic, version, _ = BLOB_HEADER.unpack(f.read(BLOB_HEADER.size))
+        if magic != BLOB_MAGIC or version != BLOB_VERSION:
+            raise ValueError(f"Unsupported blob index: {self.index_file}")
+
+        thread_lock = threading.RLock()
+        self._lock = lock or (lambda: thread_lock)
+        self._read_lock = threading.Lock()
+        self._entries: Dict[bytes, Tuple] = {}
+        self._indexed = BLOB_HEADER.size
+        self._dictionary_id = 0
+        self._dictionaries: Dict[int, bytes] = {}
+        self._pack = None
+        self._refresh()
+
+    def _refresh(self):
+        """Pick up the dictionary id and any entries other writers have appended"""
+        with open(self.index_file, "rb") as f:
+            _, _, self._dictionary_id = BLOB_HEADER.unpack(f.read(BLOB_HEADER.size))
+            f.seek(self._indexed)
+            data = f.read()
+        # a partial entry at the end is a write in progress (or a crashed one)
+        usable = len(data) - len(data) % BLOB_ENTRY.size
+        for digest, *entry in BLOB_ENTRY.iter_unpack(data[:usable]):
+            self._entries[digest] = tuple(entry)
+        self._indexed += usable
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        digest = bytes.fromhex(key)
+        if digest not in self._entries:
+            self._refresh()
+        return digest in self._entries
+
+    def _dictionary_file(self, dictionary_id: int) -> str:
+        return os.path.join(self.directory, f"blobs-{dictionary_id}.dict")
+
+    def _dictionary(self, dictionary_id: int) -> bytes:
+        if not dictionary_id:
+            return b""
+        if dictionary_id not in self._dictionaries:
+            with open(self._dictionary_file(dictionary_id), "rb") as f:
+                self._dictionaries[dictionary_id] = f.read()
+        return self._dictionaries[dictionary_id]
+
+    def _compress(self, data: bytes, codec: int, dictionary_id: int) -> bytes:
+        dictionary = self._dictionary(dictionary_id)
+        if codec == ZSTD:
+            compressor = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL, dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            )
+            return compressor.compress(data)
+        # raw deflate: the zlib header and checksum would be a tenth of a small blob
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict=dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, data: bytes, codec: int, dictionary_id: int) -> bytes:
+        dictionary = self._dictionary(dictionary_id)
+        if codec == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("This blob is zstd-compressed; install the zstandard package to read it")
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            )
+            return decompressor.decompress(data)
+        decompressor = zlib.decompressobj(-15, zdict=dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def put(self, data: bytes) -> str:
+        """Store a body (once) and return its hex SHA-256"""
+        digest = hashlib.sha256(data).digest()
+        if digest in self._entries:
+            return digest.hex()
+        self._refresh()
+        if digest in self._entries:
+            return digest.hex()
+
+        dictionary_id = self._dictionary_id
+        compressed = self._compress(data, self.codec, dictionary_id)
+        with self._lock():
+            self._refresh()
+            if digest in self._entries:
+                return digest.hex()
+            if self._dictionary_id != dictionary_id:
+                # another writer trained a dictionary in the meantime
+                dictionary_id = self._dictionary_id
+                compressed = self._compress(data, self.codec, dictionary_id)
+
+            with open(self.pack_file, "ab") as f:
+                offset = f.tell()
+                f.write(compressed)
+            entry = (offset, len(compressed), len(data), self.codec, dictionary_id)
+            with open(self.index_file, "r+b") as f:
+                # overwrite any partial entry a crashed writer left behind
+                f.seek(self._indexed)
+                f.write(BLOB_ENTRY.pack(digest, *entry))
+                f.truncate()
+            self._entries[digest] = entry
+            self._indexed += BLOB_ENTRY.size
+
+            count = len(self._entries)
+            if TRAIN_AFTER <= count <= RETRAIN_UNTIL and not count & (count - 1):
+                self.train()
+        return digest.hex()
+
+    def _read(self, entry: Tuple) -> bytes:
+        offset, length, _, codec, dictionary_id = entry
+        with self._read_lock:
+            if self._pack is None:
+                self._pack = open(self.pack_file, "rb")
+            self._pack.seek(offset)
+            data = self._pack.read(length)
+        return self._decompress(data, codec, dictionary_id)
+
+    def get(self, key: str) -> bytes:
+        """The body stored under this hex hash; KeyError if there is none"""
+        digest = bytes.fromhex(key)
+        if digest not in self._entries:
+            self._refresh()
+        if digest not in self._entries:
+            raise KeyError(key)
+        return self._read(self._entries[digest])
+
+    def train(self, samples: List[bytes] = None) -> int:
+        """
+        Train a dictionary on samples (default: the most recently stored
+        bodies) and compress new blobs with it. Blobs already stored keep the
+        dictionary they were written with. Returns the new dictionary id.
+        """
+        with self._lock():
+            self._refresh()
+            if samples is None:
+                recent = sorted(self._entries.values())[-TRAIN_SAMPLES:]
+                samples = [self._read(entry) for entry in recent]
+            dictionary = train_dictionary(samples, self.codec)
+
+            dictionary_id = self._dictionary_id + 1
+            temp_file = f"{self._dictionary_file(dictionary_id)}.{os.getpid()}.tmp"
+            with open(temp_file, "wb") as f:
+                f.write(dictionary)
+            os.replace(temp_file, self._dictionary_file(dictionary_id))
+            with open(self.index_file, "r+b") as f:
+                f.write(BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, dictionary_id))
+            self._dictionary_id = dictionary_id
+            self._dictionaries[dictionary_id] = dictionary
+        return dictionary_id
+
+    def stats(self) -> Dict:
+        self._refresh()
+        return {
+            "blobs": len(self._entries),
+            "raw_bytes": sum(entry[2] for entry in self._entries.values()),
+            "stored_bytes": sum(entry[1] for entry in self._entries.values()),
+            "codec": CODEC_NAMES[self.codec],
+            "dictionary": self._dictionary_id,
+        }
+
+    def close(self):
+        with self._read_lock:
+            if self._pack is not None:
+                self._pack.close()
+                self._pack = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain a story store's compressed bodies")
+    parser.add_argument("command", choices=["stats", "train", "migrate"])
+    parser.add_argument("store", nargs="?", default="story_metrics_store", help="Story store directory")
+    args = parser.parse_args()
+
+    from utils.story_store import StoryStore
+
+    store = StoryStore(args.store)
+    if args.command == "train":
+        print(f"Trained dictionary {store.blobs.train()}")
+    elif args.command == "migrate":
+        moved = store.migrate_bodies()
+        print(f"Moved {moved} inline bodies to the blob store")
+
+    stats = store.blobs.stats()
+    ratio = stats["raw_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 0
+    print(
+        f"{stats['blobs']} blobs, {stats['raw_bytes']:,} bytes -> {stats['stored_bytes']:,} "
+        f"({ratio:.1f}x, {stats['codec']}, dictionary {stats['dictionary'] or 'none'})"
+    )
+
+
+if __name__ == "__main__":
+    main()
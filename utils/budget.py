@@ -0,0 +1,111 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+_active_budget: ContextVar = ContextVar("beanstalk_budget", default=None)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class BudgetExhausted(TimeoutError):
+    """Raised instead of calling the model once the budget can't fit another call"""
+
+
+class Budget:
+    """
+    Wall-clock and token budget for one story. While a budget is active, every
+    call made through BudgetedCall gets the remaining time as its timeout and a
+    max_tokens that can still be produced before the deadline.
+    """
+
+    def __init__(
+        self,
+        seconds: Optional[float] = None,
+        tokens: Optional[int] = None,
+        output_tokens_per_second: float = 60.0,
+        min_tokens: int = 64,
+    ):
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds if seconds else None
+        self.tokens_left = tokens
+        self.output_tokens_per_second = output_tokens_per_second
+        self.min_tokens = min_tokens
+        self.tokens_used = 0
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (None when there is no deadline)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def exhausted(self) -> bool:
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            return True
+        return self.tokens_left is not None and self.tokens_left < self.min_tokens
+
+    def max_tokens(self, requested: int) -> int:
+        """Shrink requested output tokens to what fits in the remaining time and tokens"""
+        allowed = requested
+        remaining = self.remaining()
+        if remaining is not None:
+            allowed = min(allowed, int(remaining * self.output_tokens_per_second))
+        if self.tokens_left is not None:
+            allowed = min(allowed, self.tokens_left)
+        return allowed
+
+    def spend(self, prompt: str, response: str):
+        used = estimate_tokens(prompt) + estimate_tokens(response)
+        self.tokens_used += used
+        if self.tokens_left is not None:
+            self.tokens_left -= used
+
+    @contextmanager
+    def activate(self):
+        """Make this the budget for calls made in the current context"""
+        token = _active_budget.set(self)
+        try:
+            yield self
+        finally:
+            _active_budget.reset(token)
+
+
+def active_budget() -> Optional[Budget]:
+    return _active_budget.get()
+
+
+class BudgetedCall:
+    """
+    Wraps an LLM call function so the active Budget is propagated: the remaining
+    deadline is passed as timeout and max_tokens is shrunk to fit. Without an
+    active budget calls pass straight through.
+    """
+
+    def __init__(self, llm_call_function: Callable):
+        self.call_model = llm_call_function
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        budget = active_budget()
+        if budget is None:
+            return self.call_model(prompt, max_tokens=max_tokens, temperature=temperature, **kwargs)
+
+        allowed = budget.max_tokens(max_tokens)
+        if budget.exhausted() or allowed < budget.min_tokens:
+            raise BudgetExhausted(
+                f"Budget exhausted after {budget.elapsed():.1f}s and {budget.tokens_used} tokens"
+            )
+
+        remaining = budget.remaining()
+        if remaining is not None:
+            kwargs["timeout"] = remaining
+
+        response = self.call_model(prompt, max_tokens=allowed, temperature=temperature, **kwargs)
+        budget.spend(prompt, response)
+        return response
@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a prompt was never recorded"""
+
+
+class Cassette:
+    """
+    Record/replay layer around an LLM call function.
+
+    Calls are keyed by prompt, temperature and any extra params. max_tokens and
+    timeout are left out of the key because the budget shrinks them based on
+    wall-clock time, which would make replays nondeterministic. Recordings are
+    appended to a gzip JSONL file together with the original latency.
+
+    Modes:
+        "record" - always call upstream and record the response
+        "replay" - only serve recorded responses, raise CassetteMiss otherwise
+        "auto"   - replay when recorded, otherwise call upstream and record
+    """
+
+    MODES = ["record", "replay", "auto"]
+    UNKEYED_PARAMS = ("max_tokens", "timeout")
+
+    def __init__(
+        self,
+        path: str,
+        llm_call_function: Optional[Callable] = None,
+        mode: str = "replay",
+        replay_latency: bool = False,
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode != "replay" and llm_call_function is None:
+            raise ValueError(f"Cassette mode '{mode}' needs an LLM call function")
+
+        self.path = path
+        self.call_model = llm_call_function
+        self.mode = mode
+        # sleep for the recorded latency so benchmarks see realistic timing
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, List[Dict]] = {}
+        self._plays: Dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recordings.setdefault(entry["key"], []).append(entry)
+
+    @classmethod
+    def key(cls, prompt: str, temperature: float, params: Dict) -> str:
+        keyed = {name: value for name, value in params.items() if name not in cls.UNKEYED_PARAMS}
+        payload = json.dumps(
+            {"prompt": prompt, "temperature": temperature, "params": keyed}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _replay(self, key: str) -> Optional[Dict]:
+        """Recorded entries play back in order; the last one repeats once they run out"""
+        with self._lock:
+            entries = self._recordings.get(key)
+            if not entries:
+                return None
+            played = self._plays.get(key, 0)
+            self._plays[key] = played + 1
+            self.stats["hits"] += 1
+            return entries[min(played, len(entries) - 1)]
+
+    def _record(self, key: str, prompt: str, max_tokens: int, temperature: float, params: Dict) -> str:
+        started = time.monotonic()
+        response = self.call_model(prompt, max_tokens=max_tokens, temperature=temperature, **params)
+        entry = {
+            "key": key,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "params": {name: value for name, value in params.items() if name not in self.UNKEYED_PARAMS},
+            "response": response,
+            "latency": round(time.monotonic() - started, 3),
+            "recorded_at": datetime.now().isoformat(),
+        }
+
+        with self._lock:
+            entries = self._recordings.setdefault(key, [])
+            entries.append(entry)
+            # a fresh recording is what the next replay of this key should see
+            self._plays[key] = len(entries)
+            self.stats["recorded"] += 1
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # gzip members can be concatenated, so recordings are appended
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return response
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        key = self.key(prompt, temperature, kwargs)
+
+        if self.mode != "record":
+            entry = self._replay(key)
+            if entry is not None:
+                if self.replay_latency:
+                    time.sleep(entry.get("latency", 0))
+                return entry["response"]
+
+            with self._lock:
+                self.stats["misses"] += 1
+            if self.mode == "replay":
+                raise CassetteMiss(f"No recording in {self.path} for prompt: {prompt[:80]!r}")
+
+        return self._record(key, prompt, max_tokens, temperature, kwargs)
+
+    def recording(self, prompt: str, temperature: float = 0.7, **params) -> Optional[Dict]:
+        """The first recording for this call, without playing it"""
+        entries = self._recordings.get(self.key(prompt, temperature, params))
+        return entries[0] if entries else None
+
+    def recorded_latency(self) -> float:
+        """Total original latency of every recording, for comparing against replay time"""
+        return sum(entry.get("latency", 0) for entries in self._recordings.values() for entry in entries)
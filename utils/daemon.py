@@ -0,0 +1,279 @@
+"""
+Warm local daemon for the story menu.
+
+`python main.py --daemon` starts a long-running process that keeps everything
+a launch would otherwise rebuild: the interpreter and imports, .env, the
+agents with their outline caches and fallback libraries, the tenant shards
+with their indexes loaded, and one pooled HTTPS session to the API. It listens
+on a Unix socket, beanstalk.sock in the working directory (or
+BEANSTALK_SOCKET).
+
+`python main.py` then becomes a thin client: when a daemon answers on the
+socket it relays the terminal to it and the menu runs in the daemon, so the
+first story starts calling the model straight away. When nothing answers
+(no daemon, a stale socket file, a platform without Unix sockets) main.py
+runs in-process as before; `--in-process` skips the daemon.
+
+The wire protocol is JSON lines. The client's first line is a hello,
+{"tenant": ..., "profile": rate or null} or {"command": "status"}. The
+daemon then sends {"out": text} for terminal output, {"read": true} when the
+menu waits for a line (answered with {"line": text} or {"eof": true}), and
+{"exit": 0} when the session ends. Each session runs in its own thread;
+sys.stdin and sys.stdout are routed to the session of the calling context,
+which worker threads started with contextvars.copy_context() share, so
+sessions and the daemon's own log don't mix.
+
+Usage:
+    python main.py --daemon                 # serve until Ctrl+C
+    python main.py                          # uses the daemon when it's running
+    python -m utils.daemon status           # uptime, sessions and warm tenants
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+SOCKET_FILE = "beanstalk.sock"
+
+_session: ContextVar = ContextVar("beanstalk_daemon_session", default=None)
+
+
+def socket_path() -> str:
+    return os.getenv("BEANSTALK_SOCKET", SOCKET_FILE)
+
+
+class _Session:
+    """One client's terminal: output is sent a line at a time, input is asked for"""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.closed = False
+        self._buffer = []
+        # worker threads running in a copy of the session's context write here too;
+        # reentrant because write flushes and flush sends
+        self._lock = threading.RLock()
+
+    def send(self, message: Dict):
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                # the client went away mid-story; finish quietly, the next read ends the session
+                self.closed = True
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            self._buffer.append(text)
+            if "\n" in text:
+                self.flush()
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                self.send({"out": "".join(self._buffer)})
+                self._buffer = []
+
+    def readline(self) -> str:
+        self.flush()
+        self.send({"read": True})
+        line = b"" if self.closed else self.rfile.readline()
+        if not line:
+            # the client went away; the menu sees end of input
+            return ""
+        reply = json.loads(line)
+        return "" if reply.get("eof") else reply["line"] + "\n"
+
+
+class _Routed:
+    """sys.stdin/sys.stdout stand-in: the calling context's session, or the daemon's own stream"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _target(self):
+        return _session.get() or self._stream
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def readline(self, size: int = -1) -> str:
+        return self._target().readline()
+
+    def __getattr__(self, name):
+        # isatty(), fileno() and friends are the daemon's own; input() falls back to readline() without them
+        if _session.get() is not None:
+            raise AttributeError(name)
+        return getattr(self._stream, name)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # a liveness check: connected and closed
+            return
+        hello = json.loads(line)
+        session = _Session(self.rfile, self.wfile)
+        daemon = self.server.story_daemon
+        if hello.get("command") == "status":
+            session.send({"status": daemon.status()})
+            return
+
+        daemon.count(+1)
+        token = _session.set(session)
+        try:
+            daemon.run_session(hello)
+        except EOFError:
+            pass
+        except Exception as e:
+            print(f"\n Something went wrong: {e}")
+        finally:
+            _session.reset(token)
+            daemon.count(-1)
+        session.flush()
+        session.send({"exit": 0})
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class StoryDaemon:
+    """
+    Serves run_session(hello) to clients on a Unix socket. run_session runs
+    the menu for one client; status() adds whatever the caller wants shown.
+    """
+
+    def __init__(self, run_session: Callable[[Dict], None], path: Optional[str] = None,
+                 status: Callable[[], Dict] = dict):
+        self.run_session = run_session
+        self.path = path or socket_path()
+        self._status = status
+        self.started = time.time()
+        self.sessions = 0
+        self.active = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def count(self, change: int):
+        """A session started (+1) or ended (-1)"""
+        with self._lock:
+            self.active += change
+            self.sessions += change > 0
+
+    def status(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "sessions": self.sessions,
+            "active": self.active,
+            **self._status(),
+        }
+
+    def serve_forever(self):
+        running = client_socket(self.path)
+        if running is not None:
+            running.close()
+            raise RuntimeError(f"A daemon is already serving {self.path}")
+        if os.path.exists(self.path):
+            # left behind by a daemon that didn't shut down cleanly
+            os.remove(self.path)
+        sys.stdin, sys.stdout = _Routed(sys.stdin), _Routed(sys.stdout)
+        self._server = _Server(self.path, _Handler)
+        self._server.story_daemon = self
+        # the socket runs the menu as this user; nobody else may connect
+        os.chmod(self.path, 0o600)
+        if threading.current_thread() is threading.main_thread():
+            # kill and service managers stop with SIGTERM; clean up as for Ctrl+C
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self.path)
+            sys.stdin, sys.stdout = sys.stdin._stream, sys.stdout._stream
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def client_socket(path: Optional[str] = None) -> Optional[socket.socket]:
+    """A connection to the daemon, or None when none is running"""
+    path = path or socket_path()
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def run_client(hello: Dict, path: Optional[str] = None) -> bool:
+    """Relay this terminal to the daemon's menu; False if no daemon is running"""
+    connection = client_socket(path)
+    if connection is None:
+        return False
+    with connection, connection.makefile("rb") as rfile, connection.makefile("wb") as wfile:
+        def send(message):
+            wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            wfile.flush()
+
+        send(hello)
+        for line in rfile:
+            message = json.loads(line)
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "read" in message:
+                text = sys.stdin.readline()
+                send({"line": text.rstrip("\n")} if text else {"eof": True})
+            else:
+                break
+    return True
+
+
+def status(path: Optional[str] = None) -> Optional[Dict]:
+    connection = client_socket(path)
+    if connection is None:
+        return None
+    with connection, connection.makefile("rb") as rfile:
+        connection.sendall(b'{"command": "status"}\n')
+        return json.loads(rfile.readline())["status"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the warm story daemon (start it with python main.py --daemon)")
+    parser.add_argument("command", choices=["status"])
+    parser.add_argument("--socket", default=None, help=f"Daemon socket (default: BEANSTALK_SOCKET or {SOCKET_FILE})")
+    args = parser.parse_args()
+
+    info = status(args.socket)
+    if info is None:
+        print(f"No daemon on {args.socket or socket_path()}")
+        return
+    for key, value in info.items():
+        print(f"{key:<10}{value}")
+
+
+if __name__ == "__main__":
+    main()
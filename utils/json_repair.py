@@ -0,0 +1,449 @@
+"""
+Shared parser for the JSON the agents ask the model for.
+
+Model replies are often almost JSON: wrapped in a ```json fence or a sentence
+of prose, with a trailing comma, typographic quotes, raw newlines or
+unescaped quotes inside a story, or cut off at max_tokens. Each of those used
+to cost a fallback or a retry. parse() takes the reply apart in three steps,
+stopping at the first that works:
+
+    clean       json.loads as is
+    extracted   the outermost {...} found inside prose or a fence
+    repaired    that object rewritten by a tolerant scanner (see repair_json)
+
+and then validates the result against the schema for its prompt family,
+coercing harmless type slips ("true" for true, "7.5" for 7.5). Replies that
+still don't parse, or don't match, raise JSONRepairError, a ValueError, so
+the agents' existing fallbacks apply.
+
+Counts per family and outcome are kept by stats() and exported as
+beanstalk_json_responses_total; extracted + repaired replies are the calls
+bare json.loads would have thrown away.
+
+Usage:
+    python -m utils.json_repair tests/cassettes/*.jsonl.gz   # parse/repair rates over recorded replies
+"""
+
+import argparse
+import copy
+import gzip
+import json
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+from utils import metrics
+from utils.story_store import SCORE_DIMENSIONS
+
+OUTCOMES = ("clean", "extracted", "repaired", "failed", "invalid")
+SMART_QUOTES = "“”„‟″"
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+VALID_ESCAPES = '"\\/bfnrtu'
+
+
+class JSONRepairError(ValueError):
+    """The reply held no usable JSON, or it didn't match the family's schema"""
+
+    def __init__(self, message: str, family: str = None):
+        super().__init__(message)
+        self.family = family
+
+
+# --- schemas: one coercer per field, raising ValueError on a mismatch ---
+
+def text(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f"expected text, got {type(value).__name__}")
+
+
+def loose_text(value: Any) -> str:
+    """Text, or a list/dict of it (outline characters often come back as a list)"""
+    if isinstance(value, list):
+        return "; ".join(loose_text(item) for item in value)
+    if isinstance(value, dict):
+        return "; ".join(f"{key}: {loose_text(item)}" for key, item in value.items())
+    return text(value)
+
+
+def boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    raise ValueError(f"expected true/false, got {value!r}")
+
+
+def number(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return float(value.strip().split("/")[0])  # "7.5" or "7.5/10"
+    raise ValueError(f"expected a number, got {value!r}")
+
+
+def list_of(item: Callable) -> Callable:
+    def coerce(value: Any) -> List:
+        if not isinstance(value, list):
+            raise ValueError(f"expected a list, got {type(value).__name__}")
+        return [item(element) for element in value]
+    return coerce
+
+
+def dict_of(item: Callable) -> Callable:
+    def coerce(value: Any) -> Dict:
+        if not isinstance(value, dict):
+            raise ValueError(f"expected an object, got {type(value).__name__}")
+        return {key: item(element) for key, element in value.items()}
+    return coerce
+
+
+def nullable(coerce: Callable) -> Callable:
+    return lambda value: None if value is None else coerce(value)
+
+
+def obj(value: Any) -> Dict:
+    if not isinstance(value, dict):
+        raise ValueError(f"expected an object, got {type(value).__name__}")
+    return value
+
+
+class Schema:
+    """
+    Required fields, and optional fields with their defaults (a missing
+    optional field is only filled in when the default isn't None). Fields not
+    in the schema are passed through.
+    """
+
+    def __init__(self, required: Dict[str, Callable], optional: Dict[str, Tuple[Callable, Any]] = None):
+        self.required = required
+        self.optional = optional or {}
+
+    def validate(self, value: Any) -> Dict:
+        if not isinstance(value, dict):
+            raise ValueError(f"expected an object, got {type(value).__name__}")
+        result = dict(value)
+        for name, coerce in self.required.items():
+            if name not in value:
+                raise ValueError(f"missing field {name!r}")
+            result[name] = self._coerce(name, coerce, value[name])
+        for name, (coerce, default) in self.optional.items():
+            if name in value:
+                result[name] = self._coerce(name, coerce, value[name])
+            elif default is not None:
+                result[name] = copy.copy(default)
+        return result
+
+    @staticmethod
+    def _coerce(name: str, coerce: Callable, value: Any):
+        try:
+            return coerce(value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"field {name!r}: {e}") from None
+
+
+class JudgeSchema(Schema):
+    """
+    A judge verdict. Null scores mark an unsafe story, which can't pass; any
+    other verdict needs the overall score and all four rubric dimensions.
+    """
+
+    def validate(self, value: Any) -> Dict:
+        result = super().validate(value)
+        if "scores" in result and result["scores"] is None:
+            if result["pass"]:
+                raise ValueError("field 'scores': null, but the story passed")
+            return result
+        for name in ("scores", "overall"):
+            if name not in result:
+                raise ValueError(f"missing field {name!r}")
+        missing = [dim for dim in SCORE_DIMENSIONS if dim not in result["scores"]]
+        if missing:
+            raise ValueError(f"field 'scores': missing {', '.join(missing)}")
+        return result
+
+
+JUDGE_FIELDS = {
+    # null scores mark an unsafe story
+    "scores": (nullable(dict_of(number)), None),
+    "overall": (number, None),
+    "reason": (text, None),
+    "feedback": (text, None),
+    "improvement": (text, None),
+}
+
+# one per prompt family in utils/prompts.py
+SCHEMAS: Dict[str, Schema] = {
+    "input": Schema(
+        {"valid": boolean, "story_elements": text},
+        {"suggestion": (text, "")},
+    ),
+    "outline": Schema(
+        {"outline": loose_text},
+        {"characters": (loose_text, ""), "instruction": (loose_text, "")},
+    ),
+    "story": Schema({"title": text, "story": text, "moral": text}),
+    "patch": Schema({"edits": list_of(obj)}),
+    "judge": JudgeSchema({"pass": boolean}, JUDGE_FIELDS),
+    "judge_questions": JudgeSchema({"pass": boolean}, {**JUDGE_FIELDS, "questions": (list_of(loose_text), [])}),
+    # each entry is checked against "judge" by JudgeSystem.evaluate_stories, so one bad entry costs one story
+    "judge_many": Schema({"evaluations": list_of(obj)}),
+    "questions": Schema({"questions": list_of(loose_text)}),
+}
+
+
+# --- repair ---
+
+def _closes_string(source: str, index: int) -> bool:
+    """A quote ends a string when what follows can follow a string in JSON"""
+    rest = source[index + 1:].lstrip()
+    return not rest or rest[0] in ",:}]"
+
+
+def _starts(source: str) -> List[int]:
+    """Where the JSON may begin: braces opening on a key first, then any other brace, then brackets"""
+    keyed = [match.start() for match in re.finditer(r"\{\s*[\"'}" + SMART_QUOTES + "]", source)]
+    braces = [i for i, c in enumerate(source) if c == "{" and i not in keyed]
+    return keyed + braces + [i for i, c in enumerate(source) if c == "["]
+
+
+def repair_json(source: str) -> Tuple[Any, List[str]]:
+    """
+    Parse the first JSON object or array in source, repairing it on the way.
+    A brace in prose before the object ("my {honest} verdict: {...}") is
+    skipped. Returns the value and the kinds of repair made, e.g.
+    ["trailing_comma", "truncated"]; raises JSONRepairError when there is
+    nothing to salvage.
+    """
+    starts = _starts(source)
+    if not starts:
+        raise JSONRepairError("no JSON object in the response")
+    for start in starts:
+        try:
+            return _repair_from(source, start)
+        except JSONRepairError as e:
+            error = e
+    raise error
+
+
+def _repair_from(source: str, start: int) -> Tuple[Any, List[str]]:
+    repairs = set()
+    out: List[str] = []
+    stack: List[str] = []
+    # (length of out, open brackets) at each comma between values, to back off to on truncation
+    commas: List[Tuple[int, Tuple[str, ...]]] = []
+    quote = None
+    escaped = False
+    i = start
+    while i < len(source):
+        c = source[i]
+        if quote is not None:
+            if escaped:
+                if c in VALID_ESCAPES:
+                    out.append(c)
+                else:
+                    out[-1] = c  # \' and friends: drop the backslash
+                    repairs.add("invalid_escapes")
+                escaped = False
+            elif c == "\\":
+                out.append(c)
+                escaped = True
+            elif c == quote or (quote == '"' and c in SMART_QUOTES) or (quote in SMART_QUOTES and c in SMART_QUOTES + '"'):
+                if _closes_string(source, i):
+                    out.append('"')
+                    quote = None
+                elif c == '"' or c == quote == "'":
+                    out.append('\\"' if c == '"' else c)
+                    repairs.add("inner_quotes")
+                else:
+                    out.append(c)  # typographic quotes inside the text stay as they are
+            elif c == '"':
+                out.append('\\"')  # inside a single-quoted string
+            elif c in CONTROL_ESCAPES or ord(c) < 0x20:
+                out.append(CONTROL_ESCAPES.get(c, f"\\u{ord(c):04x}"))
+                repairs.add("control_chars")
+            else:
+                out.append(c)
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+            out.append(c)
+        elif c in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                repairs.add("trailing_comma")
+            if not stack:
+                break
+            out.append(stack.pop())
+            if not stack:
+                break
+        elif c == '"' or c in SMART_QUOTES or c == "'":
+            if c != '"':
+                repairs.add("smart_quotes" if c in SMART_QUOTES else "single_quotes")
+            quote = c
+            out.append('"')
+        elif c == ",":
+            commas.append((len(out), tuple(stack)))
+            out.append(c)
+        elif c.isalpha():
+            word = re.match(r"[A-Za-z_]+", source[i:]).group()
+            if word in PYTHON_LITERALS:
+                out.append(PYTHON_LITERALS[word])
+                repairs.add("python_literals")
+            else:
+                out.append(word)
+            i += len(word)
+            continue
+        else:
+            out.append(c)
+        i += 1
+
+    if quote is None and not stack:
+        candidates = ["".join(out)]
+    else:
+        # cut off mid-reply: close what is open, or back off to an earlier comma
+        repairs.add("truncated")
+        if escaped:
+            out.pop()
+        body = "".join(out) + ('"' if quote is not None else "")
+        candidates = [_close(body, stack)]
+        candidates += [_close("".join(out[:length]), list(open_brackets)) for length, open_brackets in reversed(commas)]
+
+    for candidate in candidates:
+        try:
+            return json.loads(candidate), sorted(repairs)
+        except json.JSONDecodeError:
+            continue
+    raise JSONRepairError("the response's JSON could not be repaired")
+
+
+def _close(body: str, stack: List[str]) -> str:
+    body = body.rstrip()
+    if body.endswith(","):
+        body = body[:-1]
+    elif body.endswith(":"):
+        body += " null"
+    return body + "".join(reversed(stack))
+
+
+# --- entry point and stats ---
+
+_lock = threading.Lock()
+_stats: Dict[str, Counter] = {}
+_repairs: Dict[str, Counter] = {}
+
+
+def _record(family: str, outcome: str, repairs: List[str] = ()):
+    with _lock:
+        _stats.setdefault(family, Counter())[outcome] += 1
+        _repairs.setdefault(family, Counter()).update(repairs)
+    metrics.JSON_RESPONSES.labels(family=family, result=outcome).inc()
+    if outcome in ("failed", "invalid"):
+        metrics.JSON_PARSE_FAILURES.labels(site=metrics.current_site()).inc()
+
+
+def parse(response: str, family: str) -> Dict:
+    """The reply's JSON, repaired if need be and validated against SCHEMAS[family]"""
+    schema = SCHEMAS[family]
+    repairs: List[str] = []
+    try:
+        value = json.loads(response)
+        outcome = "clean"
+    except (json.JSONDecodeError, TypeError):
+        try:
+            value, repairs = repair_json(response or "")
+        except JSONRepairError as e:
+            _record(family, "failed")
+            e.family = family
+            raise
+        outcome = "repaired" if repairs else "extracted"
+
+    try:
+        result = schema.validate(value)
+    except ValueError as e:
+        _record(family, "invalid", repairs)
+        raise JSONRepairError(f"{family} response: {e}", family) from None
+    _record(family, outcome, repairs)
+    return result
+
+
+def stats() -> Dict[str, Dict]:
+    """Per family: responses by outcome, repair kinds, parse rate and calls saved"""
+    with _lock:
+        snapshot = {family: (Counter(counts), Counter(_repairs[family])) for family, counts in _stats.items()}
+    report = {}
+    for family, (counts, repairs) in sorted(snapshot.items()):
+        total = sum(counts.values())
+        saved = counts["extracted"] + counts["repaired"]
+        report[family] = {
+            "responses": total,
+            **{outcome: counts[outcome] for outcome in OUTCOMES},
+            "repairs": dict(repairs),
+            "parse_rate": round((total - counts["failed"] - counts["invalid"]) / total * 100, 1) if total else 0.0,
+            "strict_parse_rate": round(counts["clean"] / total * 100, 1) if total else 0.0,
+            # replies bare json.loads would have dropped to a fallback or retry
+            "calls_saved": saved,
+        }
+    return report
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+        _repairs.clear()
+
+
+# prompt text that identifies each family, for replaying recorded replies
+FAMILY_MARKERS = [
+    ("input", "Analyze this user input"),
+    ("judge_many", "Evaluate each story below"),
+    ("judge_questions", "Questions for the child"),
+    ("judge", "expert evaluator of bedtime stories"),
+    ("questions", '"questions"'),
+    ("patch", '"edits"'),
+    ("outline", '"outline"'),
+    ("story", '"story"'),
+]
+
+
+def family_of(prompt: str) -> str:
+    for family, marker in FAMILY_MARKERS:
+        if marker in prompt:
+            return family
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse and repair rates over recorded model replies")
+    parser.add_argument("cassettes", nargs="+", help="Cassette files (.jsonl.gz) from tests/cassettes")
+    args = parser.parse_args()
+
+    for path in args.cassettes:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                recording = json.loads(line)
+                family = family_of(recording["prompt"])
+                if family is None:
+                    continue  # free-text replies (answers to questions)
+                try:
+                    parse(recording["response"], family)
+                except JSONRepairError:
+                    pass
+
+    print(f"{'family':<16}{'replies':>9}{'clean':>8}{'extracted':>11}{'repaired':>10}{'failed':>8}{'invalid':>9}{'parsed':>9}")
+    for family, row in stats().items():
+        print(
+            f"{family:<16}{row['responses']:>9}{row['clean']:>8}{row['extracted']:>11}{row['repaired']:>10}"
+            f"{row['failed']:>8}{row['invalid']:>9}{row['parse_rate']:>8}%"
+        )
+        if row["repairs"]:
+            print(f"{'':<16}repairs: " + ", ".join(f"{kind} {count}" for kind, count in sorted(row["repairs"].items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Story library builder.
+
+Writes several stories per theme from a single outline: the outline comes from
+the OutlineCache when a theme has been seen before, the variants are written
+and judged in parallel, and passing stories get their Q&A questions and are
+appended to a JSON lines library. Per theme that is one outline call (or none)
+plus a story, judge and questions call per variant, instead of an outline call
+for every story.
+
+With --bulk-judge a theme's variants are judged together in one prompt
+(JudgeSystem.evaluate_stories) instead of a judge call each.
+
+With --batch every theme runs at once and each stage (outlines, stories,
+judging, questions) goes out as one provider batch; see utils/batch_backend.py.
+
+Usage:
+    python -m utils.library_builder themes.txt --variants 3 --concurrency 4 --output story_library.jsonl
+    python -m utils.library_builder themes.txt --batch openai
+    python -m utils.library_builder themes.txt --variants 4 --bulk-judge
+    python -m utils.library_builder themes.txt --profile    # see utils/profiling.py
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from utils import metrics, profiling
+
+
+def iter_themes(path: str) -> Iterable[str]:
+    """One theme per line; blank lines and # comments are skipped"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            theme = line.strip()
+            if theme and not theme.startswith("#"):
+                yield theme
+
+
+class LibraryBuilder:
+    """Fan each theme out into judged story variants and collect the passing ones"""
+
+    def __init__(
+        self, story_generator, judge_system, variants: int = 3, concurrency: int = 4, qa_agent=None, bulk_judge=False
+    ):
+        self.story_generator = story_generator
+        self.judge_system = judge_system
+        # optional QAAgent; passing stories then carry suggested questions
+        self.qa_agent = qa_agent
+        self.variants = variants
+        self.concurrency = concurrency
+        # judge a theme's variants in shared prompts; a variant the batch reply misses is re-judged alone
+        self.bulk_judge = bulk_judge
+        self._write_lock = threading.Lock()
+
+    def build_theme(self, theme: str) -> List[Dict]:
+        """Judged variants for one theme, passing or not"""
+        stories, outline = self.story_generator.generate_variants(theme, self.variants)
+        with ThreadPoolExecutor(max_workers=max(1, len(stories))) as pool:
+            if self.bulk_judge:
+                evaluations = self.judge_system.evaluate_stories(stories)
+            else:
+                evaluations = list(pool.map(self.judge_system.evaluate_story, stories))
+            passing = [i for i, evaluation in enumerate(evaluations) if evaluation.get("pass", False)]
+            questions = {}
+            if self.qa_agent:
+                asked = pool.map(self.qa_agent.generate_question_opportunities, [stories[i] for i in passing])
+                questions = dict(zip(passing, asked))
+
+        return [
+            {
+                "theme": theme,
+                "variant": i,
+                "timestamp": datetime.now().isoformat(),
+                "outline": outline,
+                "story": story,
+                "evaluation": evaluation,
+                "questions": questions.get(i, []),
+            }
+            for i, (story, evaluation) in enumerate(zip(stories, evaluations))
+        ]
+
+    def build(self, themes: Iterable[str], output_file: str) -> Dict:
+        """Build every theme with bounded concurrency, appending passing stories to output_file"""
+        cache = self.story_generator.outline_cache
+        hits_before = cache.stats["hits"] if cache is not None else 0
+        bulk_before = dict(self.judge_system.bulk_stats)
+        summary = {"themes": 0, "stories": 0, "passed": 0}
+        started = time.monotonic()
+
+        def run(theme: str):
+            records = self.build_theme(theme)
+            passing = [r for r in records if r["evaluation"].get("pass", False)]
+            with self._write_lock:
+                summary["themes"] += 1
+                summary["stories"] += len(records)
+                summary["passed"] += len(passing)
+                with open(output_file, "a", encoding="utf-8") as f:
+                    for record in passing:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            print(f"  {theme[:50]:<50} {len(passing)}/{len(records)} passed")
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(run, themes))
+
+        outline_hits = (cache.stats["hits"] - hits_before) if cache is not None else 0
+        judge_calls = summary["stories"]
+        if self.bulk_judge:
+            bulk = self.judge_system.bulk_stats
+            judge_calls = sum(bulk[key] - bulk_before[key] for key in ("requests", "rejudged"))
+        summary.update({
+            "outline_cache_hits": outline_hits,
+            "outline_calls": summary["themes"] - outline_hits,
+            "judge_calls": judge_calls,
+            # a story call per variant, the judge calls, a questions call per passing variant,
+            # plus one outline call per uncached theme
+            "llm_calls": summary["themes"] - outline_hits + summary["stories"] + judge_calls
+            + (summary["passed"] if self.qa_agent else 0),
+            "wall_time": round(time.monotonic() - started, 2),
+        })
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a library of judged bedtime stories from a list of themes")
+    parser.add_argument("themes", help="Text file with one theme per line")
+    parser.add_argument("--variants", type=int, default=3, help="Stories per theme, all from one outline")
+    parser.add_argument("--concurrency", type=int, default=None, help="Themes built at once (default 4, all with --batch)")
+    parser.add_argument("--batch", choices=["openai", "local"],
+                        help="Send each stage as a provider batch (local processes batch files in-process)")
+    parser.add_argument("--bulk-judge", action="store_true", help="Judge each theme's variants in one prompt")
+    parser.add_argument("--output", default="story_library.jsonl", help="Library file passing stories are appended to")
+    parser.add_argument("--outline-cache", default=os.path.join("story_metrics_store", "outlines.jsonl"),
+                        help="Outline cache shared with the app")
+    profiling.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profiling.configure(args.profile)
+
+    from main import call_model, load_env
+    from agents.judge import JudgeSystem
+    from agents.qa import QAAgent
+    from agents.story_generator import StoryGenerator
+    from utils.batch_backend import batch_runner
+    from utils.outline_cache import OutlineCache
+    from utils.single_flight import SingleFlight
+
+    load_env()
+    themes = list(iter_themes(args.themes))
+    llm = SingleFlight(call_model)
+    concurrency = args.concurrency or 4
+    if args.batch:
+        llm = batch_runner(args.batch, llm)
+        # every theme has to be waiting on the same stage for it to go out as one batch
+        concurrency = args.concurrency or max(1, len(themes))
+    llm = metrics.InstrumentedCall(llm)
+    metrics.start_from_env()
+
+    os.makedirs(os.path.dirname(args.outline_cache) or ".", exist_ok=True)
+    builder = LibraryBuilder(
+        StoryGenerator(llm, outline_cache=OutlineCache(args.outline_cache)),
+        JudgeSystem(llm),
+        args.variants,
+        concurrency,
+        qa_agent=QAAgent(llm),
+        bulk_judge=args.bulk_judge,
+    )
+    with profiling.stage("library_build"):
+        summary = builder.build(themes, args.output)
+    print(
+        f"\n{summary['passed']}/{summary['stories']} stories passed across {summary['themes']} themes "
+        f"in {summary['wall_time']}s | {summary['llm_calls']} LLM calls, {summary['judge_calls']} judging "
+        f"({summary['outline_cache_hits']} outlines from cache)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,525 @@
+"""
+Prometheus-style metrics for the agents, caches and story tracker.
+
+Counters, gauges and latency histograms live in a process-wide registry and
+are rendered in the Prometheus text format (0.0.4). Nothing is exported
+unless asked for, from the shell environment:
+
+    BEANSTALK_METRICS_PORT=9464          serve http://127.0.0.1:9464/metrics
+    BEANSTALK_METRICS_FILE=beanstalk.prom   rewrite this file every
+    BEANSTALK_METRICS_INTERVAL=15        ... seconds, and once more at exit
+
+The file is written atomically, so node_exporter's textfile collector can
+pick it up; use it for batch jobs that finish before a scrape would.
+
+Agent methods are wrapped with @observed, which counts calls by outcome (ok,
+fallback, error), times them and names the call site every LLM call and
+fallback made inside them is recorded under.
+
+Usage:
+    BEANSTALK_METRICS_PORT=9464 python main.py
+    python -m utils.metrics beanstalk.prom        # pretty-print a dump
+"""
+
+import argparse
+import atexit
+import bisect
+import functools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# http.server is imported when the endpoint is started; main.py imports this module at startup
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+WRITE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# the agent method running in this context, e.g. "JudgeSystem.evaluate_story"
+_call_site: ContextVar = ContextVar("beanstalk_call_site", default=None)
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in labels]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """A named family of time series, one per combination of label values"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, **labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames) or '(none)'}")
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, **labels):
+        """Drop the series with these label values, if there is one"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._children.pop(key, None)
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} needs labels {', '.join(self.labelnames)}")
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[Tuple[str, Tuple, float]]:
+        """(sample name, labels, value) for every series"""
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for key, child in sorted(children):
+            labels = tuple(zip(self.labelnames, key))
+            samples.extend(child.samples(self.name, labels))
+        return samples
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("Counters only go up")
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: Tuple) -> List:
+        return [(name, labels, self.value)]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = float(value)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function at render time instead"""
+        self.function = function
+
+    def samples(self, name: str, labels: Tuple) -> List:
+        value = self.value
+        if self.function is not None:
+            try:
+                value = float(self.function())
+            except Exception:
+                value = math.nan
+        return [(name, labels, value)]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._unlabelled().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._unlabelled().set_function(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name: str, labels: Tuple) -> List:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        samples, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", labels + (("le", _format_value(bound)),), cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LLM_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled().observe(value)
+
+    def time(self):
+        return self._unlabelled().time()
+
+
+class MetricsRegistry:
+    """Metrics by name; render() is the body of a scrape"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LLM_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+    def get_sample_value(self, name: str, labels: Dict[str, str] = None) -> Optional[float]:
+        """Current value of one sample (e.g. "beanstalk_agent_calls_total"), None if it has no series yet"""
+        wanted = sorted((labels or {}).items())
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if not name.startswith(metric.name):
+                continue
+            for sample_name, sample_labels, value in metric.samples():
+                if sample_name == name and sorted(sample_labels) == wanted:
+                    return value
+        return None
+
+
+REGISTRY = MetricsRegistry()
+
+AGENT_CALLS = REGISTRY.counter(
+    "beanstalk_agent_calls_total", "Agent method calls by outcome (ok, fallback, error)",
+    ("agent", "method", "outcome"))
+AGENT_SECONDS = REGISTRY.histogram(
+    "beanstalk_agent_call_seconds", "Agent method latency in seconds", ("agent", "method"))
+LLM_CALLS = REGISTRY.counter(
+    "beanstalk_llm_calls_total", "LLM calls by call site and outcome (ok, error, timeout, budget)",
+    ("site", "outcome"))
+LLM_SECONDS = REGISTRY.histogram(
+    "beanstalk_llm_call_seconds", "LLM call latency in seconds, including time coalesced onto another call",
+    ("site",))
+FALLBACKS = REGISTRY.counter(
+    "beanstalk_fallbacks_total", "Canned or degraded responses served instead of the model's", ("site",))
+JSON_PARSE_FAILURES = REGISTRY.counter(
+    "beanstalk_json_parse_failures_total", "Model responses with no usable JSON, even after repair", ("site",))
+JSON_RESPONSES = REGISTRY.counter(
+    "beanstalk_json_responses_total",
+    "JSON responses by prompt family and result (clean, extracted, repaired, failed, invalid)",
+    ("family", "result"))
+JUDGE_VERDICTS = REGISTRY.counter(
+    "beanstalk_judge_verdicts_total", "Judge verdicts (pass, fail, unsafe, fallback)", ("verdict",))
+STORIES_SAVED = REGISTRY.counter(
+    "beanstalk_stories_saved_total", "Stories saved by the tracker, by whether they passed", ("passed",))
+TRACKER_WRITE_SECONDS = REGISTRY.histogram(
+    "beanstalk_tracker_write_seconds",
+    "add_story latency: prepare (tokenize, embed, compress) and commit (lock wait and writes)",
+    ("phase",), buckets=WRITE_BUCKETS)
+OUTLINE_CACHE_LOOKUPS = REGISTRY.counter(
+    "beanstalk_outline_cache_lookups_total", "Outline cache lookups by result (hit, miss)", ("result",))
+SINGLE_FLIGHT_CALLS = REGISTRY.counter(
+    "beanstalk_single_flight_calls_total", "Calls through SingleFlight: upstream or coalesced onto one in flight",
+    ("result",))
+ROUTE_DECISIONS = REGISTRY.counter(
+    "beanstalk_route_decisions_total",
+    "Model routes chosen per call site and why (preferred, fastest, probe, failover)", ("site", "route", "reason"))
+ROUTE_CALLS = REGISTRY.counter(
+    "beanstalk_route_calls_total", "Calls per model route by outcome (ok, error)", ("route", "outcome"))
+ROUTE_LATENCY = REGISTRY.gauge(
+    "beanstalk_route_latency_seconds", "Learned (EWMA) call latency per call site and route", ("site", "route"))
+ROUTE_OPEN = REGISTRY.gauge(
+    "beanstalk_route_open", "1 while a route is out of rotation after too many errors", ("route",))
+LIBRARY_STORIES = REGISTRY.counter(
+    "beanstalk_library_stories_served_total",
+    "Vetted library stories served instead of a new one, by failure (timeout, open, budget, error)", ("reason",))
+PROMPT_TOKENS = REGISTRY.counter(
+    "beanstalk_prompt_tokens_total",
+    "Prompt tokens sent by call site and part (prefix, suffix, unstructured)", ("site", "part"))
+PROMPT_PREFIX = REGISTRY.counter(
+    "beanstalk_prompt_prefix_total",
+    "Prompts by template and whether the provider can serve their static prefix from cache (hit, miss, short)",
+    ("template", "result"))
+TENANT_SHARD_LOOKUPS = REGISTRY.counter(
+    "beanstalk_tenant_shard_lookups_total",
+    "Tenant shard lookups by result (hit: already open, open: opened, evicting the least recent if full)",
+    ("result",))
+TENANT_SHARDS_OPEN = REGISTRY.gauge("beanstalk_tenant_shards_open", "Tenant shards with open file handles")
+STORIES = REGISTRY.gauge(
+    "beanstalk_stories", "Stories in each tenant's history (total, passed, liked)", ("tenant", "state"))
+
+
+def current_site() -> str:
+    """The agent method running in this context, or "other" outside one"""
+    state = _call_site.get()
+    return state["site"] if state else "other"
+
+
+def observed(function: Callable) -> Callable:
+    """Count, time and name the call site of an agent method"""
+    method = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        agent = type(self).__name__
+        state = {"site": f"{agent}.{method}", "fallback": False}
+        token = _call_site.set(state)
+        outcome = "error"
+        started = time.perf_counter()
+        try:
+            result = function(self, *args, **kwargs)
+            outcome = "fallback" if state["fallback"] else "ok"
+            return result
+        finally:
+            _call_site.reset(token)
+            AGENT_SECONDS.labels(agent=agent, method=method).observe(time.perf_counter() - started)
+            AGENT_CALLS.labels(agent=agent, method=method, outcome=outcome).inc()
+
+    return wrapper
+
+
+def fallback():
+    """Record that the running agent method served a fallback"""
+    state = _call_site.get()
+    if state:
+        state["fallback"] = True
+    FALLBACKS.labels(site=current_site()).inc()
+
+
+def track(story_tracker, tenant: str = "default"):
+    """Export the tenant's history totals as gauges, read from its tracker's summary at scrape time"""
+    for state, key in (("total", "count"), ("passed", "passed"), ("liked", "liked")):
+        STORIES.labels(tenant=tenant, state=state).set_function(lambda key=key: story_tracker.summary()[key])
+
+
+def untrack(tenant: str):
+    """Stop exporting the tenant's history totals"""
+    for state in ("total", "passed", "liked"):
+        STORIES.remove(tenant=tenant, state=state)
+
+
+class InstrumentedCall:
+    """
+    Wraps an LLM call function to count and time calls by call site and
+    outcome. Put it outermost, so time spent waiting for the budget or on a
+    coalesced call counts as the caller saw it. Prompt tokens are accounted
+    here too (utils/prompt_compiler.py).
+    """
+
+    def __init__(self, llm_call_function: Callable):
+        self.call_model = llm_call_function
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        from utils.budget import BudgetExhausted
+
+        from utils.prompt_compiler import account
+
+        site = current_site()
+        account(prompt, site)
+        outcome = "error"
+        started = time.perf_counter()
+        try:
+            response = self.call_model(prompt, max_tokens=max_tokens, temperature=temperature, **kwargs)
+            outcome = "ok"
+            return response
+        except BudgetExhausted:
+            outcome = "budget"
+            raise
+        except TimeoutError:
+            outcome = "timeout"
+            raise
+        finally:
+            LLM_SECONDS.labels(site=site).observe(time.perf_counter() - started)
+            LLM_CALLS.labels(site=site, outcome=outcome).inc()
+
+    def __getattr__(self, name):
+        # get_stats() and friends of the wrapped call
+        return getattr(self.call_model, name)
+
+
+def start_http_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY):
+    """Serve the registry at http://host:port/metrics from a daemon thread; returns the server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # scrapes would otherwise print over the menu
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class FileDumper:
+    """Rewrites a Prometheus text file every interval seconds, and once more at exit"""
+
+    def __init__(self, path: str, interval: float = 15.0, registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        temp_file = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(self.registry.render())
+        os.replace(temp_file, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Could not write metrics to {self.path}: {e}")
+
+    def start(self) -> "FileDumper":
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="metrics-dump", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        atexit.unregister(self.stop)
+        try:
+            self.write()
+        except OSError as e:
+            print(f"Could not write metrics to {self.path}: {e}")
+
+
+def start_from_env():
+    """Start the HTTP endpoint and file dump the environment asks for (neither by default)"""
+    port = os.getenv("BEANSTALK_METRICS_PORT")
+    if port:
+        try:
+            start_http_server(int(port))
+        except OSError as e:
+            print(f"Could not serve metrics on port {port}: {e}")
+    path = os.getenv("BEANSTALK_METRICS_FILE")
+    if path:
+        FileDumper(path, float(os.getenv("BEANSTALK_METRICS_INTERVAL", "15"))).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the non-zero series in a metrics dump")
+    parser.add_argument("file", help="File written with BEANSTALK_METRICS_FILE")
+    args = parser.parse_args()
+
+    rows = []
+    with open(args.file, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            series, value = line.rstrip().rsplit(" ", 1)
+            if "_bucket{" not in series and float(value) != 0:
+                rows.append((series, value))
+    width = max((len(series) for series, _ in rows), default=0)
+    for series, value in rows:
+        print(f"{series:<{width}}  {float(value):g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Per-call-site model routing.
+
+Every agent method (the call site metrics.current_site() names, e.g.
+"InputHandler.process_input") gets an ordered list of routes, each a model
+on an endpoint, and a policy:
+
+    ordered   the first healthy route; the others are failovers
+    fastest   the healthy route with the lowest learned latency at this site,
+              for cheap calls the user is waiting on (validation, questions)
+
+Latency is learned per site and route as an EWMA of successful call times,
+since a story call and a validation call on the same model aren't
+comparable. Errors are tracked per route as an EWMA error rate, since an
+outage hits every site. A route whose error rate passes error_threshold is
+left out for cooldown seconds, and a call that fails on one route is retried
+on the next healthy one with what is left of its timeout. When every route
+of a site is out, calls fail at once with RoutesOpen instead of waiting on a
+failing upstream. The fastest policy re-times the least recently used route
+every probe_every calls, so a route that got faster is noticed.
+
+Decisions are counted in beanstalk_route_decisions_total with the reason
+(preferred, fastest, probe, failover); learned latencies and open routes are
+exported as gauges (see utils/metrics.py).
+
+Routes come from DEFAULT_CONFIG, or from a JSON file of the same shape named
+by BEANSTALK_ROUTES:
+
+    {"routes": {"mini": {"model": "gpt-4o-mini"},
+                "local": {"model": "llama3", "endpoint": "http://localhost:8000/v1"}},
+     "sites": {"InputHandler.process_input": {"policy": "fastest", "routes": ["mini", "local"]}},
+     "default": {"policy": "ordered", "routes": ["mini"]}}
+
+Usage:
+    python -m utils.model_router                 # print the default routing table
+    python -m utils.model_router routes.json
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils import metrics
+
+POLICIES = ("ordered", "fastest")
+
+
+class RoutesOpen(ConnectionError):
+    """Every route for the call site is cooling down after errors"""
+
+
+DEFAULT_CONFIG = {
+    "routes": {
+        "turbo": {"model": "gpt-3.5-turbo"},
+        "mini": {"model": "gpt-4o-mini"},
+    },
+    "sites": {
+        # short replies the user waits on: whichever model answers first
+        "InputHandler.process_input": {"policy": "fastest", "routes": ["mini", "turbo"]},
+        "QAAgent.generate_question_opportunities": {"policy": "fastest", "routes": ["mini", "turbo"]},
+        "QAAgent.answer_question": {"policy": "fastest", "routes": ["mini", "turbo"]},
+    },
+    "default": {"policy": "ordered", "routes": ["turbo", "mini"]},
+}
+
+
+class _RouteHealth:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.error_rate = 0.0
+        self.open_until = 0.0
+
+
+class ModelRouter:
+    """
+    Wraps an LLM call function that takes model= (and endpoint=) and picks
+    them per call site. Put it under SingleFlight and BudgetedCall, so the
+    budget's timeout reaches it and failovers share it.
+    """
+
+    def __init__(
+        self,
+        llm_call_function: Callable,
+        config: Optional[Dict] = None,
+        alpha: float = 0.2,
+        error_threshold: float = 0.5,
+        cooldown: float = 30.0,
+        probe_every: int = 20,
+        min_timeout: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.call_model = llm_call_function
+        config = config or DEFAULT_CONFIG
+        self.routes: Dict[str, Dict] = config["routes"]
+        self.sites: Dict[str, Dict] = config.get("sites", {})
+        self.default: Dict = config.get("default") or {"policy": "ordered", "routes": list(self.routes)}
+        for name, site in [("default", self.default)] + list(self.sites.items()):
+            if site.get("policy", "ordered") not in POLICIES:
+                raise ValueError(f"{name}: unknown policy {site['policy']!r}")
+            unknown = [route for route in site["routes"] if route not in self.routes]
+            if unknown or not site["routes"]:
+                raise ValueError(f"{name}: unknown or missing routes {unknown}")
+
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.probe_every = probe_every
+        # a failover needs at least this much of the caller's timeout left
+        self.min_timeout = min_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._health = {name: _RouteHealth() for name in self.routes}
+        self._latency: Dict[str, Dict[str, float]] = {}
+        self._last_used: Dict[Tuple[str, str], float] = {}
+        self._site_calls: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, llm_call_function: Callable, **kwargs) -> "ModelRouter":
+        """Routes from the JSON file named by BEANSTALK_ROUTES, else DEFAULT_CONFIG"""
+        path = os.getenv("BEANSTALK_ROUTES")
+        config = None
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        return cls(llm_call_function, config, **kwargs)
+
+    def _site(self, site: str) -> Dict:
+        return self.sites.get(site, self.default)
+
+    def plan(self, site: str) -> List[Tuple[str, str]]:
+        """Routes to try for one call at site, in order, each with the reason it was picked"""
+        config = self._site(site)
+        names = config["routes"]
+        now = self.clock()
+        with self._lock:
+            healthy = [name for name in names if self._health[name].open_until <= now]
+            if not healthy:
+                reopens = min(self._health[name].open_until for name in names) - now
+                raise RoutesOpen(f"No healthy route for {site}; the first reopens in {reopens:.0f}s")
+
+            if config.get("policy", "ordered") == "ordered":
+                return [(healthy[0], "preferred")] + [(name, "failover") for name in healthy[1:]]
+
+            latency = self._latency.get(site, {})
+            calls = self._site_calls[site] = self._site_calls.get(site, 0) + 1
+            unknown = [name for name in healthy if name not in latency]
+            ranked = sorted((name for name in healthy if name in latency), key=latency.get)
+            if unknown:
+                first, reason = unknown[0], "probe"
+            elif len(ranked) > 1 and calls % self.probe_every == 0:
+                first = min(ranked, key=lambda name: self._last_used.get((site, name), 0.0))
+                reason = "probe"
+            else:
+                first, reason = ranked[0], "fastest"
+        return [(first, reason)] + [(name, "failover") for name in ranked + unknown if name != first]
+
+    def _record(self, site: str, name: str, seconds: float, ok: bool):
+        now = self.clock()
+        with self._lock:
+            health = self._health[name]
+            health.calls += 1
+            health.errors += not ok
+            health.error_rate += self.alpha * ((not ok) - health.error_rate)
+            if health.error_rate >= self.error_threshold:
+                health.open_until = now + self.cooldown
+            self._last_used[(site, name)] = now
+            if ok:
+                latency = self._latency.setdefault(site, {})
+                previous = latency.get(name)
+                latency[name] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+                metrics.ROUTE_LATENCY.labels(site=site, route=name).set(latency[name])
+            metrics.ROUTE_OPEN.labels(route=name).set(1 if health.open_until > now else 0)
+        metrics.ROUTE_CALLS.labels(route=name, outcome="ok" if ok else "error").inc()
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        from utils.budget import BudgetExhausted
+
+        site = metrics.current_site()
+        timeout = kwargs.get("timeout")
+        deadline = self.clock() + timeout if timeout else None
+        last_error = None
+
+        for attempt, (name, reason) in enumerate(self.plan(site)):
+            if attempt and deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining < self.min_timeout:
+                    break
+                kwargs["timeout"] = remaining
+            metrics.ROUTE_DECISIONS.labels(site=site, route=name, reason=reason).inc()
+
+            route = {key: value for key, value in self.routes[name].items() if key in ("model", "endpoint")}
+            started = self.clock()
+            try:
+                response = self.call_model(prompt, max_tokens=max_tokens, temperature=temperature, **route, **kwargs)
+            except BudgetExhausted:
+                raise
+            except Exception as e:
+                self._record(site, name, self.clock() - started, ok=False)
+                last_error = e
+                continue
+            self._record(site, name, self.clock() - started, ok=True)
+            return response
+
+        raise last_error
+
+    def stats(self) -> Dict:
+        """Per route: calls, errors, error rate and whether it's open; per site: learned latencies"""
+        now = self.clock()
+        with self._lock:
+            return {
+                "routes": {
+                    name: {
+                        "model": self.routes[name].get("model"),
+                        "calls": health.calls,
+                        "errors": health.errors,
+                        "error_rate": round(health.error_rate, 3),
+                        "open": health.open_until > now,
+                    }
+                    for name, health in self._health.items()
+                },
+                "latency": {
+                    site: {name: round(seconds, 3) for name, seconds in latency.items()}
+                    for site, latency in self._latency.items()
+                },
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the model routing table")
+    parser.add_argument("config", nargs="?", help="Routes JSON file (default: the built-in table)")
+    args = parser.parse_args()
+
+    config = DEFAULT_CONFIG
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    router = ModelRouter(lambda prompt, **kwargs: "", config)
+
+    print(f"{'route':<12}{'model':<24}endpoint")
+    for name, route in router.routes.items():
+        print(f"{name:<12}{route.get('model', ''):<24}{route.get('endpoint') or 'default'}")
+    print(f"\n{'call site':<42}{'policy':<10}routes")
+    for site, site_config in list(router.sites.items()) + [("(everything else)", router.default)]:
+        print(f"{site:<42}{site_config.get('policy', 'ordered'):<10}{' > '.join(site_config['routes'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from utils import metrics
+from utils.search_index import tokenize
+from utils.similarity_index import BOILERPLATE
+
+
+def normalize_elements(story_elements: str) -> str:
+    """
+    Cache key for a story request: lowercase content words, plurals folded,
+    deduplicated and sorted, so "A story about two dragons" and "dragon story
+    (two)" share an outline.
+    """
+    return " ".join(sorted(set(tokenize(story_elements)) - BOILERPLATE))
+
+
+class OutlineCache:
+    """
+    Outlines keyed by normalized story elements, least recently used evicted.
+    Persisted as an append-only JSON lines file that is rewritten once it holds
+    twice as many lines as live entries.
+    """
+
+    def __init__(self, path: str = "outline_cache.jsonl", max_entries: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0}
+        self._lines = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line
+                self._lines += 1
+                self.entries.pop(item["key"], None)
+                self.entries[item["key"]] = item["outline"]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self.entries)
+
+    def get(self, story_elements: str) -> Optional[Dict]:
+        key = normalize_elements(story_elements)
+        with self._lock:
+            self._load()
+            outline = self.entries.get(key) if key else None
+            if outline is None:
+                self.stats["misses"] += 1
+                metrics.OUTLINE_CACHE_LOOKUPS.labels(result="miss").inc()
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            metrics.OUTLINE_CACHE_LOOKUPS.labels(result="hit").inc()
+            return dict(outline)
+
+    def put(self, story_elements: str, outline: Dict):
+        key = normalize_elements(story_elements)
+        if not key or not outline.get("outline"):
+            return
+        with self._lock:
+            self._load()
+            self.entries.pop(key, None)
+            self.entries[key] = outline
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.stats["stored"] += 1
+
+            if self._lines >= 2 * self.max_entries:
+                self._rewrite()
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "outline": outline}, ensure_ascii=False) + "\n")
+                self._lines += 1
+
+    def _rewrite(self):
+        temp_file = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            for key, outline in self.entries.items():
+                f.write(json.dumps({"key": key, "outline": outline}, ensure_ascii=False) + "\n")
+        os.replace(temp_file, self.path)
+        self._lines = len(self.entries)
@@ -0,0 +1,298 @@
+"""
+Opt-in CPU and memory profiling for pipeline stages.
+
+Turn it on with BEANSTALK_PROFILE, or --profile on main.py and the batch
+CLIs, set to the fraction of stages to profile: 1 profiles every stage, 0.02
+one in fifty, which keeps the overhead negligible in production. Each
+profiled stage writes, under profiles/<session id>/:
+
+    <stage>-<n>.folded        sampled stacks of every thread (flamegraph.pl, speedscope)
+    <stage>-<n>.pstats        cProfile of the thread that ran the stage
+    <stage>-<n>.tracemalloc   tracemalloc snapshot at the end of the stage (mode full)
+    stages.jsonl              one line per stage: wall, CPU and waiting time (and peak memory)
+
+CPU time is the whole process's, so wall minus CPU is time spent waiting on
+the model. The stack samples show where: threads blocked in a socket read are
+waiting upstream, threads in _clean_json or the report builder are not.
+
+BEANSTALK_PROFILE_MODE picks what is collected: "sample" (stack samples
+only), "cpu" (plus cProfile; the default) or "full" (plus tracemalloc).
+Sampling and cProfile cost little on this code, most of which runs in C
+(json, regex); tracemalloc slows allocation-heavy stages 3-8x, so leave
+"full" for hunting memory growth.
+
+A daemon session (utils/daemon.py) started with --profile gets its own
+profiler for the stages it runs; see using().
+
+Usage:
+    BEANSTALK_PROFILE=1 python main.py
+    python main.py --profile 0.1
+    python -m utils.profiling profiles/<session id> [--stage create_story.generate] [--top 20]
+"""
+
+import argparse
+import functools
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List
+
+# cProfile, pstats and tracemalloc are imported when a stage is first profiled;
+# main.py imports this module at startup
+MODES = ("sample", "cpu", "full")
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 4
+
+
+class StackSampler:
+    """Background thread that counts the call stacks of every other thread, in folded form"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name.replace(" ", "_") for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Profiles a sampled fraction of stages. One stage is profiled at a time;
+    stages entered while another is being profiled (nested or on other
+    threads) run unprofiled.
+    """
+
+    def __init__(self, rate: float = 0.0, mode: str = "cpu", directory: str = "profiles", session_id: str = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode} (expected one of {', '.join(MODES)})")
+        self.rate = rate
+        self.mode = mode
+        self.directory = directory
+        self.session_id = session_id or f"{datetime.now():%Y%m%d-%H%M%S}-{os.urandom(3).hex()}"
+        self.session_dir = os.path.join(directory, self.session_id)
+        self._runs = Counter()
+        self._active = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Profiler":
+        return cls(
+            rate=float(os.getenv("BEANSTALK_PROFILE", "0") or 0),
+            mode=os.getenv("BEANSTALK_PROFILE_MODE", "cpu"),
+            directory=os.getenv("BEANSTALK_PROFILE_DIR", "profiles"),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    @contextmanager
+    def stage(self, name: str):
+        """Profile the block if this stage is sampled"""
+        if self.rate <= 0 or random.random() >= self.rate or not self._active.acquire(blocking=False):
+            yield
+            return
+        try:
+            with self._profile(name):
+                yield
+        finally:
+            self._active.release()
+
+    @contextmanager
+    def _profile(self, name: str):
+        import cProfile
+        import tracemalloc
+
+        self._runs[name] += 1
+        tag = f"{name}-{self._runs[name]}"
+        sampler = StackSampler()
+        profile = cProfile.Profile() if self.mode != "sample" else None
+        started_tracing = self.mode == "full" and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if self.mode == "full":
+            tracemalloc.reset_peak()
+
+        record = {"session": self.session_id, "stage": name, "run": self._runs[name],
+                  "started": datetime.now().isoformat(), "error": None}
+        sampler.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            if profile:
+                profile.disable()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            sampler.stop()
+            record.update({
+                "wall": round(wall, 4),
+                "cpu": round(cpu, 4),
+                "wait": round(max(0.0, wall - cpu), 4),
+                "samples": sampler.samples,
+            })
+            try:
+                self._write(tag, record, sampler, profile)
+            except OSError as e:
+                print(f"Could not write profile for {tag}: {e}")
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def _write(self, tag: str, record: Dict, sampler: StackSampler, profile):
+        import tracemalloc
+
+        os.makedirs(self.session_dir, exist_ok=True)
+        base = os.path.join(self.session_dir, tag)
+        sampler.write(base + ".folded")
+        record["files"] = [tag + ".folded"]
+        if profile:
+            profile.dump_stats(base + ".pstats")
+            record["files"].append(tag + ".pstats")
+        if self.mode == "full":
+            record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.take_snapshot().dump(base + ".tracemalloc")
+            record["files"].append(tag + ".tracemalloc")
+        with open(os.path.join(self.session_dir, "stages.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+_profiler = None
+# set by using(); threads started with contextvars.copy_context() share it
+_context_profiler: ContextVar = ContextVar("beanstalk_profiler", default=None)
+
+
+def get_profiler() -> Profiler:
+    """The profiler set by using(), else the process-wide one, configured from the environment on first use"""
+    global _profiler
+    profiler = _context_profiler.get()
+    if profiler is not None:
+        return profiler
+    if _profiler is None:
+        _profiler = Profiler.from_env()
+    return _profiler
+
+
+def new_profiler(rate: float = 1.0, mode: str = None, directory: str = None) -> Profiler:
+    """A profiler for CLI flags; unset options come from the environment"""
+    defaults = Profiler.from_env()
+    return Profiler(rate, mode or defaults.mode, directory or defaults.directory)
+
+
+def configure(rate: float = 1.0, mode: str = None, directory: str = None) -> Profiler:
+    """Replace the process-wide profiler (CLI flags); unset options come from the environment"""
+    global _profiler
+    _profiler = new_profiler(rate, mode, directory)
+    return _profiler
+
+
+@contextmanager
+def using(profiler: Profiler):
+    """Profile the stages run in this block with profiler instead of the process-wide one"""
+    token = _context_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _context_profiler.reset(token)
+
+
+def stage(name: str):
+    """Context manager profiling the block as this stage, when profiling is on and it is sampled"""
+    return get_profiler().stage(name)
+
+
+def profiled(name: str) -> Callable:
+    """Decorator form of stage()"""
+    def decorate(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add_profile_argument(parser: argparse.ArgumentParser):
+    parser.add_argument("--profile", type=float, nargs="?", const=1.0, metavar="RATE",
+                        help="Profile this fraction of stages (default 1) into profiles/; see utils/profiling.py")
+
+
+def load_stages(session_dir: str) -> List[Dict]:
+    with open(os.path.join(session_dir, "stages.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a profiling session")
+    parser.add_argument("session", help="Session directory, e.g. profiles/20250804-163138-ab12cd")
+    parser.add_argument("--stage", help="Show the cProfile functions for this stage, all runs merged")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'stage':<28}{'runs':>6}{'wall s':>10}{'cpu s':>10}{'wait s':>10}{'peak MB':>10}")
+    totals: Dict[str, Dict] = {}
+    for record in load_stages(args.session):
+        total = totals.setdefault(record["stage"], {"runs": 0, "wall": 0.0, "cpu": 0.0, "wait": 0.0, "peak": None})
+        total["runs"] += 1
+        for key in ("wall", "cpu", "wait"):
+            total[key] += record[key]
+        if "peak_memory" in record:
+            total["peak"] = max(total["peak"] or 0, record["peak_memory"])
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["wall"]):
+        # peak memory is only measured in mode full
+        peak = f"{total['peak'] / 1e6:.1f}" if total["peak"] is not None else "-"
+        print(f"{name:<28}{total['runs']:>6}{total['wall']:>10.2f}{total['cpu']:>10.2f}{total['wait']:>10.2f}{peak:>10}")
+
+    if args.stage:
+        files = sorted(glob.glob(os.path.join(args.session, f"{glob.escape(args.stage)}-*.pstats")))
+        if not files:
+            print(f"\nNo cProfile output for {args.stage}")
+            return
+        import pstats
+
+        print()
+        pstats.Stats(*files).sort_stats("cumulative").print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
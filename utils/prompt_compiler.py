@@ -0,0 +1,188 @@
+"""
+Prompt templates with a static prefix and a dynamic suffix.
+
+Every prompt in utils/prompts.py is a PromptTemplate: its instructions, rubric
+and reply format come first and never change, and the story, request or
+question goes last. Two calls from the same template then share their whole
+prefix, which is what provider-side prompt caching matches on: OpenAI and
+Anthropic bill a cached prefix at a fraction of the price and start answering
+sooner, but only from min_tokens (1024 for both) and only while the prefix
+was used in the last few minutes. Self-hosted servers (vLLM, llama.cpp) cache
+much shorter prefixes; set BEANSTALK_PREFIX_CACHE_MIN_TOKENS to match.
+
+Token counts come from tiktoken (cl100k_base) when it's installed and
+utils.budget.estimate_tokens otherwise. A template's prefix is counted once;
+only the suffix is counted per call.
+
+Rendered prompts are CompiledPrompt strings that remember their template.
+InstrumentedCall hands them to account(), which adds the prefix and suffix
+tokens to beanstalk_prompt_tokens_total by call site and counts each call in
+beanstalk_prompt_prefix_total as a hit (same prefix within the cache TTL), a
+miss or short (prefix below min_tokens).
+
+Usage:
+    python -m utils.prompt_compiler                              # prefix tokens per template
+    python -m utils.prompt_compiler tests/cassettes/*.jsonl.gz   # tokens per call site over recordings
+"""
+
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from utils import metrics
+from utils.budget import estimate_tokens
+
+_encoding = None
+_lock = threading.Lock()
+_last_used: Dict[str, float] = {}
+
+# every template, by name, for reports and for recognising recorded prompts
+TEMPLATES: Dict[str, "PromptTemplate"] = {}
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in text with the local tokenizer (tiktoken when installed, else ~4 characters a token)"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if not _encoding:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def tokenizer_name() -> str:
+    count_tokens("")
+    return "tiktoken cl100k_base" if _encoding else "estimate (~4 characters a token)"
+
+
+class CompiledPrompt(str):
+    """A rendered prompt; still a plain str to everything downstream"""
+
+    template: "PromptTemplate"
+
+
+class PromptTemplate:
+    """
+    prefix is sent as is; suffix is a str.format template for the per-call
+    fields. site names the agent method that sends it, for reports.
+    """
+
+    def __init__(self, name: str, prefix: str, suffix: str, site: str = ""):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+        self.site = site
+        self._prefix_tokens = None
+        TEMPLATES[name] = self
+
+    @property
+    def prefix_tokens(self) -> int:
+        if self._prefix_tokens is None:
+            self._prefix_tokens = count_tokens(self.prefix)
+        return self._prefix_tokens
+
+    def render(self, **fields) -> CompiledPrompt:
+        prompt = CompiledPrompt(self.prefix + self.suffix.format(**fields))
+        prompt.template = self
+        return prompt
+
+    def suffix_tokens(self, prompt: str) -> int:
+        return count_tokens(prompt[len(self.prefix):])
+
+
+def cache_settings() -> Dict:
+    """Provider prompt cache limits from the environment: smallest cached prefix and idle TTL"""
+    return {
+        "min_tokens": int(os.getenv("BEANSTALK_PREFIX_CACHE_MIN_TOKENS", "1024")),
+        "ttl": float(os.getenv("BEANSTALK_PREFIX_CACHE_TTL", "300")),
+    }
+
+
+def account(prompt: str, site: str):
+    """Record a prompt about to be sent from site: its tokens by part and whether its prefix is cached"""
+    template: Optional[PromptTemplate] = getattr(prompt, "template", None)
+    if template is None:
+        metrics.PROMPT_TOKENS.labels(site=site, part="unstructured").inc(count_tokens(prompt))
+        return
+
+    settings = cache_settings()
+    metrics.PROMPT_TOKENS.labels(site=site, part="prefix").inc(template.prefix_tokens)
+    metrics.PROMPT_TOKENS.labels(site=site, part="suffix").inc(template.suffix_tokens(prompt))
+    if template.prefix_tokens < settings["min_tokens"]:
+        result = "short"
+    else:
+        now = time.monotonic()
+        with _lock:
+            last = _last_used.get(template.name)
+            _last_used[template.name] = now
+        result = "hit" if last is not None and now - last <= settings["ttl"] else "miss"
+    metrics.PROMPT_PREFIX.labels(template=template.name, result=result).inc()
+
+
+def template_of(prompt: str) -> Optional[PromptTemplate]:
+    """The template a (recorded, plain str) prompt was rendered from"""
+    template = getattr(prompt, "template", None)
+    if template is not None:
+        return template
+    matches = [t for t in TEMPLATES.values() if prompt.startswith(t.prefix)]
+    return max(matches, key=lambda t: len(t.prefix), default=None)
+
+
+def site_report(prompts: List[Dict]) -> Dict[str, Dict]:
+    """Calls and tokens per call site for recorded {"prompt", "response"} entries"""
+    report = defaultdict(lambda: {"calls": 0, "prefix": 0, "suffix": 0, "response": 0})
+    for entry in prompts:
+        template = template_of(entry["prompt"])
+        row = report[template.site if template else "(unstructured)"]
+        row["calls"] += 1
+        if template:
+            row["prefix"] += template.prefix_tokens
+            row["suffix"] += template.suffix_tokens(entry["prompt"])
+        else:
+            row["suffix"] += count_tokens(entry["prompt"])
+        row["response"] += count_tokens(entry.get("response") or "")
+    return dict(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt token accounting")
+    parser.add_argument("cassettes", nargs="*", help="Cassette files (.jsonl.gz) to report tokens per call site for")
+    args = parser.parse_args()
+
+    # the templates register with utils.prompt_compiler as utils.prompts imports it, not with __main__
+    import utils.prompts  # noqa: F401
+    from utils.prompt_compiler import TEMPLATES, site_report
+
+    settings = cache_settings()
+    print(f"Tokenizer: {tokenizer_name()} | provider caching from {settings['min_tokens']} prefix tokens\n")
+    if not args.cassettes:
+        print(f"{'template':<22}{'call site':<42}{'prefix tokens':>14}  cacheable")
+        for template in TEMPLATES.values():
+            cacheable = "yes" if template.prefix_tokens >= settings["min_tokens"] else "no"
+            print(f"{template.name:<22}{template.site:<42}{template.prefix_tokens:>14}  {cacheable}")
+        return
+
+    entries = []
+    for path in args.cassettes:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    report = site_report(entries)
+    print(f"{'call site':<42}{'calls':>6}{'prefix':>9}{'suffix':>9}{'static %':>10}{'response':>10}")
+    for site, row in sorted(report.items(), key=lambda item: -(item[1]["prefix"] + item[1]["suffix"])):
+        prompt_tokens = row["prefix"] + row["suffix"]
+        static = round(100 * row["prefix"] / prompt_tokens, 1) if prompt_tokens else 0.0
+        print(f"{site:<42}{row['calls']:>6}{row['prefix']:>9,}{row['suffix']:>9,}{static:>10}{row['response']:>10,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,28 @@
 """
 Central repository for all LLM prompts used in Beanstalk AI.
 This will evolve as we build more agents.
+
+Each prompt is a PromptTemplate (utils/prompt_compiler.py): the instructions,
+rubric and reply format are a static prefix, and the request, story or
+question is appended after them, so every call from one template starts with
+the same text and providers can serve that part from their prompt cache.
+Keep new prompts in that shape - anything that varies goes in the suffix.
 """
 
-from typing import Dict
+from typing import Dict, List
+
+from utils.prompt_compiler import PromptTemplate
 
 
 class InputValidationPrompts:
     """Prompts for input validation and processing"""
 
-    @staticmethod
-    def validation_prompt(user_input: str) -> str:
-        return f"""
+    VALIDATION = PromptTemplate(
+        "validation",
+        """
 You are an intelligent input processor for a bedtime story generator for kids aged 5-10.
 
-Analyze this user input: "{user_input}"
-
-Determine if this is a meaningful story request by considering:
+You will be given a user input at the end. Determine if it is a meaningful story request by considering:
 - Does it contain story elements (characters, settings, actions, themes)?
 - Is it coherent enough to build a bedtime story around?
 - Could this realistically come from someone wanting a story?
@@ -33,29 +39,35 @@ If VALID: Extract and enhance the core story elements into a clear story request
 If INVALID: Provide a gentle, encouraging re-prompt with a specific example.
 
 Respond ONLY with valid JSON:
-{{
+{
     "valid": true/false,
     "story_elements": "enhanced story request (empty if invalid)",
     "suggestion": "encouraging re-prompt with example (empty if valid)"
-}}
+}
 
 Examples:
-Input: "sdfdfgg" → {{"valid": false, "story_elements": "", "suggestion": "I didn't quite catch that! Try something like: 'A story about a friendly robot who learns to paint'"}}
-Input: "dragon" → {{"valid": true, "story_elements": "A story about a dragon", "suggestion": ""}}
-Input: "my cat died" → {{"valid": false, "story_elements": "", "suggestion": "Let's create something happy for bedtime! How about: 'A story about a cat who goes on a magical adventure'?"}}
+Input: "sdfdfgg" → {"valid": false, "story_elements": "", "suggestion": "I didn't quite catch that! Try something like: 'A story about a friendly robot who learns to paint'"}
+Input: "dragon" → {"valid": true, "story_elements": "A story about a dragon", "suggestion": ""}
+Input: "my cat died" → {"valid": false, "story_elements": "", "suggestion": "Let's create something happy for bedtime! How about: 'A story about a cat who goes on a magical adventure'?"}
 
-Now analyze: "{user_input}"
-"""
+""",
+        'Analyze this user input: "{user_input}"\n',
+        site="InputHandler.process_input",
+    )
+
+    @staticmethod
+    def validation_prompt(user_input: str) -> str:
+        return InputValidationPrompts.VALIDATION.render(user_input=user_input)
 
 
 class StoryGenerationPrompts:
     """Prompts for two-phase story generation"""
 
-    @staticmethod
-    def generate_outline_prompt(story_request: str) -> str:
-        return f"""You are an expert at creating imaginative outlines for children stories.
-You are an imaginative story writer who has written 100s of popular stories that children aged 5-10 love reading at bedtime. 
-You are given this - {story_request}. You need to generate an outline.
+    OUTLINE = PromptTemplate(
+        "outline",
+        """You are an expert at creating imaginative outlines for children stories.
+You are an imaginative story writer who has written 100s of popular stories that children aged 5-10 love reading at bedtime.
+The story request you are given is at the end.
 
 STEP 1
 - Come up with a overall theme/arc that aligns with the request (example - friendship, adventure, mystery etc)
@@ -65,16 +77,20 @@ STEP 1
 STEP 2
 - Now based on the theme and characters, think about what would make an engaging bedtime story and provide an outline in terms - opening, key events, closing, climax etc. (focus on bedtime and appropriateness for ages 5-10). The outline should have a major plot, key events
 - Imagine you are providing this outline to your writer and give instruction on how to create a beautiful 500 word story from the outline. Give clear instruction around how make the story engaging, visual, detailed, while suitable for bedtime
-- Make sure to provide instruction to make the story very vivid and descriptive and to write dialogues. 
+- Make sure to provide instruction to make the story very vivid and descriptive and to write dialogues.
 Respond in JSON:
-{{"outline": "outline that you have come up with", "characters":"characters you think are relevant and their traits", "instruction":"instructions to your writer on how to develop that outline into a great story"}}"""
+{"outline": "outline that you have come up with", "characters":"characters you think are relevant and their traits", "instruction":"instructions to your writer on how to develop that outline into a great story"}
 
-    @staticmethod
-    def write_story_from_outline_prompt(outline: Dict) -> str:
-        return f"""You are an expert at writing bedtime stories for children once given an outline
+""",
+        "You are given this - {story_request}. You need to generate an outline.",
+        site="StoryGenerator.get_outline",
+    )
+
+    WRITE_STORY = PromptTemplate(
+        "write_story",
+        """You are an expert at writing bedtime stories for children once given an outline
 
-Your boss has given you a story outline and some instruction into how you can develop that into a full bedtime story for kids aged 5-10.
-Outline - {outline.get('outline', '')}, Characters - {outline.get('characters', '')}, Instructions - {outline.get('instruction', '')}
+Your boss has given you a story outline and some instruction into how you can develop that into a full bedtime story for kids aged 5-10. They are at the end.
 
 Based on the outline, characters and traits - follow the instructions and develop the outline into a full-fledged bedtime story for kids with atleast 500 words.
 
@@ -89,44 +105,93 @@ Once you have developed an initial story, take another look at it and ensure it
 Ensure there are atleast 3-4 dialogues.
 
 Once you're satisfied, respond in JSON:
-{{"title":"an apt title for the story", "story":"the full story (with dialogues) with atleast 500 words", "moral":"moral of the story"}}"""
+{"title":"an apt title for the story", "story":"the full story (with dialogues) with atleast 500 words", "moral":"moral of the story"}
+
+""",
+        "Outline - {outline}, Characters - {characters}, Instructions - {instruction}{telling}",
+        site="StoryGenerator.write_story",
+    )
+
+    REFINE = PromptTemplate(
+        "refine",
+        """You are a children's story editor and an expert at taking a story and refining it.
+You are given a story at the end, and a minor suggestion a critic made after reading it.
+
+This original story is already good. You just need to address that minor suggestion. Implement the suggestion without changing too much. The end result should not be very different from the input story.
+Ensure it is 500 words.
+Ensure there are atleast 3-4 dialogues.
+Think twice about if you have enhanced it or made it worse. Always make it better!
+Keep the title and moral exactly as they are.
+Respond in JSON -
+{"title": "the story's title", "story":"the full refined story (with dialogues) with atleast 500 words", "moral": "the story's moral"}
+
+""",
+        "Title - {title}\nMoral - {moral}\nThe critic's suggestion - {improvement_suggestion}\nThe story - {story}",
+        site="StoryGenerator.refine_story",
+    )
+
+    PATCH = PromptTemplate(
+        "patch",
+        """You are a children's story editor and an expert at making small, targeted improvements to a story.
+A critic has read the story at the end and made a minor suggestion.
+
+The story is already good. Address the suggestion by editing only the paragraphs that need it. Do NOT rewrite the whole story.
+The story's paragraphs are numbered.
+
+Allowed edits:
+- "replace": rewrite paragraph N (give the full new paragraph text)
+- "insert_after": add a new paragraph after paragraph N (use 0 to insert at the very start)
+- "delete": remove paragraph N (no text needed)
+
+Keep the story at least as long as it is now and keep its dialogues. Use as few edits as possible (usually 1-3).
+Respond in JSON -
+{"edits": [{"paragraph": 2, "action": "replace", "text": "the new paragraph"}]}
+
+""",
+        "The critic's suggestion - {improvement_suggestion}\n\n{numbered}",
+        site="StoryGenerator.refine_story",
+    )
+
+    @staticmethod
+    def generate_outline_prompt(story_request: str) -> str:
+        return StoryGenerationPrompts.OUTLINE.render(story_request=story_request)
+
+    @staticmethod
+    def write_story_from_outline_prompt(outline: Dict, variation: str = "") -> str:
+        return StoryGenerationPrompts.WRITE_STORY.render(
+            outline=outline.get("outline", ""),
+            characters=outline.get("characters", ""),
+            instruction=outline.get("instruction", ""),
+            telling=f"\nFor this telling - {variation}" if variation else "",
+        )
 
     @staticmethod
     def story_refinement_prompt(
         original_story: Dict, improvement_suggestion: str
     ) -> str:
-        return f"""You are a children's story editor and an expert at taking a story and refining it. 
-        You are given this {original_story['story']}. A critic has read it and made a minor suggestion - {improvement_suggestion}.
-        
-        This original story is already good. You just need to address that minor suggestion. Implement the suggestion without changing too much. The end result should not be very different from the input story.
-        Ensure it is 500 words. 
-        Ensure there are atleast 3-4 dialogues.
-        Think twice about if you have enhanced it or made it worse. Always make it better! 
-        Respond in JSON -
-        {{"title": "{original_story['title']}", "story":"the full refined story (with dialogues) with atleast 500 words", "moral": "{original_story['moral']}"}}"""
-
-
-class JudgePrompts:
-    """Streamlined prompts for bedtime story evaluation"""
+        return StoryGenerationPrompts.REFINE.render(
+            title=original_story["title"],
+            moral=original_story["moral"],
+            improvement_suggestion=improvement_suggestion,
+            story=original_story["story"],
+        )
 
     @staticmethod
-    def unified_evaluation_prompt(story: Dict) -> str:
-        """Single prompt that handles both safety and quality evaluation"""
-        return f"""You are an expert evaluator of bedtime stories for children ages 5-10.
+    def story_patch_prompt(original_story: Dict, improvement_suggestion: str) -> str:
+        paragraphs = [p.strip() for p in original_story["story"].split("\n\n") if p.strip()]
+        numbered = "\n\n".join(f"[{i}] {p}" for i, p in enumerate(paragraphs, 1))
+        return StoryGenerationPrompts.PATCH.render(improvement_suggestion=improvement_suggestion, numbered=numbered)
 
-Evaluate this story:
-Title: {story['title']}
-Story: {story['story']}
-Moral: {story['moral']}
 
-Step 1: Check for unsafe content:
+# Steps 1-4 of the judge's rubric, shared by the single, combined and multi-story prompts
+_SAFETY_AND_SCORES = """Step 1: Check for unsafe content:
 - Scary things (monsters, darkness, threats)
 - Violence or danger
 - Unresolved problems
 - Parent separation
 - Incomplete story
 
-If unsafe, return: {{"pass": false, "reason": "[what makes it unsafe]", "scores": null}}
+If unsafe, {unsafe}
 
 Step 2: Score these (1-10 each, can have decimals too like 7.5 or 8.2):
 - bedtime_readiness: How calming? (8-10=very calming, 5-7=somewhat calm, 1-4=exciting)
@@ -141,22 +206,99 @@ Look at your scores. Is any score less than 5?
 
 Step 4: Provide improvement suggestion
 Write 1-2 specific, actionable sentences on how to improve the story. Focus on the lowest scoring dimension.
+"""
 
-Return JSON:
-{{
-  "pass": [true if all scores >= 5, false if any score < 5],
-  "scores": {{
+_EVALUATION_FIELDS = '''"pass": [true if all scores >= 5, false if any score < 5],
+  "scores": {
     "bedtime_readiness": [number],
     "creative_spark": [number],
     "story_quality": [number],
     "age_readability": [number]
-  }},
+  },
   "overall": [average of 4 scores],
   "feedback": "[one sentence summary]",
-  "improvement": "[1 tangible instructions to the story-writer on what to improve to bump up on what is lacking in the scores]"
-}}
+  "improvement": "[1 tangible instructions to the story-writer on what to improve to bump up on what is lacking in the scores]"'''
+
+_GENERIC_RULE = "Generic princess/fairy/unicorn stories get creative_spark = 3 or less."
+
+_STORY = "Title: {title}\nStory: {story}\nMoral: {moral}\n"
 
-Generic princess/fairy/unicorn stories get creative_spark = 3 or less."""
+
+class JudgePrompts:
+    """Streamlined prompts for bedtime story evaluation"""
+
+    EVALUATION = PromptTemplate(
+        "judge",
+        "You are an expert evaluator of bedtime stories for children ages 5-10.\n\n"
+        + _SAFETY_AND_SCORES.replace(
+            "{unsafe}", 'return: {"pass": false, "reason": "[what makes it unsafe]", "scores": null}'
+        )
+        + "\nReturn JSON:\n{\n  " + _EVALUATION_FIELDS + "\n}\n\n"
+        + _GENERIC_RULE + "\n\nEvaluate this story:\n",
+        _STORY,
+        site="JudgeSystem.evaluate_story",
+    )
+
+    EVALUATION_WITH_QUESTIONS = PromptTemplate(
+        "judge_questions",
+        "You are an expert evaluator of bedtime stories for children ages 5-10.\n\n"
+        + _SAFETY_AND_SCORES.replace(
+            "{unsafe}",
+            'return: {"pass": false, "reason": "[what makes it unsafe]", "scores": null, "questions": []}',
+        )
+        + """
+Step 5: Questions for the child (only if pass = true)
+Now imagine you are the 5-10 year old child who just heard this story and is full of curiosity.
+Write the 3 most obvious follow-up questions they would ask: two about what happened in the story,
+one more general question that the story makes them wonder about. Use a child's words. If pass = false, leave the list empty.
+"""
+        + "\nReturn JSON:\n{\n  " + _EVALUATION_FIELDS + ',\n  "questions": ["first question", "second question", "third question"]\n}\n\n'
+        + _GENERIC_RULE + "\n\nEvaluate this story:\n",
+        _STORY,
+        site="JudgeSystem.evaluate_story",
+    )
+
+    MULTI_STORY_EVALUATION = PromptTemplate(
+        "judge_many",
+        "You are an expert evaluator of bedtime stories for children ages 5-10.\n\n"
+        "Evaluate each story below on its own. Do not compare the stories with each other.\n\n"
+        "For each story:\n\n"
+        + _SAFETY_AND_SCORES.replace(
+            "{unsafe}", 'its entry is: {"id": [story id], "pass": false, "reason": "[what makes it unsafe]", "scores": null}'
+        )
+        + "\nReturn JSON with one entry per story, in story order, each with its story id:\n"
+        + '{\n  "evaluations": [\n    {\n      "id": [story id],\n      '
+        + _EVALUATION_FIELDS.replace("\n", "\n    ")
+        + "\n    }\n  ]\n}\n\n"
+        + _GENERIC_RULE + "\n\n",
+        "{tagged}",
+        site="JudgeSystem.evaluate_stories",
+    )
+
+    @staticmethod
+    def unified_evaluation_prompt(story: Dict) -> str:
+        """Single prompt that handles both safety and quality evaluation"""
+        return JudgePrompts.EVALUATION.render(title=story["title"], story=story["story"], moral=story["moral"])
+
+    @staticmethod
+    def evaluation_with_questions_prompt(story: Dict) -> str:
+        """unified_evaluation_prompt plus the child's follow-up questions, saving a second call that resends the story"""
+        return JudgePrompts.EVALUATION_WITH_QUESTIONS.render(
+            title=story["title"], story=story["story"], moral=story["moral"]
+        )
+
+    @staticmethod
+    def tagged_story(story_id: int, story: Dict) -> str:
+        """One story in a multi-story prompt, tagged with the id its result comes back under"""
+        return f"=== Story {story_id} ===\n" + _STORY.format(
+            title=story["title"], story=story["story"], moral=story["moral"]
+        )
+
+    @staticmethod
+    def multi_story_evaluation_prompt(stories: List[Dict]) -> str:
+        """unified_evaluation_prompt for several stories at once; the rubric is sent once for all of them"""
+        tagged = "\n".join(JudgePrompts.tagged_story(i, story) for i, story in enumerate(stories, 1))
+        return JudgePrompts.MULTI_STORY_EVALUATION.render(tagged=tagged)
 
     @staticmethod
     def safety_evaluation_prompt(story: Dict) -> str:  # old
@@ -290,43 +432,56 @@ Provide 2-4 specific, actionable instructions focusing on the lowest-scoring dim
 class QAPrompts:
     """Prompts for Q&A system after story completion"""
 
-    @staticmethod
-    def generate_questions_prompt(story: Dict) -> str:
-        return f"""
-        You are a 5-10 year old child who is an active listener of stories
+    QUESTIONS = PromptTemplate(
+        "questions",
+        """
+You are a 5-10 year old child who is an active listener of stories
 
-        Your parents just read you this {story['story']}
+Your parents just read you the story at the end.
 
-Your 5-10 year old brain is now curious. You have so many follow up questions from the story. 
-What are some most obvious questions you have from the story or any general questions related to what happened in the story? 
+Your 5-10 year old brain is now curious. You have so many follow up questions from the story.
+What are some most obvious questions you have from the story or any general questions related to what happened in the story?
 
 Respond ONLY with valid JSON:
-{{
+{
     "questions": [
         "first question",
-        "second question not directly related to a story", 
+        "second question not directly related to a story",
         "third question"
     ]
-}}
-"""
+}
 
-    @staticmethod
-    def answer_question_prompt(question: str, story: Dict) -> str:
-        return f"""
-You are a parent answering a question to your child after you've read them a bedtime story.
+""",
+        "The story - {story}\n",
+        site="QAAgent.generate_question_opportunities",
+    )
 
-You just read this story to your child - {story['story']}
-And now your 5-10 year child has some follow up questions.
+    ANSWER = PromptTemplate(
+        "answer",
+        """
+You are a parent answering a question to your child after you've read them a bedtime story.
 
-They have asked you - {question}
+The story you just read to your child is at the end, followed by the follow up question your 5-10 year child has asked you.
 
-Use the story context and respond with 2-3 line answer. 
+Use the story context and respond with 2-3 line answer.
 
-Make sure you address the answer to a 5-10 child. You can use anything from the story and also invent any information (factually sound) to keep your child happy and satisfied. 
+Make sure you address the answer to a 5-10 child. You can use anything from the story and also invent any information (factually sound) to keep your child happy and satisfied.
 
-Try to turn these questions into lessons for your child. Be brief. 
+Try to turn these questions into lessons for your child. Be brief.
 
-If the questions seems completely out of story context, just say that you can only answer questions that are related to this story and don't answer that question. 
+If the questions seems completely out of story context, just say that you can only answer questions that are related to this story and don't answer that question.
 
 Respond with ONLY the answer text (no JSON, no quotes, just the answer)
-"""
+
+""",
+        "You just read this story to your child - {story}\nThey have asked you - {question}\n",
+        site="QAAgent.answer_question",
+    )
+
+    @staticmethod
+    def generate_questions_prompt(story: Dict) -> str:
+        return QAPrompts.QUESTIONS.render(story=story["story"])
+
+    @staticmethod
+    def answer_question_prompt(question: str, story: Dict) -> str:
+        return QAPrompts.ANSWER.render(story=story["story"], question=question)
@@ -0,0 +1,119 @@
+import time
+from typing import Dict, Optional
+from utils.budget import Budget, BudgetExhausted
+
+NO_IMPROVEMENT = ["story is excellent as is.", "no improvements needed.", ""]
+
+
+class RefinementLoop:
+    """
+    Keeps refining and re-judging a story until it reaches the target score,
+    quality stops improving, or the budget can't fit another round.
+    The best-scoring draft is always the one returned.
+    """
+
+    def __init__(
+        self,
+        story_generator,
+        judge_system,
+        refinement_policy=None,
+        target_score: float = 8.0,
+        min_gain: float = 0.1,
+        max_rounds: int = 3,
+    ):
+        self.story_generator = story_generator
+        self.judge_system = judge_system
+        self.refinement_policy = refinement_policy
+        self.target_score = target_score
+        self.min_gain = min_gain
+        self.max_rounds = max_rounds
+
+    def _needs_improvement(self, evaluation: Dict) -> bool:
+        improvement = evaluation.get("improvement", "") or ""
+        return improvement.lower() not in NO_IMPROVEMENT
+
+    def _fits_another_round(self, budget: Budget, round_seconds: Optional[float]) -> bool:
+        if budget.exhausted():
+            return False
+        remaining = budget.remaining()
+        # before the first round we don't know its cost, so any time left will do
+        return remaining is None or round_seconds is None or remaining >= round_seconds
+
+    def run(self, story: Dict, evaluation: Dict, budget: Optional[Budget] = None) -> Dict:
+        budget = budget or Budget()
+        best_story, best_evaluation = story, evaluation
+        word_count = len(story.get("story", "").split())
+        result = {
+            "initial_evaluation": evaluation,
+            "initial_word_count": word_count,
+            "refined_evaluation": None,
+            "rounds": 0,
+            "skipped": False,
+            "predicted_win_rate": None,
+            "stop_reason": "",
+        }
+
+        round_seconds = None
+        while True:
+            if best_evaluation.get("pass", False) and best_evaluation.get("overall", 0) >= self.target_score:
+                result["stop_reason"] = "target_reached"
+                break
+            if not self._needs_improvement(best_evaluation):
+                result["stop_reason"] = "no_improvement_suggested"
+                break
+            if result["rounds"] >= self.max_rounds:
+                result["stop_reason"] = "max_rounds"
+                break
+            if not self._fits_another_round(budget, round_seconds):
+                result["stop_reason"] = "budget_exhausted"
+                break
+
+            if result["rounds"] == 0 and self.refinement_policy is not None:
+                # skip the refine + re-judge calls when history says they rarely help
+                refine, result["predicted_win_rate"] = self.refinement_policy.should_refine(
+                    best_evaluation, word_count
+                )
+                if not refine:
+                    result["skipped"] = True
+                    result["stop_reason"] = "policy_skip"
+                    break
+
+            print("Improving story...")
+            started = time.monotonic()
+            try:
+                refined_story = self.story_generator.refine_story(
+                    best_story, best_evaluation.get("improvement", "")
+                )
+                refined_evaluation = self.judge_system.evaluate_story(refined_story)
+            except BudgetExhausted:
+                result["stop_reason"] = "budget_exhausted"
+                break
+            except Exception as e:
+                # the model is slow or failing; the best draft so far is already judged
+                from utils.story_library import failure_kind
+
+                print(f"Stopping refinement: {e}")
+                result["stop_reason"] = "model_unavailable" if failure_kind(e) != "error" else "refine_failed"
+                break
+            round_seconds = time.monotonic() - started
+
+            result["rounds"] += 1
+            result["refined_evaluation"] = refined_evaluation
+            if self.refinement_policy is not None:
+                self.refinement_policy.observe(
+                    best_evaluation.get("scores") or {},
+                    best_evaluation.get("overall", 0),
+                    len(best_story.get("story", "").split()),
+                    refined_evaluation.get("overall", 0),
+                )
+
+            gain = refined_evaluation.get("overall", 0) - best_evaluation.get("overall", 0)
+            if gain > 0:
+                best_story, best_evaluation = refined_story, refined_evaluation
+            if gain < self.min_gain:
+                result["stop_reason"] = "plateau"
+                break
+
+        result["story"] = best_story
+        result["evaluation"] = best_evaluation
+        return result
@@ -0,0 +1,76 @@
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SCORE_DIMENSIONS = ["bedtime_readiness", "creative_spark", "story_quality", "age_readability"]
+
+
+class RefinementPolicy:
+    """
+    Decides whether a refine + re-judge round is worth its two LLM calls.
+    Learns from the initial/refined scores StoryTracker records: a new story is
+    compared with its nearest past stories (initial scores and length), and
+    refinement is skipped when few of those neighbours improved.
+    """
+
+    def __init__(
+        self,
+        min_samples: int = 20,
+        neighbours: int = 15,
+        min_win_rate: float = 0.3,
+        explore_rate: float = 0.1,
+    ):
+        self.min_samples = min_samples
+        self.neighbours = neighbours
+        self.min_win_rate = min_win_rate
+        # keep refining a small share of skips so the history stays fresh
+        self.explore_rate = explore_rate
+        self.examples: List[Tuple[List[float], bool]] = []
+
+    def _features(self, scores: Dict, overall: float, word_count: int) -> List[float]:
+        features = [float(scores.get(dim, 0) or 0) for dim in SCORE_DIMENSIONS]
+        features.append(float(overall or 0))
+        # word count on roughly the same scale as the scores (100 words ~ 1 point)
+        features.append(word_count / 100.0)
+        return features
+
+    def fit(self, history: Iterable[Dict]) -> "RefinementPolicy":
+        """Load refinement outcomes from StoryTracker.refinement_history()"""
+        self.examples = []
+        for refinement in history:
+            if not refinement.get("attempted"):
+                continue
+            self.observe(
+                refinement.get("initial_scores", {}),
+                refinement.get("initial_overall", 0),
+                refinement.get("initial_word_count", 0),
+                refinement.get("refined_overall", 0),
+            )
+        return self
+
+    def observe(self, scores: Dict, overall: float, word_count: int, refined_overall: float):
+        """Add one refinement outcome"""
+        improved = (refined_overall or 0) > (overall or 0)
+        self.examples.append((self._features(scores, overall, word_count), improved))
+
+    def predict(self, evaluation: Dict, word_count: int) -> Optional[float]:
+        """Estimated chance that refinement raises the overall score (None without history)"""
+        if len(self.examples) < self.min_samples:
+            return None
+
+        target = self._features(
+            evaluation.get("scores") or {}, evaluation.get("overall", 0), word_count
+        )
+        nearest = sorted(
+            self.examples,
+            key=lambda example: sum((a - b) ** 2 for a, b in zip(example[0], target)),
+        )[: self.neighbours]
+
+        # Laplace smoothing keeps a few neighbours from producing 0% or 100%
+        wins = sum(1 for _, improved in nearest if improved)
+        return (wins + 1) / (len(nearest) + 2)
+
+    def should_refine(self, evaluation: Dict, word_count: int) -> Tuple[bool, Optional[float]]:
+        win_rate = self.predict(evaluation, word_count)
+        if win_rate is None or win_rate >= self.min_win_rate:
+            return True, win_rate
+        return random.random() < self.explore_rate, win_rate
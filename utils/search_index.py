@@ -0,0 +1,349 @@
+import json
+import math
+import os
+import pickle
+import re
+import threading
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.analytics import load_index
+from utils.story_store import LIKED, PASSED, SCORE_DIMENSIONS, IndexEntry, StoryStore
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it its of on or she so that the "
+    "their them then there they this to was were who will with you your".split()
+)
+# matches in the title count three times, in the request twice
+FIELD_WEIGHTS = {"title": 3, "user_request": 2, "moral": 1, "content": 1}
+MAX_TF = 0xFFFF
+# index fields search ranks and filters on
+SEARCH_COLUMNS = ["word_count", "overall", "flags", "timestamp", *SCORE_DIMENSIONS]
+SNAPSHOT_VERSION = 1
+# recently queried terms whose BM25 weights are kept between searches
+WEIGHT_CACHE_TERMS = 64
+
+
+# story vocabularies are small, so nearly every token is a cache hit
+@lru_cache(maxsize=65536)
+def normalize(token: str) -> str:
+    """Fold simple plurals so "dragons" finds "dragon" and "bunnies" finds "bunny" """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [normalize(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def document_terms(record: Dict) -> Dict[str, int]:
+    """Field-weighted term frequencies for a tracker story record"""
+    story = record.get("story", {})
+    fields = {
+        "title": story.get("title", ""),
+        "user_request": record.get("user_request", ""),
+        "moral": story.get("moral", ""),
+        "content": story.get("content", ""),
+    }
+    terms = Counter()
+    for field, text in fields.items():
+        for token in tokenize(text):
+            terms[token] += FIELD_WEIGHTS[field]
+    return dict(terms)
+
+
+def _date(value: str, end_of_day: bool = False) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def _yes(value: str) -> bool:
+    return value.lower() in ("y", "yes", "true", "1")
+
+
+def parse_query(text: str) -> Tuple[str, Dict]:
+    """
+    Split a CLI query into keywords and search() filters, e.g.
+    "dragon liked:yes score>=7 creative>=8 since:2025-08-01"
+    """
+    keywords, filters = [], {}
+    for part in text.split():
+        match = re.fullmatch(r"(\w+)(>=|<=|:)(.+)", part)
+        if not match:
+            keywords.append(part)
+            continue
+        key, op, value = match.group(1).lower(), match.group(2), match.group(3)
+        dimension = next((dim for dim in SCORE_DIMENSIONS if dim.startswith(key) or key in dim.split("_")), None)
+        try:
+            if key in ("liked", "passed") and op == ":":
+                filters[key] = _yes(value)
+            elif key == "since" and op == ":":
+                filters["since"] = _date(value)
+            elif key == "until" and op == ":":
+                filters["until"] = _date(value, end_of_day=True)
+            elif key in ("score", "overall") and op != ":":
+                filters["min_score" if op == ">=" else "max_score"] = float(value)
+            elif dimension and op == ">=":
+                filters.setdefault("min_scores", {})[dimension] = float(value)
+            else:
+                keywords.append(part)
+        except ValueError:
+            keywords.append(part)
+    return " ".join(keywords), filters
+
+
+class SearchIndex:
+    """
+    Inverted index over story titles, text, morals and requests, ranked with BM25.
+
+    Postings are kept in memory as compact arrays (story position, weighted
+    term frequency). New stories are appended to search.log; on load the
+    pickled snapshot is read and only the log written since is replayed, and
+    each search first replays lines other processes have appended.
+    Score, liked and date filters are applied to the candidates through the
+    story index, so no story body is read until a hit is displayed.
+    """
+
+    def __init__(self, store: StoryStore, k1: float = 1.2, b: float = 0.75, compact_every: int = 1000):
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        self.compact_every = compact_every
+        self.log_file = os.path.join(store.directory, "search.log")
+        self.snapshot_file = os.path.join(store.directory, "search.snapshot")
+
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.count = 0
+        self.total_length = 0
+        self._log_offset = 0
+        self._unsnapshotted = 0
+        self._from_store = False
+        self._loaded = False
+        self._column_cache = None
+        self._weight_cache: Dict[str, Tuple] = {}
+        # sessions sharing a tracker share this index: loading, replaying the log,
+        # snapshotting and scoring each see a consistent postings dict
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return self.count
+
+    def _add_terms(self, position: int, terms: Dict[str, int], length: int):
+        for term, tf in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("I"), array("H"))
+            postings[0].append(position)
+            postings[1].append(min(tf, MAX_TF))
+        self.count = position + 1
+        self.total_length += length
+
+    def _index_from_store(self, position: int):
+        entry = self.store.entry(position)
+        self._add_terms(position, document_terms(self.store.read(entry)), entry.word_count)
+        # these have no log line, so only a snapshot keeps them from being re-read
+        self._from_store = True
+
+    def _load(self):
+        """Read the snapshot, then catch up with the log and the store"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+
+            try:
+                with open(self.snapshot_file, "rb") as f:
+                    snapshot = pickle.load(f)
+                if snapshot.get("version") == SNAPSHOT_VERSION:
+                    self.postings = snapshot["postings"]
+                    self.count = snapshot["count"]
+                    self.total_length = snapshot["total_length"]
+                    self._log_offset = snapshot["log_offset"]
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+            self._catch_up()
+
+    def _catch_up(self):
+        """
+        Replay log lines written since the last look (by this process or any
+        other) and index any stories the log missed.
+        """
+        with self._lock:
+            if os.path.exists(self.log_file) and os.path.getsize(self.log_file) > self._log_offset:
+                with open(self.log_file, "rb") as f:
+                    f.seek(self._log_offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break  # torn or still being written; the story is picked up from the store below
+                        self._log_offset += len(line)
+                        item = json.loads(line)
+                        if item["pos"] < self.count:
+                            continue
+                        # stories appended without a log line (e.g. the legacy import) come from the store
+                        while self.count < item["pos"]:
+                            self._index_from_store(self.count)
+                        self._add_terms(item["pos"], item["terms"], item["length"])
+                        self._unsnapshotted += 1
+
+            while self.count < len(self.store):
+                self._index_from_store(self.count)
+            if self._from_store or self._unsnapshotted >= self.compact_every:
+                self.compact()
+
+    def add(self, position: int, record: Dict, terms: Dict[str, int] = None):
+        """
+        Index the story stored at this index position (call right after
+        StoryStore.append). Pass document_terms(record) to tokenize before taking the store lock.
+        """
+        terms = document_terms(record) if terms is None else terms
+        length = record.get("story", {}).get("word_count", 0)
+        line = json.dumps({"pos": position, "id": record["id"], "length": length, "terms": terms}) + "\n"
+        # one write on an O_APPEND file, so lines from concurrent writers never interleave
+        with open(self.log_file, "ab") as f:
+            f.write(line.encode("utf-8"))
+
+        # an unloaded index picks the line up from the log when it is first searched
+        with self._lock:
+            if self._loaded:
+                self._catch_up()
+
+    def compact(self):
+        """Write the in-memory index as a snapshot so the next load replays nothing"""
+        with self._lock:
+            self._load()
+            # per-process temp file; the offset is what this index has replayed, not the log size,
+            # since another writer may have appended lines it hasn't read yet
+            temp_file = f"{self.snapshot_file}.{os.getpid()}.tmp"
+            with open(temp_file, "wb") as f:
+                pickle.dump({
+                    "version": SNAPSHOT_VERSION,
+                    "postings": self.postings,
+                    "count": self.count,
+                    "total_length": self.total_length,
+                    "log_offset": self._log_offset,
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, self.snapshot_file)
+            self._unsnapshotted = 0
+            self._from_store = False
+
+    def _columns(self) -> Dict[str, np.ndarray]:
+        """Contiguous copies of the index columns search reads, extended as stories are added"""
+        have = len(self._column_cache["overall"]) if self._column_cache else 0
+        if have < self.count:
+            tail = load_index(self.store)[have:self.count]
+            columns = {}
+            for name in SEARCH_COLUMNS:
+                # float32 lengths keep the BM25 arithmetic in single precision
+                column = tail[name].astype(np.float32 if name == "word_count" else tail.dtype[name])
+                columns[name] = np.concatenate([self._column_cache[name], column]) if have else column
+            self._column_cache = columns
+        return self._column_cache
+
+    def _bm25(self, terms: List[str], lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Candidate positions and their BM25 scores summed over the query terms"""
+        average_length = (self.total_length / self.count) or 1
+        matches = []
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            cached = self._weight_cache.get(term)
+            # weights depend on the story count and average length, so any add invalidates them
+            if cached is None or cached[0] != self.count:
+                # copies, so the arrays stay free to grow while results are held
+                term_positions = np.array(postings[0], dtype=np.int64)
+                tf = np.array(postings[1], dtype=np.float32)
+                df = len(term_positions)
+                idf = math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+                norm = lengths[term_positions] * np.float32(self.k1 * self.b / average_length)
+                norm += np.float32(self.k1 * (1 - self.b))
+                weights = tf * np.float32(idf * (self.k1 + 1)) / (tf + norm)
+                cached = (self.count, term_positions, weights)
+                self._weight_cache.pop(term, None)
+                self._weight_cache[term] = cached
+                if len(self._weight_cache) > WEIGHT_CACHE_TERMS:
+                    self._weight_cache.pop(next(iter(self._weight_cache)))
+            matches.append(cached[1:])
+
+        if not matches:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        if len(matches) == 1:
+            return matches[0]
+        # a dense accumulator beats sorting when common terms match most stories
+        totals = np.zeros(self.count, dtype=np.float32)
+        for term_positions, weights in matches:
+            totals[term_positions] += weights
+        candidates = np.flatnonzero(totals)
+        return candidates, totals[candidates]
+
+    def search(self, query: str, limit: int = 10, min_score: float = None, max_score: float = None,
+               liked: Optional[bool] = None, passed: Optional[bool] = None,
+               since: datetime = None, until: datetime = None,
+               min_scores: Dict[str, float] = None) -> List[Tuple[IndexEntry, float]]:
+        """
+        Best matches for the query, highest BM25 score first. With no keywords,
+        the newest stories that pass the filters are returned.
+        """
+        # scoring reads the postings; what it returns is copied, so filtering runs unlocked
+        with self._lock:
+            self._load()
+            self._catch_up()
+            count = self.count
+            if not count:
+                return []
+            columns = self._columns()
+            terms = list(dict.fromkeys(tokenize(query)))
+            if terms:
+                candidates, scores = self._bm25(terms, columns["word_count"])
+            else:
+                candidates, scores = None, None
+
+        def column(name: str) -> np.ndarray:
+            return columns[name] if candidates is None else columns[name][candidates]
+
+        conditions = []
+        if min_score is not None:
+            conditions.append(column("overall") >= min_score)
+        if max_score is not None:
+            conditions.append(column("overall") <= max_score)
+        if liked is not None:
+            conditions.append(((column("flags") & LIKED) != 0) == liked)
+        if passed is not None:
+            conditions.append(((column("flags") & PASSED) != 0) == passed)
+        if since is not None:
+            conditions.append(column("timestamp") >= since.timestamp())
+        if until is not None:
+            conditions.append(column("timestamp") < until.timestamp())
+        for dimension, minimum in (min_scores or {}).items():
+            conditions.append(column(dimension) >= minimum)
+        keep = np.logical_and.reduce(conditions) if conditions else None
+
+        if candidates is None:
+            # no keywords: newest stories first
+            newest = np.flatnonzero(keep)[::-1] if keep is not None else np.arange(count - 1, -1, -1)
+            candidates = newest[:limit]
+            scores = np.zeros(len(candidates))
+        else:
+            if keep is not None:
+                candidates, scores = candidates[keep], scores[keep]
+            if len(candidates) > limit:
+                top = np.argpartition(-scores, limit)[:limit]
+                candidates, scores = candidates[top], scores[top]
+            order = np.lexsort((-candidates, -scores))
+            candidates, scores = candidates[order], scores[order]
+
+        return [(self.store.entry(int(position)), round(float(score), 3))
+                for position, score in zip(candidates, scores)]
@@ -0,0 +1,201 @@
+import math
+import os
+import zlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from utils.analytics import load_index
+from utils.search_index import tokenize
+from utils.story_store import PASSED, SAFETY_PASSED, StoryStore
+
+DIMENSIONS = 512
+NGRAM = 3
+# whole words count double so a shared word outweighs a few shared letters
+WORD_WEIGHT = 2.0
+# share of the vector given to sentiment axes (see POLARITY); opposite requests score at most 1 - 2 * this
+POLARITY_WEIGHT = 0.2
+# Calibrated on the paraphrase, opposite and same-character pairs in
+# tests/test_similarity_index.py: paraphrases score 0.78 and up, a different
+# idea about the same character 0.72 at most, and opposites 0.6 at most.
+# at or above: the same request asked again; offer the earlier story
+DUPLICATE_THRESHOLD = 0.77
+# at or above: close enough that the earlier outline fits; the user is asked first
+OUTLINE_THRESHOLD = 0.74
+# bump when embed() changes, so stored vectors are rebuilt
+EMBEDDING_VERSION = 2
+CHUNK_ROWS = 65536
+# InputHandler phrases every request as "A story about ...", which says nothing about the story
+BOILERPLATE = frozenset(["story", "about"])
+# fillers and generic verbs that read the same in any request
+FILLER = BOILERPLATE | frozenset(
+    "very little named called am be being do does did can could would want wish dream one some "
+    "go goe going went get make try trie trying".split()
+)
+NEGATIONS = frozenset("not no never don doesn didn isn wasn aren won t cannot".split())
+# a negation flips the sentiment of the next words, as in "not afraid of the dark"
+NEGATION_REACH = 2
+
+
+def stem(word: str) -> str:
+    """Fold -ing/-ed/-s and a final e, so "loving", "loved" and "loves" meet at "lov" """
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and not word.endswith("ss") and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    # a consonant doubled before -ing/-ed: "hopping" -> "hop"
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "lsz":
+        word = word[:-1]
+    return word
+
+
+# sentiment axes: words at either end count toward the axis with opposite signs,
+# so "loves books" and "hates books" point apart however much else they share
+POLARITY_AXES = {
+    "like": ("love like enjoy adore", "hate dislike loathe"),
+    "fear": ("afraid scared frightened fearful timid scary", "brave fearless bold courageous"),
+    "mood": ("happy cheerful glad joyful", "sad grumpy unhappy gloomy"),
+    "size": ("big giant huge large enormous", "tiny small"),
+    "noise": ("noisy loud", "quiet silent"),
+    "speed": ("fast quick speedy", "slow"),
+}
+POLARITY = {
+    stem(word): (axis, sign)
+    for axis, ends in POLARITY_AXES.items()
+    for sign, words in zip((1, -1), ends)
+    for word in words.split()
+}
+
+
+def request_text(record: Dict) -> str:
+    """What a story was asked for: the raw request plus InputHandler's story elements"""
+    return f"{record.get('user_request', '')} {record.get('story_elements', '')}"
+
+
+def _slot(feature: str, dimensions: int) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % dimensions
+
+
+def embed(text: str, dimensions: int = DIMENSIONS) -> np.ndarray:
+    """
+    Unit-length hashed bag of stemmed words and character trigrams, plus a
+    signed sentiment part. Word order is ignored and trigrams overlap across
+    word forms, so "a dragon who loves books" and "book-loving dragon" land
+    close together, while "a dragon who hates books" points away.
+    """
+    features = Counter()
+    polarity = {}
+    negated = 0
+    for word in tokenize(text):
+        if word in NEGATIONS:
+            negated = NEGATION_REACH
+            continue
+        stemmed = stem(word)
+        if stemmed in POLARITY:
+            axis, sign = POLARITY[stemmed]
+            polarity[axis] = -sign if negated else sign
+        elif word not in FILLER:
+            # a word in both the request and its story elements counts twice: it is what the story is about
+            features[stemmed] += WORD_WEIGHT
+            padded = f"#{stemmed}#"
+            for i in range(len(padded) - NGRAM + 1):
+                features[padded[i:i + NGRAM]] += 1
+        negated = max(0, negated - 1)
+
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, count in features.items():
+        vector[_slot(feature, dimensions)] += count
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    if polarity:
+        signs = np.zeros(dimensions, dtype=np.float32)
+        for axis, sign in polarity.items():
+            signs[_slot(f"~{axis}", dimensions)] += sign
+        signs /= np.linalg.norm(signs)
+        vector = vector * math.sqrt(1 - POLARITY_WEIGHT) + signs * math.sqrt(POLARITY_WEIGHT) if norm else signs
+    return vector
+
+
+class SimilarityIndex:
+    """
+    One hashed request vector per stored story, kept as a float32 matrix file
+    next to the story index (row n is the story at index position n) and
+    searched by cosine similarity in chunks through a memory map. float32 rows
+    feed matmul straight from the map; converting float16 cost more than the
+    matmul itself.
+    """
+
+    def __init__(self, store: StoryStore, dimensions: int = DIMENSIONS):
+        self.store = store
+        self.dimensions = dimensions
+        self.matrix_file = os.path.join(store.directory, f"similarity-v{EMBEDDING_VERSION}-{dimensions}.f32")
+        self.row_bytes = dimensions * 4
+        self._map = None
+        self._mapped_rows = 0
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.matrix_file):
+            return 0
+        return os.path.getsize(self.matrix_file) // self.row_bytes
+
+    def _append_rows(self, vectors: List[np.ndarray]):
+        with open(self.matrix_file, "ab") as f:
+            f.write(b"".join(vector.astype(np.float32).tobytes() for vector in vectors))
+
+    def sync(self):
+        """Embed stories that have no row yet (e.g. from the legacy import)"""
+        if len(self) >= len(self.store):
+            return
+        # rows must line up with index positions, so only one process fills the gap
+        with self.store.locked():
+            missing = range(len(self), len(self.store))
+            if missing:
+                self._append_rows([embed(request_text(self.store.read(self.store.entry(i), bodies=False)))
+                                   for i in missing])
+
+    def add(self, position: int, record: Dict, vector: np.ndarray = None):
+        """
+        Embed the story stored at this index position (call right after
+        StoryStore.append). Pass its vector to embed before taking the store lock.
+        """
+        if len(self) < position:
+            self.sync()
+        if len(self) == position:
+            self._append_rows([embed(request_text(record)) if vector is None else vector])
+
+    def _matrix(self) -> np.ndarray:
+        rows = len(self)
+        if rows != self._mapped_rows:
+            self._map = np.memmap(self.matrix_file, dtype=np.float32, mode="r", shape=(rows, self.dimensions)) \
+                if rows else None
+            self._mapped_rows = rows
+        return self._map
+
+    def search(self, text: str, k: int = 3, passed_only: bool = True) -> List[Tuple[int, float]]:
+        """Index positions of the k most similar requests, with cosine similarity, best first"""
+        self.sync()
+        matrix = self._matrix()
+        if matrix is None:
+            return []
+        query = embed(text, self.dimensions)
+        if not query.any():
+            return []
+
+        similarity = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), CHUNK_ROWS):
+            chunk = matrix[start:start + CHUNK_ROWS]
+            similarity[start:start + len(chunk)] = chunk @ query
+        if passed_only:
+            flags = load_index(self.store)["flags"][:len(matrix)]
+            usable = ((flags & PASSED) != 0) & ((flags & SAFETY_PASSED) != 0)
+            similarity[~usable] = -1
+
+        k = min(k, len(similarity))
+        top = np.argpartition(-similarity, k - 1)[:k]
+        top = top[np.argsort(-similarity[top], kind="stable")]
+        return [(int(position), round(float(similarity[position]), 3))
+                for position in top if similarity[position] > 0]
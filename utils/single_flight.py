@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from utils import metrics
+
+
+class _Flight:
+    """One upstream call that any number of identical requests can wait on"""
+
+    def __init__(self, max_tokens: int):
+        # the longest reply this call can produce; callers asking for more don't join it
+        self.max_tokens = max_tokens
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # the leader was cancelled or interrupted; waiters run the call again
+        self.abandoned = False
+        self.callbacks: List[Callable] = []
+
+
+class SingleFlight:
+    """
+    Wraps an LLM call function so identical in-flight (prompt, params) requests
+    share one upstream call. Works for threaded callers via __call__ and for
+    asyncio callers via acall; both kinds of caller join the same flights.
+    """
+
+    # per-caller options that don't change the response; the leader's value is sent
+    # upstream, and each waiter still gives up at its own timeout
+    IGNORED_PARAMS = ("timeout",)
+    # max_tokens is not part of the key either: BudgetedCall shrinks it as each
+    # caller's budget runs down, so identical prompts would rarely match. A caller
+    # joins a flight that asked for at least as many tokens; one that needs more
+    # starts its own, which later callers then join.
+
+    def __init__(self, llm_call_function: Callable):
+        self.call_model = llm_call_function
+        self._lock = threading.Lock()
+        self._flights: Dict[Tuple, _Flight] = {}
+        self._stats = {"calls": 0, "upstream_calls": 0, "coalesced": 0, "errors": 0}
+
+    def _key(self, prompt: str, temperature: float, kwargs: Dict) -> Tuple:
+        params = tuple(sorted(
+            (name, value) for name, value in kwargs.items() if name not in self.IGNORED_PARAMS
+        ))
+        return (prompt, temperature, params)
+
+    def _join(self, key: Tuple, max_tokens: int, retry: bool = False) -> Tuple[_Flight, bool]:
+        """Return the flight for key and whether the caller must run it (leader)"""
+        with self._lock:
+            if not retry:
+                self._stats["calls"] += 1
+            flight = self._flights.get(key)
+            if flight is not None and flight.max_tokens >= max_tokens:
+                self._stats["coalesced"] += 1
+                metrics.SINGLE_FLIGHT_CALLS.labels(result="coalesced").inc()
+                return flight, False
+
+            flight = _Flight(max_tokens)
+            self._flights[key] = flight
+            self._stats["upstream_calls"] += 1
+            metrics.SINGLE_FLIGHT_CALLS.labels(result="upstream").inc()
+            return flight, True
+
+    def _finish(self, key: Tuple, flight: _Flight, result=None, error=None, abandoned=False):
+        with self._lock:
+            # a caller that needed more tokens may have replaced this flight under the key
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.result = result
+            flight.error = error
+            flight.abandoned = abandoned
+            if error is not None:
+                self._stats["errors"] += 1
+            callbacks = flight.callbacks
+            flight.callbacks = []
+            flight.done.set()
+
+        for callback in callbacks:
+            callback(flight)
+
+    @staticmethod
+    def _remaining(deadline: Optional[float], kwargs: Dict) -> Optional[float]:
+        """Seconds this caller may still wait; a waiter that leads a retry gets them as its timeout"""
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Timed out waiting for an identical in-flight call")
+        kwargs["timeout"] = remaining
+        return remaining
+
+    @staticmethod
+    def _outcome(flight: _Flight) -> str:
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def __call__(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        key = self._key(prompt, temperature, kwargs)
+        timeout = kwargs.get("timeout")
+        deadline = time.monotonic() + timeout if timeout else None
+        retry = False
+
+        while True:
+            flight, leader = self._join(key, max_tokens, retry)
+            if leader:
+                try:
+                    result = self.call_model(
+                        prompt, max_tokens=max_tokens, temperature=temperature, **kwargs
+                    )
+                except Exception as e:
+                    self._finish(key, flight, error=e)
+                    raise
+                except BaseException:
+                    # interrupted: there is no result to share, so the waiters retry
+                    self._finish(key, flight, abandoned=True)
+                    raise
+                self._finish(key, flight, result=result)
+                return result
+
+            # each waiter keeps its own deadline; the leader's timeout may be longer
+            if not flight.done.wait(self._remaining(deadline, kwargs)):
+                raise TimeoutError("Timed out waiting for an identical in-flight call")
+            if not flight.abandoned:
+                return self._outcome(flight)
+            self._remaining(deadline, kwargs)
+            retry = True
+
+    async def acall(self, prompt: str, max_tokens=3000, temperature=0.7, **kwargs) -> str:
+        key = self._key(prompt, temperature, kwargs)
+        timeout = kwargs.get("timeout")
+        deadline = time.monotonic() + timeout if timeout else None
+        loop = asyncio.get_running_loop()
+        retry = False
+
+        while True:
+            flight, leader = self._join(key, max_tokens, retry)
+            if leader:
+                try:
+                    if asyncio.iscoroutinefunction(self.call_model):
+                        result = await self.call_model(
+                            prompt, max_tokens=max_tokens, temperature=temperature, **kwargs
+                        )
+                    else:
+                        call_kwargs = dict(kwargs)
+                        result = await loop.run_in_executor(
+                            None,
+                            lambda: self.call_model(
+                                prompt, max_tokens=max_tokens, temperature=temperature, **call_kwargs
+                            ),
+                        )
+                except Exception as e:
+                    self._finish(key, flight, error=e)
+                    raise
+                except BaseException:
+                    # cancelled: there is no result to share, so the waiters retry
+                    self._finish(key, flight, abandoned=True)
+                    raise
+                self._finish(key, flight, result=result)
+                return result
+
+            future = loop.create_future()
+
+            def resolve(finished: _Flight, future=future):
+                if not future.done():
+                    future.set_result(finished)
+
+            def callback(finished: _Flight, resolve=resolve):
+                loop.call_soon_threadsafe(resolve, finished)
+
+            with self._lock:
+                registered = not flight.done.is_set()
+                if registered:
+                    flight.callbacks.append(callback)
+            if not registered:
+                resolve(flight)
+
+            try:
+                await asyncio.wait_for(future, self._remaining(deadline, kwargs))
+            except asyncio.TimeoutError:
+                raise TimeoutError("Timed out waiting for an identical in-flight call") from None
+            finally:
+                # a waiter that gave up (timed out or cancelled) is not called back into a finished loop
+                with self._lock:
+                    if callback in flight.callbacks:
+                        flight.callbacks.remove(callback)
+            if not flight.abandoned:
+                return self._outcome(flight)
+            self._remaining(deadline, kwargs)
+            retry = True
+
+    def get_stats(self) -> Dict:
+        """Get coalescing counts since startup"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+
+        stats["coalesce_rate"] = (
+            round((stats["coalesced"] / stats["calls"]) * 100, 1) if stats["calls"] else 0
+        )
+        return stats
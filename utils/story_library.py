@@ -0,0 +1,229 @@
+"""
+Fallback library of vetted stories.
+
+When a story can't be written (the model timed out, every route is open, the
+story budget ran out), StoryGenerator serves the library story whose request
+reads most like this one instead of a one-line stub. Library stories have
+passed the judge already and carry that evaluation, so serving one takes no
+further calls.
+
+The library is built from passing stories at or above min_overall:
+- the tracker's history (best first, index-only scan)
+- the good categories of a labelled dataset (excellent, length_variety_pass)
+- library_builder output files
+Stories are matched with the hashed request vectors the tracker uses for
+repeated requests (utils/similarity_index.py), over their request, title and
+moral.
+
+Usage:
+    python -m utils.story_library build                       # tracker + bundled dataset
+    python -m utils.story_library build --library story_library.jsonl
+    python -m utils.story_library match "a sleepy dragon"
+"""
+
+import argparse
+import heapq
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from utils.similarity_index import DIMENSIONS, embed
+
+LIBRARY_FILE = "fallback_library.jsonl"
+DATASET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bedtime_stories_ds.json")
+GOOD_CATEGORIES = ("excellent", "length_variety_pass")
+MIN_OVERALL = 7.0
+# below this the closest story shares a word or two by chance; the best-scored story is served instead
+MIN_SIMILARITY = 0.35
+
+
+def failure_kind(error: Exception) -> str:
+    """Why generation failed: budget, open (no healthy route), timeout or error"""
+    from utils.budget import BudgetExhausted
+    from utils.model_router import RoutesOpen
+
+    if isinstance(error, BudgetExhausted):
+        return "budget"
+    if isinstance(error, RoutesOpen):
+        return "open"
+    # openai and requests name their timeouts Timeout rather than subclassing TimeoutError
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return "timeout"
+    return "error"
+
+
+def _entry(title: str, story: str, moral: str, evaluation: Dict, request: str, source: str,
+           questions: List[str] = ()) -> Dict:
+    return {
+        "title": title,
+        "story": story,
+        "moral": moral,
+        "evaluation": evaluation,
+        "questions": list(questions),
+        "request": request,
+        "source": source,
+    }
+
+
+def from_tracker(story_tracker, min_overall: float = MIN_OVERALL, limit: int = 200) -> Iterator[Dict]:
+    """The best passing stories in the tracker's history; only those records are read"""
+    entries = (
+        entry for entry in story_tracker.store.entries()
+        if entry.passed and entry.safety_passed and entry.overall >= min_overall
+    )
+    for entry in heapq.nlargest(limit, entries, key=lambda entry: entry.overall):
+        record = story_tracker.store.read(entry)
+        story = record["story"]
+        yield _entry(
+            story["title"], story["content"], story.get("moral", ""), record["evaluation"],
+            f"{record.get('user_request', '')} {record.get('story_elements', '')}".strip(),
+            f"tracker:{record['id']}",
+        )
+
+
+def from_dataset(path: str, min_overall: float = MIN_OVERALL) -> Iterator[Dict]:
+    """Stories in the dataset's good categories, with the expected judgement as their evaluation"""
+    from agents.judge import JudgeSystem
+    from utils.batch_eval import iter_dataset
+
+    judge = JudgeSystem(None)
+    for item in iter_dataset(path):
+        expected = item["expected"]
+        scores = dict(expected.get("scores") or {})
+        overall = scores.pop("overall", 0)
+        if item["category"] not in GOOD_CATEGORIES or not expected.get("pass") or overall < min_overall:
+            continue
+        # the dataset predates the rubric's rename of this dimension
+        if "reading_level_length" in scores:
+            scores["age_readability"] = scores.pop("reading_level_length")
+        story = item["story"]
+        evaluation = {
+            "pass": True,
+            "safety_passed": True,
+            "scores": scores,
+            "overall": overall,
+            "feedback": expected.get("feedback", ""),
+            "improvement": "",
+            "length_check": judge._analyze_length(story),
+        }
+        yield _entry(story["title"], story["story"], story["moral"], evaluation, story["title"],
+                     f"dataset:{item['id']}")
+
+
+def from_library_file(path: str, min_overall: float = MIN_OVERALL) -> Iterator[Dict]:
+    """Passing stories from a library_builder output file"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            evaluation = record["evaluation"]
+            if evaluation.get("pass") and evaluation.get("overall", 0) >= min_overall:
+                story = record["story"]
+                yield _entry(story["title"], story["story"], story.get("moral", ""), evaluation,
+                             record.get("theme", ""), f"library:{record.get('theme', '')}",
+                             record.get("questions", []))
+
+
+class StoryLibrary:
+    """Vetted stories and a request vector for each, matched by cosine similarity"""
+
+    def __init__(self, entries: Iterable[Dict]):
+        self.entries: List[Dict] = list(entries)
+        self.vectors = np.zeros((len(self.entries), DIMENSIONS), dtype=np.float32)
+        for row, entry in enumerate(self.entries):
+            self.vectors[row] = embed(f"{entry['request']} {entry['title']} {entry['moral']}")
+        scores = [entry["evaluation"].get("overall", 0) for entry in self.entries]
+        self.best_scored = int(np.argmax(scores)) if scores else None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @classmethod
+    def build(cls, *sources: Iterable[Dict], limit: int = 500) -> "StoryLibrary":
+        """Best-scoring stories across sources, one copy of each"""
+        seen, entries = set(), []
+        for entry in sorted((e for source in sources for e in source),
+                            key=lambda e: e["evaluation"].get("overall", 0), reverse=True):
+            key = (entry["title"], entry["story"][:200])
+            if key not in seen:
+                seen.add(key)
+                entries.append(entry)
+        return cls(entries[:limit])
+
+    @classmethod
+    def load(cls, path: str) -> "StoryLibrary":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.loads(line) for line in f if line.strip())
+
+    @classmethod
+    def open(cls, path: str, story_tracker=None, dataset: str = DATASET_FILE) -> "StoryLibrary":
+        """The library at path, built from the tracker and dataset and saved there if it's missing"""
+        if os.path.exists(path):
+            return cls.load(path)
+        sources = [from_tracker(story_tracker)] if story_tracker is not None else []
+        if dataset and os.path.exists(dataset):
+            sources.append(from_dataset(dataset))
+        library = cls.build(*sources)
+        library.save(path)
+        return library
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, path)
+
+    def match(self, request: str, min_similarity: float = MIN_SIMILARITY) -> Optional[Dict]:
+        """The closest story to request with its "similarity"; the best-scored one if nothing is close"""
+        if not self.entries:
+            return None
+        similarities = self.vectors @ embed(request)
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_similarity:
+            best = self.best_scored
+        return {**self.entries[best], "similarity": round(float(similarities[best]), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the fallback story library")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Rebuild the library from the tracker, dataset and library files")
+    build.add_argument("--dataset", default=DATASET_FILE, help="Labelled dataset (.json or .jsonl); '' to skip")
+    build.add_argument("--library", action="append", default=[], help="library_builder output file (repeatable)")
+    build.add_argument("--min-overall", type=float, default=MIN_OVERALL, help="Lowest judge score to include")
+    build.add_argument("--limit", type=int, default=500, help="Stories kept, best first")
+    match = commands.add_parser("match", help="Show the story a request would be served")
+    match.add_argument("request")
+    for command in (build, match):
+        command.add_argument("--data-dir", default="story_metrics_store", help="Tracker data directory")
+    args = parser.parse_args()
+
+    path = os.path.join(args.data_dir, LIBRARY_FILE)
+    if args.command == "match":
+        served = StoryLibrary.open(path).match(args.request)
+        if served is None:
+            print("The library is empty")
+        else:
+            print(f"{served['title']} ({served['source']}, {served['evaluation'].get('overall')}/10, "
+                  f"similarity {served['similarity']})")
+        return
+
+    from utils.story_tracker import StoryTracker
+
+    tracker = StoryTracker(data_dir=args.data_dir)
+    sources = [from_tracker(tracker, args.min_overall)]
+    if args.dataset:
+        sources.append(from_dataset(args.dataset, args.min_overall))
+    sources.extend(from_library_file(path, args.min_overall) for path in args.library)
+    library = StoryLibrary.build(*sources, limit=args.limit)
+    library.save(path)
+    print(f"{len(library)} stories in {path}")
+
+
+if __name__ == "__main__":
+    main()
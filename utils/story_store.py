@@ -0,0 +1,388 @@
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still serialized within one process
+    fcntl = None
+
+SCORE_DIMENSIONS = ["bedtime_readiness", "creative_spark", "story_quality", "age_readability"]
+
+# Side index: a 16-byte header followed by one fixed-size entry per story, in id order.
+# Entries hold byte offsets into the record file plus the fields that stats,
+# analytics and filters need, so those never have to parse a story body.
+INDEX_MAGIC = b"BSIX"
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct("<4sI8x")
+INDEX_ENTRY = struct.Struct("<QQIId4ff4fffB3xI")
+# version 1 entries lack initial_word_count; they are the first 80 bytes of a version 2 entry
+INDEX_ENTRY_V1 = struct.Struct("<QQIId4ff4fffB3x")
+
+PASSED = 1
+SAFETY_PASSED = 2
+LIKED = 4
+REFINE_ATTEMPTED = 8
+REFINE_KEPT = 16
+REFINE_SKIPPED = 32
+
+_IndexFields = namedtuple(
+    "IndexEntry",
+    [
+        "id", "offset", "length", "word_count", "timestamp",
+        *SCORE_DIMENSIONS, "overall",
+        *[f"initial_{dim}" for dim in SCORE_DIMENSIONS], "initial_overall",
+        "predicted_win_rate", "flags", "initial_word_count",
+    ],
+)
+
+
+class IndexEntry(_IndexFields):
+    """One story's index entry: offsets, timestamp, scores and flags"""
+
+    @property
+    def passed(self) -> bool:
+        return bool(self.flags & PASSED)
+
+    @property
+    def safety_passed(self) -> bool:
+        return bool(self.flags & SAFETY_PASSED)
+
+    @property
+    def liked(self) -> bool:
+        return bool(self.flags & LIKED)
+
+    @property
+    def scores(self) -> Dict:
+        return {dim: getattr(self, dim) for dim in SCORE_DIMENSIONS}
+
+    def refinement(self) -> Dict:
+        """Same shape as a record's "refinement" block, rebuilt from the index"""
+        attempted = bool(self.flags & REFINE_ATTEMPTED)
+        return {
+            "attempted": attempted,
+            "skipped": bool(self.flags & REFINE_SKIPPED),
+            "kept": bool(self.flags & REFINE_KEPT),
+            "predicted_win_rate": None if math.isnan(self.predicted_win_rate) else self.predicted_win_rate,
+            "initial_scores": {dim: getattr(self, f"initial_{dim}") for dim in SCORE_DIMENSIONS},
+            "initial_overall": self.initial_overall,
+            "initial_word_count": self.initial_word_count,
+            "refined_overall": self.overall if attempted else None,
+        }
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def index_entry_for(record: Dict, offset: int, length: int) -> bytes:
+    """Pack the index entry for a tracker story record"""
+    evaluation = record.get("evaluation", {})
+    scores = evaluation.get("scores") or {}
+    refinement = record.get("refinement") or {}
+    initial_scores = refinement.get("initial_scores") or scores
+    win_rate = refinement.get("predicted_win_rate")
+    word_count = record.get("story", {}).get("word_count", 0)
+
+    flags = 0
+    flags |= PASSED if evaluation.get("pass", False) else 0
+    flags |= SAFETY_PASSED if evaluation.get("safety_passed", True) else 0
+    flags |= LIKED if record.get("user_liked", False) else 0
+    flags |= REFINE_ATTEMPTED if refinement.get("attempted") else 0
+    flags |= REFINE_KEPT if refinement.get("kept") else 0
+    flags |= REFINE_SKIPPED if refinement.get("skipped") else 0
+
+    return INDEX_ENTRY.pack(
+        record["id"],
+        offset,
+        length,
+        word_count,
+        datetime.fromisoformat(record["timestamp"]).timestamp(),
+        *[_number(scores.get(dim)) for dim in SCORE_DIMENSIONS],
+        _number(evaluation.get("overall")),
+        *[_number(initial_scores.get(dim)) for dim in SCORE_DIMENSIONS],
+        _number(refinement.get("initial_overall", evaluation.get("overall"))),
+        float("nan") if win_rate is None else win_rate,
+        flags,
+        refinement.get("initial_word_count") or word_count,
+    )
+
+
+def indexed_count(directory: str) -> int:
+    """Stories in the store at directory, from the size of its index; 0 before the store exists"""
+    try:
+        size = os.path.getsize(os.path.join(directory, "stories.idx"))
+    except FileNotFoundError:
+        return 0
+    return max(0, (size - INDEX_HEADER.size) // INDEX_ENTRY.size)
+
+
+class StoryStore:
+    """
+    Append-only story records (JSON lines) with a fixed-width side index read
+    through mmap. Listing, stats and lookups by id touch only the index; a
+    story body is read from disk only when get() or iter_records() needs it.
+
+    Story text and outlines live in a content-addressed BlobStore; records
+    keep their hashes and read() puts the bodies back.
+
+    Writers in any number of processes share a store: append() takes an
+    advisory lock on stories.lock, assigns the next id from the index and
+    writes the record, then its entry, so ids stay unique and increasing and
+    readers never see a half-written story.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.records_file = os.path.join(directory, "stories.jsonl")
+        self.index_file = os.path.join(directory, "stories.idx")
+        self.lock_file = os.path.join(directory, "stories.lock")
+        os.makedirs(directory, exist_ok=True)
+
+        try:
+            # "xb" so two processes opening a new store can't both write the header
+            with open(self.index_file, "xb") as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION))
+        except FileExistsError:
+            pass
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_handle = None
+        # (map, size) of the index, swapped as one so a reader never pairs a map with another's size
+        self._mapping = (None, 0)
+        self._records = None
+        self._blobs = None
+
+        magic, version = self._index_version()
+        if magic == INDEX_MAGIC and version == 1:
+            self._upgrade_index()
+        elif magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"Unsupported story index: {self.index_file}")
+
+    def _index_version(self) -> Tuple[bytes, int]:
+        with open(self.index_file, "rb") as f:
+            return INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+
+    def _upgrade_index(self):
+        """
+        Rewrite a version 1 index as version 2, reading each indexed record for
+        its initial word count. Records without an entry stay invisible.
+        """
+        with self.locked():
+            # another process may have upgraded it while this one waited for the lock
+            if self._index_version()[1] == INDEX_VERSION:
+                return
+            with open(self.index_file, "rb") as f:
+                data = f.read()
+            count = (len(data) - INDEX_HEADER.size) // INDEX_ENTRY_V1.size
+            temp_index = f"{self.index_file}.{os.getpid()}.tmp"
+            with open(self.records_file, "rb") as records, open(temp_index, "wb") as index:
+                index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION))
+                for position in range(count):
+                    entry = INDEX_ENTRY_V1.unpack_from(data, INDEX_HEADER.size + position * INDEX_ENTRY_V1.size)
+                    offset, length = entry[1], entry[2]
+                    records.seek(offset)
+                    index.write(index_entry_for(json.loads(records.read(length)), offset, length))
+            os.replace(temp_index, self.index_file)
+
+    @property
+    def blobs(self):
+        """BlobStore for story bodies, opened on first use"""
+        if self._blobs is None:
+            from utils.blob_store import BlobStore
+            self._blobs = BlobStore(self.directory, lock=self.locked)
+        return self._blobs
+
+    def _index(self) -> Tuple[Optional[mmap.mmap], int]:
+        """mmap of the index and the entries it holds, remapped when another append has grown the file"""
+        index, size = self._mapping
+        current = os.path.getsize(self.index_file)
+        if current != size:
+            # the old map is left to the garbage collector; iterators may still hold it
+            index, size = None, current
+            if size > INDEX_HEADER.size:
+                with open(self.index_file, "rb") as f:
+                    index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapping = (index, size)
+        return index, (size - INDEX_HEADER.size) // INDEX_ENTRY.size
+
+    def __len__(self) -> int:
+        return indexed_count(self.directory)
+
+    def _unpack(self, index: mmap.mmap, position: int) -> IndexEntry:
+        return IndexEntry(*INDEX_ENTRY.unpack_from(index, INDEX_HEADER.size + position * INDEX_ENTRY.size))
+
+    def entry(self, position: int) -> IndexEntry:
+        return self._unpack(self._index()[0], position)
+
+    def entries(self, newest_first: bool = False) -> Iterator[IndexEntry]:
+        index, count = self._index()
+        positions = range(count - 1, -1, -1) if newest_first else range(count)
+        for position in positions:
+            yield self._unpack(index, position)
+
+    def last_id(self) -> int:
+        count = len(self)
+        return self.entry(count - 1).id if count else 0
+
+    def find(self, story_id: int) -> Optional[IndexEntry]:
+        """Binary search the index; ids only ever increase"""
+        index, count = self._index()
+        low, high = 0, count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            entry = self._unpack(index, middle)
+            if entry.id == story_id:
+                return entry
+            if entry.id < story_id:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def store_bodies(self, record: Dict) -> Dict:
+        """
+        Copy of the record with the story text and outline moved to the blob
+        store, leaving their hashes. Blobs are content-addressed, so this can
+        run (and compress) before the write lock is taken.
+        """
+        stored = dict(record)
+        story = record.get("story") or {}
+        if "content" in story:
+            content_hash = self.blobs.put(story["content"].encode("utf-8"))
+            stored["story"] = {("content_hash" if key == "content" else key): (content_hash if key == "content" else value)
+                               for key, value in story.items()}
+        if record.get("outline"):
+            outline_hash = self.blobs.put(json.dumps(record["outline"], ensure_ascii=False).encode("utf-8"))
+            stored = {("outline_hash" if key == "outline" else key): (outline_hash if key == "outline" else value)
+                      for key, value in stored.items()}
+        return stored
+
+    def load_bodies(self, record: Dict) -> Dict:
+        """Put the story text and outline back into a stored record"""
+        story = record.get("story") or {}
+        if "content_hash" in story:
+            content = self.blobs.get(story["content_hash"]).decode("utf-8")
+            record["story"] = {("content" if key == "content_hash" else key): (content if key == "content_hash" else value)
+                               for key, value in story.items()}
+        if "outline_hash" in record:
+            outline = json.loads(self.blobs.get(record["outline_hash"]))
+            record = {("outline" if key == "outline_hash" else key): (outline if key == "outline_hash" else value)
+                      for key, value in record.items()}
+        return record
+
+    def read(self, entry: IndexEntry, bodies: bool = True) -> Dict:
+        """Load one story record from the record file, with its bodies unless bodies=False"""
+        with self._lock:
+            if self._records is None:
+                self._records = open(self.records_file, "rb")
+            self._records.seek(entry.offset)
+            data = self._records.read(entry.length)
+        record = json.loads(data)
+        return self.load_bodies(record) if bodies else record
+
+    def get(self, story_id: int) -> Optional[Dict]:
+        entry = self.find(story_id)
+        return self.read(entry) if entry else None
+
+    def iter_records(self, newest_first: bool = False) -> Iterator[Dict]:
+        for entry in self.entries(newest_first):
+            yield self.read(entry)
+
+    @contextmanager
+    def locked(self):
+        """
+        Exclusive write lock across threads and processes. Reentrant, so a
+        caller can hold it around append() and whatever it keeps in step with
+        the index (summary, search log, similarity rows).
+        """
+        with self._write_lock:
+            if not self._lock_depth:
+                # opened per acquisition: flock belongs to the open file, which a forked child would share
+                self._lock_handle = open(self.lock_file, "ab")
+                if fcntl is not None:
+                    fcntl.flock(self._lock_handle.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if not self._lock_depth:
+                    # closing the file releases the flock
+                    self._lock_handle.close()
+                    self._lock_handle = None
+
+    def append(self, record: Dict) -> Dict:
+        """
+        Write the record, then its index entry; a record without an entry is
+        never visible. A record with no id gets the next one in the store.
+        Bodies still inline are moved to the blob store first.
+        """
+        stored = self.store_bodies(record)
+        with self.locked():
+            count = len(self)
+            last_id = self.entry(count - 1).id if count else 0
+            if record.get("id") is None:
+                record["id"] = last_id + 1
+            elif record["id"] <= last_id:
+                raise ValueError(f"Story id {record['id']} is not above the last id {last_id}")
+            stored["id"] = record["id"]
+
+            data = json.dumps(stored, ensure_ascii=False).encode("utf-8") + b"\n"
+            with open(self.records_file, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            with open(self.index_file, "r+b") as f:
+                # a writer that died mid-entry leaves a partial entry; write over it
+                f.seek(INDEX_HEADER.size + count * INDEX_ENTRY.size)
+                f.write(index_entry_for(stored, offset, len(data) - 1))
+                f.truncate()
+        return record
+
+    def migrate_bodies(self) -> int:
+        """
+        Rewrite the record file with inline bodies moved to the blob store
+        (stores written before it existed). Positions and ids are unchanged.
+        Run it with no other process using the store: readers don't take the
+        lock, and the record file and index are swapped one after the other.
+        Returns the number of records rewritten.
+        """
+        moved = 0
+        with self.locked():
+            temp_records = f"{self.records_file}.{os.getpid()}.tmp"
+            temp_index = f"{self.index_file}.{os.getpid()}.tmp"
+            with open(temp_records, "wb") as records, open(temp_index, "wb") as index:
+                index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION))
+                for entry in self.entries():
+                    record = self.read(entry, bodies=False)
+                    stored = self.store_bodies(record)
+                    moved += stored != record
+                    data = json.dumps(stored, ensure_ascii=False).encode("utf-8") + b"\n"
+                    offset = records.tell()
+                    records.write(data)
+                    index.write(index_entry_for(stored, offset, len(data) - 1))
+            self.close()
+            os.replace(temp_records, self.records_file)
+            os.replace(temp_index, self.index_file)
+        return moved
+
+    def close(self):
+        with self._lock:
+            if self._records is not None:
+                self._records.close()
+                self._records = None
+        if self._blobs is not None:
+            self._blobs.close()
+        # dropped, not closed: another thread may be iterating over it
+        self._mapping = (None, 0)
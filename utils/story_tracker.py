@@ -1,34 +1,170 @@
+import html
 import json
 import os
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional
+from utils import metrics
+from utils.story_store import IndexEntry, StoryStore, indexed_count
 
 class StoryTracker:
     """
     Tracks generated stories with new evaluation schema and user feedback.
-    Stores data in JSON and generates HTML reports.
+    Stores records in an offset-indexed StoryStore and generates HTML reports.
     """
     
-    def __init__(self, storage_file: str = "story_metrics.json"):
+    def __init__(self, storage_file: str = "story_metrics.json", data_dir: str = None):
+        # the old single-file JSON history is imported into the store once
         self.storage_file = storage_file
-        self.stories = self._load_stories()
+        self.data_dir = data_dir or os.path.splitext(storage_file)[0] + "_store"
+        # running totals kept next to the index so startup reads one small file
+        self.summary_file = os.path.join(self.data_dir, "summary.json")
+        self._store = None
+        self._search_index = None
+        self._similarity_index = None
     
-    def _load_stories(self) -> List[Dict]:
-        """Load existing stories from JSON file"""
-        if os.path.exists(self.storage_file):
-            try:
-                with open(self.storage_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                return []
-        return []
+    @property
+    def store(self) -> StoryStore:
+        """Story store, opened on first use"""
+        if self._store is None:
+            self._store = StoryStore(self.data_dir)
+            # a summary is only written once the import has run, so an empty store with one has nothing to import
+            if not len(self._store) and not os.path.exists(self.summary_file):
+                # under the lock so two processes starting at once import the history once
+                with self._store.locked():
+                    if not len(self._store):
+                        self._import_legacy_stories()
+        return self._store
     
-    def _save_stories(self):
-        """Save stories to JSON file"""
-        with open(self.storage_file, 'w', encoding='utf-8') as f:
-            json.dump(self.stories, f, indent=2, ensure_ascii=False)
+    @property
+    def search_index(self):
+        """Full-text SearchIndex over the store (postings load on the first search)"""
+        if self._search_index is None:
+            from utils.search_index import SearchIndex
+            self._search_index = SearchIndex(self.store)
+        return self._search_index
     
-    def add_story(self, story: Dict, evaluation: Dict, user_request: str = "", user_liked: bool = False):
+    @property
+    def similarity_index(self):
+        """Request SimilarityIndex over the store, for spotting repeated requests"""
+        if self._similarity_index is None:
+            from utils.similarity_index import SimilarityIndex
+            self._similarity_index = SimilarityIndex(self.store)
+        return self._similarity_index
+    
+    def close(self):
+        """Release the store's file handles and maps and drop the indexes; they reopen on next use"""
+        # the store object itself is kept: its write lock may be held by another thread
+        if self._store is not None:
+            self._store.close()
+        self._search_index = None
+        self._similarity_index = None
+    
+    def _import_legacy_stories(self):
+        """Import stories from the old JSON file into an empty store"""
+        if not os.path.exists(self.storage_file):
+            return
+        try:
+            with open(self.storage_file, 'r', encoding='utf-8') as f:
+                stories = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return
+        
+        last_id = 0
+        for record in stories:
+            # ids must increase for the index's binary search
+            record["id"] = max(record.get("id", 0), last_id + 1)
+            last_id = record["id"]
+            self._store.append(record)
+    
+    def _summarize(self, entries: Iterable[IndexEntry]) -> Dict:
+        summary = {"count": 0, "passed": 0, "overall_sum": 0.0, "liked": 0}
+        for entry in entries:
+            self._add_to_summary(summary, entry)
+        return summary
+    
+    def _add_to_summary(self, summary: Dict, entry: IndexEntry):
+        summary["count"] += 1
+        summary["passed"] += entry.passed
+        summary["overall_sum"] += entry.overall
+        summary["liked"] += entry.liked
+    
+    def _read_summary(self) -> Optional[Dict]:
+        """The summary file if it is current, checked against the index size without opening the store"""
+        try:
+            with open(self.summary_file, 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+        except FileNotFoundError:
+            if not indexed_count(self.data_dir) and not os.path.exists(self.storage_file):
+                # nothing stored and nothing to import
+                return self._summarize(())
+            return None
+        except json.JSONDecodeError:
+            return None
+        return summary if summary.get("count") == indexed_count(self.data_dir) else None
+    
+    def _load_summary(self) -> Dict:
+        """Read the summary file, rebuilding it from the index if it is missing or stale; hold the store lock"""
+        summary = self._read_summary()
+        if summary is None:
+            summary = self._summarize(self.store.entries())
+            self._save_summary(summary)
+        return summary
+    
+    def summary(self) -> Dict:
+        """Running totals (count, passed, overall_sum, liked); safe from any thread or process"""
+        summary = self._read_summary()
+        if summary is None:
+            with self.store.locked():
+                summary = self._load_summary()
+        return summary
+    
+    def _save_summary(self, summary: Dict):
+        # write-rename, so a reader in another process never sees a half-written file
+        temp_file = f"{self.summary_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+        os.replace(temp_file, self.summary_file)
+    
+    def get_story(self, story_id: int) -> Optional[Dict]:
+        """Load one story record by id"""
+        return self.store.get(story_id)
+    
+    def iter_stories(self, newest_first: bool = False) -> Iterator[Dict]:
+        """Stream full story records, one body in memory at a time"""
+        return self.store.iter_records(newest_first)
+    
+    def refinement_history(self) -> Iterator[Dict]:
+        """Refinement outcomes for every story, read from the index only"""
+        for entry in self.store.entries():
+            yield entry.refinement()
+    
+    def search(self, query: str, limit: int = 10, **filters) -> List[Dict]:
+        """
+        Ranked keyword search with optional filters (see SearchIndex.search).
+        Returns full story records with a "search_score" added.
+        """
+        hits = []
+        for entry, score in self.search_index.search(query, limit=limit, **filters):
+            record = self.store.read(entry)
+            record["search_score"] = score
+            hits.append(record)
+        return hits
+    
+    def find_similar(self, user_request: str, story_elements: str = "", k: int = 3) -> List[Dict]:
+        """
+        Passing stories whose request reads most like this one, best first.
+        Returns full story records with a "similarity" (cosine, 0-1) added.
+        """
+        matches = []
+        for position, similarity in self.similarity_index.search(f"{user_request} {story_elements}", k=k):
+            record = self.store.read(self.store.entry(position))
+            record["similarity"] = similarity
+            matches.append(record)
+        return matches
+    
+    def add_story(self, story: Dict, evaluation: Dict, user_request: str = "", user_liked: bool = False,
+                  refinement: Dict = None, story_elements: str = "", outline: Dict = None):
         """
         Add a new story with evaluation and user feedback
         
@@ -37,6 +173,9 @@ class StoryTracker:
             evaluation: Full judge evaluation results with new schema
             user_request: Original user request
             user_liked: Whether user liked the story (Y/N)
+            refinement: RefinementLoop result (initial evaluation, rounds, stop reason)
+            story_elements: InputHandler's reading of the request
+            outline: StoryGenerator outline, kept so a similar request can reuse it
         """
         
         # Extract scores safely
@@ -44,9 +183,11 @@ class StoryTracker:
         
         # Create story record with new schema
         story_record = {
-            "id": len(self.stories) + 1,
+            # assigned by the store under its write lock
+            "id": None,
             "timestamp": datetime.now().isoformat(),
             "user_request": user_request,
+            "story_elements": story_elements,
             "user_liked": user_liked,
             "story": {
                 "title": story.get("title", "Untitled"),
@@ -67,28 +208,130 @@ class StoryTracker:
                 "overall": evaluation.get("overall", 0),
                 "feedback": evaluation.get("feedback", ""),
                 "length_check": evaluation.get("length_check", {})
-            }
+            },
+            "refinement": self._refinement_record(story, evaluation, refinement or {}),
+            "outline": outline or {}
         }
         
-        self.stories.append(story_record)
-        self._save_stories()
-        print(f"\n📝 Story #{story_record['id']} saved to {self.storage_file}")
+        from utils.search_index import document_terms
+        from utils.similarity_index import embed, request_text
+        
+        # tokenize, embed and compress the bodies first: only the writes below need to wait for other writers
+        started = time.perf_counter()
+        terms = document_terms(story_record)
+        vector = embed(request_text(story_record))
+        stored = self.store.store_bodies(story_record)
+        prepared = time.perf_counter()
+        # one lock around the append and everything kept in step with the index, so
+        # concurrent writers in other processes can't interleave summary updates or log lines
+        with self.store.locked():
+            summary = self._load_summary()
+            story_record["id"] = self.store.append(stored)["id"]
+            position = len(self.store) - 1
+            self._add_to_summary(summary, self.store.entry(position))
+            self._save_summary(summary)
+            self.search_index.add(position, story_record, terms=terms)
+            self.similarity_index.add(position, story_record, vector=vector)
+        metrics.TRACKER_WRITE_SECONDS.labels(phase="prepare").observe(prepared - started)
+        metrics.TRACKER_WRITE_SECONDS.labels(phase="commit").observe(time.perf_counter() - prepared)
+        metrics.STORIES_SAVED.labels(passed=str(story_record["evaluation"]["pass"]).lower()).inc()
+        print(f"\n📝 Story #{story_record['id']} saved to {self.data_dir}")
+    
+    def _refinement_record(self, story: Dict, evaluation: Dict, refinement: Dict) -> Dict:
+        """Initial vs refined scores, used to learn when refinement pays off"""
+        initial_evaluation = refinement.get("initial_evaluation") or evaluation
+        initial_overall = initial_evaluation.get("overall", 0)
+        attempted = refinement.get("rounds", 0) > 0
+        # the final evaluation is the best of the initial and refined drafts
+        refined_overall = evaluation.get("overall", 0) if attempted else None
+        return {
+            "attempted": attempted,
+            "rounds": refinement.get("rounds", 0),
+            "stop_reason": refinement.get("stop_reason", ""),
+            "skipped": refinement.get("skipped", False),
+            "predicted_win_rate": refinement.get("predicted_win_rate"),
+            "initial_scores": dict(initial_evaluation.get("scores") or {}),
+            "initial_overall": initial_overall,
+            "initial_word_count": refinement.get("initial_word_count") or len(story.get("story", "").split()),
+            "refined_overall": refined_overall,
+            "kept": attempted and refined_overall > initial_overall
+        }
     
     def generate_html_report(self, output_file: str = "story_report.html"):
         """Generate HTML report with new schema"""
         
-        if not self.stories:
+        summary = self.summary()
+        if not summary["count"]:
             print("No stories to display in report")
             return
         
         # Calculate summary stats
-        total_stories = len(self.stories)
-        avg_score = sum(s["evaluation"]["overall"] for s in self.stories) / total_stories
-        liked_count = sum(1 for s in self.stories if s.get("user_liked", False))
-        liked_pct = (liked_count / total_stories) * 100
-        passed_count = sum(1 for s in self.stories if s["evaluation"]["pass"])
+        total_stories = summary["count"]
+        avg_score = summary["overall_sum"] / total_stories
+        liked_pct = (summary["liked"] / total_stories) * 100
+        passed_count = summary["passed"]
+        analytics = self.analytics()
+        refinement = analytics.refinement()
+        
+        html_content = self._report_head_html("Generated bedtime stories with quality evaluation") + f"""
+    <div class="stats">
+        <div class="stat-card">
+            <div class="stat-number">{total_stories}</div>
+            <div>Total Stories</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">{avg_score:.1f}/10</div>
+            <div>Average Score</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">{liked_pct:.0f}%</div>
+            <div>User Liked</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">{passed_count}/{total_stories}</div>
+            <div>Stories Passed</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">{refinement["win_rate"]:.0f}%</div>
+            <div>Refinements Kept ({refinement["attempted"]} tried, avg +{refinement["average_gain"]})</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">{refinement["calls_saved"]}</div>
+            <div>LLM Calls Saved ({refinement["skipped"]} skipped, est. -{refinement["estimated_forgone_gain"]} each)</div>
+        </div>
+    </div>
+"""
+        html_content += analytics.render_html()
         
-        html_content = f"""
+        # Write HTML file, streaming stories newest first so only one is in memory
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+            for story in self.iter_stories(newest_first=True):
+                f.write(self._story_card_html(story))
+            f.write("""
+</body>
+</html>
+""")
+        
+        print(f"HTML report generated: {output_file}")
+    
+    def generate_search_report(self, query: str, hits: List[Dict], output_file: str = "search_report.html"):
+        """Report page with just the stories a search returned, best match first"""
+        subtitle = f'{len(hits)} stories matching "{html.escape(query)}"'
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(self._report_head_html(subtitle))
+            for story in hits:
+                f.write(self._story_card_html(story))
+            f.write("""
+</body>
+</html>
+""")
+        
+        print(f"Search report generated: {output_file}")
+    
+    def _report_head_html(self, subtitle: str) -> str:
+        """Document head, styles and page header shared by the report pages"""
+        return f"""
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -225,50 +468,60 @@ class StoryTracker:
             border-radius: 5px;
             margin: 15px 0;
         }}
+        .analytics {{
+            background: white;
+            padding: 20px;
+            border-radius: 10px;
+            margin-bottom: 30px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        }}
+        .analytics table {{
+            width: 100%;
+            border-collapse: collapse;
+            margin: 15px 0;
+        }}
+        .analytics th, .analytics td {{
+            padding: 8px;
+            text-align: left;
+            border-bottom: 1px solid #eee;
+        }}
+        .histogram {{
+            display: flex;
+            align-items: flex-end;
+            gap: 2px;
+            height: 40px;
+            width: 220px;
+        }}
+        .bar {{
+            flex: 1;
+            background: #667eea;
+            min-height: 1px;
+        }}
     </style>
 </head>
 <body>
     <div class="header">
         <h1>🌱 Beanstalk AI Story Report</h1>
-        <p>Generated bedtime stories with quality evaluation</p>
-    </div>
-    
-    <div class="stats">
-        <div class="stat-card">
-            <div class="stat-number">{total_stories}</div>
-            <div>Total Stories</div>
-        </div>
-        <div class="stat-card">
-            <div class="stat-number">{avg_score:.1f}/10</div>
-            <div>Average Score</div>
-        </div>
-        <div class="stat-card">
-            <div class="stat-number">{liked_pct:.0f}%</div>
-            <div>User Liked</div>
-        </div>
-        <div class="stat-card">
-            <div class="stat-number">{passed_count}/{total_stories}</div>
-            <div>Stories Passed</div>
-        </div>
+        <p>{subtitle}</p>
     </div>
 """
+    
+    def _story_card_html(self, story: Dict) -> str:
+        """HTML for one story card in the report"""
+        eval_data = story["evaluation"]
+        scores = eval_data.get("scores", {})
+        
+        # Format timestamp
+        timestamp = datetime.fromisoformat(story["timestamp"]).strftime("%Y-%m-%d %H:%M")
+        
+        # User feedback badge
+        user_feedback = "👍 Liked" if story.get("user_liked", False) else "👎 Not Liked"
         
-        # Add each story
-        for story in reversed(self.stories):  # Show newest first
-            eval_data = story["evaluation"]
-            scores = eval_data.get("scores", {})
-            
-            # Format timestamp
-            timestamp = datetime.fromisoformat(story["timestamp"]).strftime("%Y-%m-%d %H:%M")
-            
-            # User feedback badge
-            user_feedback = "👍 Liked" if story.get("user_liked", False) else "👎 Not Liked"
-            
-            # Pass/Fail badge
-            pass_status = "passed" if eval_data["pass"] else "failed"
-            pass_text = "✅ PASSED" if eval_data["pass"] else "❌ FAILED"
-            
-            html_content += f"""
+        # Pass/Fail badge
+        pass_status = "passed" if eval_data["pass"] else "failed"
+        pass_text = "✅ PASSED" if eval_data["pass"] else "❌ FAILED"
+        
+        card = f"""
     <div class="story-card">
         <div class="story-header">
             <div class="story-title">#{story["id"]}: {story["story"]["title"]}</div>
@@ -278,17 +531,17 @@ class StoryTracker:
             </div>
         </div>
 """
-            
-            # Safety check
-            if not eval_data.get("safety_passed", True):
-                html_content += f"""
+        
+        # Safety check
+        if not eval_data.get("safety_passed", True):
+            card += f"""
         <div class="safety-failed">
             🛡️ SAFETY FAILED: {eval_data.get("reason", "Unknown safety issue")}
         </div>
 """
-            else:
-                # Show scores
-                html_content += f"""
+        else:
+            # Show scores
+            card += f"""
         <div class="scores">
             <div class="score-item">
                 <div class="score-label">Bedtime Readiness</div>
@@ -316,46 +569,46 @@ class StoryTracker:
             </div>
         </div>
 """
-            
-            html_content += f"""
+        
+        card += f"""
         <div class="story-content">
             <div class="story-text">{story["story"]["content"]}</div>
             <div class="moral"><strong>Moral:</strong> {story["story"]["moral"]}</div>
 """
-            
-            # Add feedback if available
-            if eval_data.get("feedback"):
-                html_content += f"""
+        
+        # Add feedback if available
+        if eval_data.get("feedback"):
+            card += f"""
             <div class="feedback">
                 <strong>Judge Feedback:</strong> {eval_data["feedback"]}
             </div>
 """
-            
-            html_content += """
+        
+        card += """
         </div>
     </div>
 """
-        
-        html_content += """
-</body>
-</html>
-"""
-        
-        # Write HTML file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
-        print(f"HTML report generated: {output_file}")
+        return card
+    
+    def analytics(self):
+        """Vectorized StoryAnalytics over the index (NumPy is imported on first use)"""
+        from utils.analytics import StoryAnalytics
+        return StoryAnalytics.from_store(self.store)
+    
+    def get_refinement_stats(self) -> Dict:
+        """Calls saved by skipped refinements and the score change refinement produced"""
+        return self.analytics().refinement()
     
     def get_stats(self) -> Dict:
-        """Get summary statistics with user feedback"""
-        if not self.stories:
+        """Get summary statistics with user feedback (reads only the summary file when it is current)"""
+        summary = self.summary()
+        if not summary["count"]:
             return {"total": 0, "passed": 0, "average_score": 0, "pass_rate": 0, "liked_percentage": 0}
         
-        total = len(self.stories)
-        passed = sum(1 for s in self.stories if s["evaluation"]["pass"])
-        avg_score = sum(s["evaluation"]["overall"] for s in self.stories) / total
-        liked = sum(1 for s in self.stories if s.get("user_liked", False))
+        total = summary["count"]
+        passed = summary["passed"]
+        avg_score = summary["overall_sum"] / total
+        liked = summary["liked"]
         
         return {
             "total": total,
@@ -0,0 +1,184 @@
+"""
+Story history sharded by tenant.
+
+Each tenant (a family, or one user) gets a shard: a StoryTracker in its own
+directory, with its own record file, index, blob store, search and similarity
+indexes, summary, outline cache and fallback library, and its own write lock.
+Writers for different tenants never wait on each other or share a file, and
+a tenant's stats, search and reports read only that tenant's files.
+
+Layout under the store directory:
+
+    story_metrics_store/                        the "default" tenant: the single-user
+                                                history main.py has always kept
+    story_metrics_store/tenants/<ab>/<tenant>/  every other tenant; <ab> is the first
+                                                byte of the id's SHA-1, so no directory
+                                                holds more than a fraction of them
+
+TenantRouter opens shards on first use and keeps at most max_open of them
+open. When another is needed the least recently used idle one is closed
+(record handle, index and similarity maps, blob pack, search postings). A
+shard is busy while a caller holds it through using(tenant), e.g. for a
+whole menu session; busy shards are never closed, so more than max_open may
+be open while more tenants than that are served at once, and the surplus is
+closed as they go idle. A caller that kept a plain tracker() just reopens its
+files on next use. Opening a shard reads only its summary and index header,
+so a cold tenant costs a few file opens.
+
+Usage:
+    python main.py --tenant smith-family                 # or BEANSTALK_TENANT=smith-family
+    python -m utils.tenant_router list
+    python -m utils.tenant_router report smith-family    # writes story_report_smith-family.html
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from utils import metrics
+from utils.story_tracker import StoryTracker
+
+DEFAULT_TENANT = "default"
+TENANTS_DIR = "tenants"
+# usable as a directory name on every platform; user ids and emails fit
+TENANT_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.@-]{0,63}$")
+
+
+def tenant_dir(data_dir: str, tenant: str) -> str:
+    """Directory of a tenant's shard under the store directory"""
+    if tenant == DEFAULT_TENANT:
+        return data_dir
+    if not TENANT_ID.match(tenant):
+        raise ValueError(f"Invalid tenant id {tenant!r}: use up to 64 letters, digits, '_', '.', '@' or '-'")
+    fanout = hashlib.sha1(tenant.encode("utf-8")).hexdigest()[:2]
+    return os.path.join(data_dir, TENANTS_DIR, fanout, tenant)
+
+
+class TenantRouter:
+    """
+    StoryTracker per tenant, opened lazily and kept in an LRU of at most
+    max_open open shards, not counting busy ones (see using()). Thread-safe;
+    processes share shards through each store's file lock, as they share the
+    single store today.
+    """
+
+    def __init__(self, storage_file: str = "story_metrics.json", data_dir: str = None, max_open: int = 32):
+        # the default tenant is the tracker main.py has always used, legacy JSON import and all
+        self.storage_file = storage_file
+        self.data_dir = data_dir or os.path.splitext(storage_file)[0] + "_store"
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._open: "OrderedDict[str, StoryTracker]" = OrderedDict()
+        # callers inside using() per tenant; a shard with any is not closed
+        self._busy: Counter = Counter()
+
+    def _new_tracker(self, tenant: str) -> StoryTracker:
+        if tenant == DEFAULT_TENANT:
+            return StoryTracker(self.storage_file, data_dir=self.data_dir)
+        directory = tenant_dir(self.data_dir, tenant)
+        # no legacy file in a tenant's directory unless someone puts one there to import
+        return StoryTracker(os.path.join(directory, "story_metrics.json"), data_dir=directory)
+
+    def tracker(self, tenant: str = DEFAULT_TENANT) -> StoryTracker:
+        """The tenant's tracker, opening its shard (and closing the least recent idle one) if it isn't open"""
+        with self._lock:
+            return self._lookup(tenant or DEFAULT_TENANT)
+
+    @contextmanager
+    def using(self, tenant: str = DEFAULT_TENANT) -> Iterator[StoryTracker]:
+        """The tenant's tracker, kept open until the block ends"""
+        tenant = tenant or DEFAULT_TENANT
+        with self._lock:
+            tracker = self._lookup(tenant)
+            self._busy[tenant] += 1
+        try:
+            yield tracker
+        finally:
+            with self._lock:
+                self._busy[tenant] -= 1
+                if not self._busy[tenant]:
+                    del self._busy[tenant]
+                self._close_idle()
+
+    def _lookup(self, tenant: str) -> StoryTracker:
+        tracker = self._open.get(tenant)
+        if tracker is not None:
+            self._open.move_to_end(tenant)
+            metrics.TENANT_SHARD_LOOKUPS.labels(result="hit").inc()
+            return tracker
+
+        tracker = self._open[tenant] = self._new_tracker(tenant)
+        metrics.TENANT_SHARD_LOOKUPS.labels(result="open").inc()
+        self._close_idle()
+        return tracker
+
+    def _close_idle(self):
+        """Close least recent idle shards while more than max_open are open; the newest is kept"""
+        idle = [tenant for tenant in list(self._open)[:-1] if not self._busy[tenant]]
+        for tenant in idle[:max(0, len(self._open) - self.max_open)]:
+            self._open.pop(tenant).close()
+        metrics.TENANT_SHARDS_OPEN.set(len(self._open))
+
+    def tenants(self) -> Iterator[str]:
+        """Tenants with a shard on disk, default first; reads directory listings only"""
+        if os.path.exists(os.path.join(self.data_dir, "stories.idx")) or os.path.exists(self.storage_file):
+            yield DEFAULT_TENANT
+        root = os.path.join(self.data_dir, TENANTS_DIR)
+        if not os.path.isdir(root):
+            return
+        for fanout in sorted(os.listdir(root)):
+            for tenant in sorted(os.listdir(os.path.join(root, fanout))):
+                if os.path.exists(os.path.join(root, fanout, tenant, "stories.idx")):
+                    yield tenant
+
+    def stats(self) -> Dict[str, Dict]:
+        """get_stats() of every tenant, from each shard's summary file; shards are not kept open"""
+        stats = {}
+        for tenant in self.tenants():
+            with self._lock:
+                tracker = self._open.get(tenant)
+            if tracker is not None:
+                stats[tenant] = tracker.get_stats()
+                continue
+            tracker = self._new_tracker(tenant)
+            try:
+                stats[tenant] = tracker.get_stats()
+            finally:
+                tracker.close()
+        return stats
+
+    def close(self):
+        with self._lock:
+            for tracker in self._open.values():
+                tracker.close()
+            self._open.clear()
+            metrics.TENANT_SHARDS_OPEN.set(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List tenants or write one tenant's story report")
+    parser.add_argument("--data-dir", default="story_metrics_store", help="Tracker data directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Stories, pass rate and average score per tenant")
+    report = commands.add_parser("report", help="HTML report of one tenant's stories")
+    report.add_argument("tenant")
+    report.add_argument("--output", help="Report file (default: story_report_<tenant>.html)")
+    args = parser.parse_args()
+
+    router = TenantRouter(data_dir=args.data_dir)
+    if args.command == "list":
+        print(f"{'tenant':<40}{'stories':>9}{'pass %':>8}{'average':>9}")
+        for tenant, stats in router.stats().items():
+            print(f"{tenant:<40}{stats['total']:>9}{stats['pass_rate']:>8}{stats['average_score']:>9}")
+        return
+
+    router.tracker(args.tenant).generate_html_report(args.output or f"story_report_{args.tenant}.html")
+
+
+if __name__ == "__main__":
+    main()